@@ -14,6 +14,7 @@ import requests
 import binascii
 import logging
 import configparser
+from json import loads as json_loads
 
 from Crypto.Protocol.KDF import PBKDF2
 from Crypto.Hash import SHA256
@@ -21,11 +22,22 @@ from Crypto.Cipher import AES, PKCS1_OAEP
 from Crypto.PublicKey import RSA
 
 
+def _have_pyarrow():
+    # pyarrow is only needed for some return formats, so don't require it
+    try:
+        import pyarrow.ipc  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
 class FASTDBClient:
     short_query_url = 'db/runsqlquery/'
     submit_long_query_url = 'db/submitsqlquery/'
     check_long_sql_query_url = 'db/checksqlquery/'
     get_long_sql_query_results_url = 'db/getsqlqueryresults/'
+    arrow_mimetype = 'application/vnd.apache.arrow.stream'
+    npz_mimetype = 'application/x-npz'
 
     def __init__( self, server, username=None, password=None, login=True,
                   verify=None, retries=None, retrysleep=None, retrysleepinc=None,
@@ -165,7 +177,7 @@ class FASTDBClient:
             self.verify_logged_in()
 
 
-    def retry_send( self, url, data=None, json=None, method="post" ):
+    def retry_send( self, url, data=None, json=None, method="post", headers=None, stream=False ):
         """Send a python requests POST or GET to a web server with retries.
 
         You usually want to use .post(), or one of the more
@@ -185,6 +197,13 @@ class FASTDBClient:
           method : "get" or "post", default "post"
             Connection m ethod
 
+          headers : dict, default None
+            Additional HTTP headers to send
+
+          stream : bool, default False
+            Passed to python requests via stream=; if True, the body
+            of the response isn't read until you read it.
+
         Returns
         -------
           Python requests Response object.  Will raise an exception if
@@ -200,9 +219,11 @@ class FASTDBClient:
             res = None
             try:
                 if method == 'post':
-                    res = self.req.post( url, data=data, json=json, verify=self.verify )
+                    res = self.req.post( url, data=data, json=json, headers=headers, verify=self.verify,
+                                         stream=stream )
                 elif method == 'get':
-                    res = self.req.get( url, data=data, json=json, verify=self.verify )
+                    res = self.req.get( url, data=data, json=json, headers=headers, verify=self.verify,
+                                        stream=stream )
                 else:
                     raise ValueError( f"Unknown method {method}, must be get or post" )
                 if res.status_code != 200:
@@ -331,9 +352,15 @@ class FASTDBClient:
 
           return_format : str, default 'json'
             What do you want returned from the call to this function?
-            Can be one of 'json', 'csv', or 'raw'.  'raw' should always
-            work; other options will only work if the api endpoint
-            you're hitting is compatible.
+            Can be one of 'json', 'csv', 'arrow', 'pandas', 'numpy', or
+            'raw'.  'raw' should always work; other options will only
+            work if the api endpoint you're hitting is compatible.
+            'arrow', 'pandas', and 'numpy' ask the server (with an
+            Accept header) to send a table as an Apache Arrow stream
+            or a numpy .npz file rather than as JSON; endpoints that
+            return tables (e.g. ltcv/getltcv, ltcv/getltcvs,
+            ltcv/gethottransients, objectsearch, db/runsqlquery) can do
+            this.
 
 
         Returns
@@ -354,13 +381,30 @@ class FASTDBClient:
                     get the filename; you get the actual text.  Write it
                     to a file if you want a file.  [NOT CURRENTLY IMPLEMENTED]
 
+              arrow : a pyarrow.Table  (requires pyarrow)
+
+              pandas : a pandas.DataFrame  (requires pandas; uses Arrow
+                       if pyarrow is installed, otherwise .npz)
+
+              numpy : a dict of numpy arrays, one per column.  In this
+                      format, nulls become NaN in numeric columns (so
+                      integer columns with nulls come back as floats),
+                      '' in string columns, and False in bool columns.
+
         """
 
         if verifyloggedin:
             self.verify_logged_in()
 
+        headers = None
+        if return_format in ( 'arrow', 'pandas', 'numpy' ):
+            if ( return_format == 'numpy' ) or ( ( return_format == 'pandas' ) and ( not _have_pyarrow() ) ):
+                headers = { 'Accept': self.npz_mimetype }
+            else:
+                headers = { 'Accept': self.arrow_mimetype }
+
         slash = '/' if ( ( self.url[-1] != '/' ) and ( relative_url[0] != '/' ) ) else ''
-        res = self.retry_send( f'{self.url}{slash}{relative_url}', json=json )
+        res = self.retry_send( f'{self.url}{slash}{relative_url}', json=json, headers=headers )
 
         if return_format == 'raw':
             return res
@@ -374,6 +418,114 @@ class FASTDBClient:
         if return_format == 'csv':
             raise NotImplementedError( "CSV return format not yet implemented." )
 
+        if return_format in ( 'arrow', 'pandas', 'numpy' ):
+            return self._decode_table( res, return_format )
+
+        raise ValueError( f"Unknown return_format {return_format}" )
+
+
+    def post_stream( self, relative_url, json=None, verifyloggedin=True, return_format='json' ):
+        """Send a POST query to an endpoint that streams its response, and read it as it comes.
+
+        Use this with endpoints you've asked to stream (e.g. by passing
+        'stream': True in json to ltcv/gethottransients or
+        db/runsqlquery).  This is a generator, so you can work on the
+        beginning of the result while the server is still sending the
+        rest, and you never need to hold all of it in memory.
+
+        Parameters
+        ----------
+          relative_url, json, verifyloggedin : see post()
+
+          return_format : str, default 'json'
+            'json' to have the server send JSON lines; each thing
+            yielded is one row (usually a dict).  'arrow' or 'pandas'
+            to have the server send an Arrow stream; each thing
+            yielded is a pyarrow.RecordBatch or a pandas.DataFrame with
+            one chunk of rows.  (The latter two require pyarrow.)
+
+        Yields
+        ------
+          See return_format.  Raises a RuntimeError if the server hit
+          an error after it started sending.
+
+        """
+
+        if verifyloggedin:
+            self.verify_logged_in()
+
+        if return_format == 'json':
+            headers = None
+        elif return_format in ( 'arrow', 'pandas' ):
+            headers = { 'Accept': self.arrow_mimetype }
+        else:
+            raise ValueError( f"Unknown return_format {return_format}; must be json, arrow, or pandas" )
+
+        slash = '/' if ( ( self.url[-1] != '/' ) and ( relative_url[0] != '/' ) ) else ''
+        with self.retry_send( f'{self.url}{slash}{relative_url}', json=json, headers=headers, stream=True ) as res:
+            ctype = res.headers.get( 'Content-Type', '' )
+            if ctype[:16] == 'application/json':
+                # Errors found before the server started streaming may come back as a dictionary
+                data = res.json()
+                if isinstance( data, dict ) and ( data.get( 'status' ) == 'error' ):
+                    raise RuntimeError( f"Got an error from the server: {data.get('error')}" )
+                raise RuntimeError( "Asked for a stream, but the server sent back JSON; "
+                                    "maybe this endpoint doesn't stream?" )
+            if return_format == 'json':
+                if ctype[:20] != 'application/x-ndjson':
+                    raise RuntimeError( f"Expected JSON lines back from fastdb server, but got {ctype}" )
+                for line in res.iter_lines():
+                    if len( line ) == 0:
+                        continue
+                    row = json_loads( line )
+                    if ( isinstance( row, dict ) and ( set( row.keys() ) == { 'status', 'error' } )
+                         and ( row['status'] == 'error' ) ):
+                        raise RuntimeError( f"Got an error from the server: {row['error']}" )
+                    yield row
+            else:
+                if ctype != self.arrow_mimetype:
+                    raise RuntimeError( f"Expected an Arrow stream back from fastdb server, but got {ctype}" )
+                import pyarrow
+                import pyarrow.ipc
+                res.raw.decode_content = True
+                try:
+                    for batch in pyarrow.ipc.open_stream( res.raw ):
+                        yield batch.to_pandas() if return_format == 'pandas' else batch
+                except pyarrow.ArrowInvalid as ex:
+                    raise RuntimeError( f"Arrow stream from the server was cut off; the server probably "
+                                        f"hit an error.  ({ex})" )
+
+
+    def _decode_table( self, res, return_format ):
+        """Turn a response with an Arrow stream or a .npz file into what post() returns."""
+
+        ctype = res.headers.get( 'Content-Type', '' )
+        if ctype[:16] == 'application/json':
+            # Some endpoints send back an error dictionary (with status 200) rather than failing
+            data = res.json()
+            if isinstance( data, dict ) and ( data.get( 'status' ) == 'error' ):
+                raise RuntimeError( f"Got an error from the server: {data.get('error')}" )
+            raise RuntimeError( "Asked for a table, but the server sent back JSON; "
+                                "maybe this endpoint doesn't do binary tables?" )
+
+        if ctype == self.arrow_mimetype:
+            import pyarrow.ipc
+            table = pyarrow.ipc.open_stream( res.content ).read_all()
+            return table.to_pandas() if return_format == 'pandas' else table
+
+        if ctype == self.npz_mimetype:
+            import numpy
+            with numpy.load( io.BytesIO( res.content ), allow_pickle=False ) as npz:
+                arrays = { k: npz[k] for k in npz.files }
+            if return_format == 'numpy':
+                return arrays
+            if return_format == 'pandas':
+                import pandas
+                return pandas.DataFrame( arrays )
+            raise RuntimeError( f"Asked for {return_format}, but the server sent back {ctype}" )
+
+        raise RuntimeError( f"Don't know how to read a table of type {ctype}" )
+
 
     # ======================================================================
     # Methods for communicating with the db/ api for direct sql queries
@@ -444,8 +596,17 @@ class FASTDBClient:
             query, or fromt he last query in the list if a list of
             queries was sent.
 
+          'pandas', 'numpy', or 'arrow' : a pandas DataFrame, a
+            dictionary of {column: numpy array}, or a pyarrow Table.
+            These skip JSON entirely, so they're much faster for big
+            results.  See post() for how nulls come out in 'numpy'.
+
         """
 
+        if return_format in ( 'pandas', 'numpy', 'arrow' ):
+            json = self._parse_query( query, subdict, 0 )
+            return self.post( self.short_query_url, json=json, return_format=return_format )
+
         json = self._parse_query( query, subdict, return_format )
         data = self.post( self.short_query_url, json=json )
 
@@ -0,0 +1,16 @@
+-- Send a notification on channel fastdb_procver whenever processing
+--   versions or their aliases change, so that processes that cache them
+--   (see db.ProcessingVersionCache) know to reload.
+CREATE OR REPLACE FUNCTION notify_procver_change() RETURNS trigger AS $$
+BEGIN
+  PERFORM pg_notify( 'fastdb_procver', TG_TABLE_NAME );
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trig_procver_notify
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON processing_version
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_procver_change();
+CREATE TRIGGER trig_procveralias_notify
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON processing_version_alias
+  FOR EACH STATEMENT EXECUTE FUNCTION notify_procver_change();
@@ -0,0 +1,48 @@
+-- Per-object detection statistics.  This is derived entirely from
+--   diasource (one row per diaobjectid/processing_version of the
+--   sources), and is kept up to date by whatever loads sources (see
+--   db.DiaObjectDetStats.recompute).  It exists so that
+--   ltcv.object_search can filter on these things with index scans
+--   instead of aggregating diasource for every candidate object.
+CREATE TABLE diaobject_detstats(
+  diaobjectid bigint NOT NULL,
+  processing_version integer NOT NULL,
+  ndet integer NOT NULL,
+  firstdetmjd double precision NOT NULL,
+  lastdetmjd double precision NOT NULL,
+  nbandsdetected smallint NOT NULL,
+  bandsdetected text NOT NULL,
+  maxdetflux real NOT NULL,
+  maxdetfluxerr real NOT NULL,
+  maxdetfluxmjd double precision NOT NULL,
+  maxdetfluxband char NOT NULL,
+  lastdetflux real NOT NULL,
+  lastdetfluxerr real NOT NULL,
+  lastdetfluxmjd double precision NOT NULL,
+  lastdetfluxband char NOT NULL,
+
+  PRIMARY KEY (diaobjectid, processing_version)
+);
+CREATE INDEX idx_diaobject_detstats_ndet ON diaobject_detstats(processing_version, ndet);
+CREATE INDEX idx_diaobject_detstats_firstdet ON diaobject_detstats(processing_version, firstdetmjd);
+CREATE INDEX idx_diaobject_detstats_lastdet ON diaobject_detstats(processing_version, lastdetmjd);
+CREATE INDEX idx_diaobject_detstats_dt ON diaobject_detstats(processing_version, (lastdetmjd-firstdetmjd));
+CREATE INDEX idx_diaobject_detstats_nbands ON diaobject_detstats(processing_version, nbandsdetected);
+CREATE INDEX idx_diaobject_detstats_lastflux ON diaobject_detstats(processing_version, lastdetflux);
+ALTER TABLE diaobject_detstats ADD CONSTRAINT fk_diaobject_detstats_procver
+  FOREIGN KEY (processing_version) REFERENCES processing_version(id) ON DELETE CASCADE;
+
+INSERT INTO diaobject_detstats
+  SELECT diaobjectid, processing_version, COUNT(*),
+         MIN(midpointmjdtai), MAX(midpointmjdtai),
+         COUNT(DISTINCT band), string_agg(DISTINCT band::text, '' ORDER BY band::text),
+         (array_agg(psfflux ORDER BY psfflux DESC))[1],
+         (array_agg(psffluxerr ORDER BY psfflux DESC))[1],
+         (array_agg(midpointmjdtai ORDER BY psfflux DESC))[1],
+         (array_agg(band ORDER BY psfflux DESC))[1],
+         (array_agg(psfflux ORDER BY midpointmjdtai DESC))[1],
+         (array_agg(psffluxerr ORDER BY midpointmjdtai DESC))[1],
+         (array_agg(midpointmjdtai ORDER BY midpointmjdtai DESC))[1],
+         (array_agg(band ORDER BY midpointmjdtai DESC))[1]
+  FROM diasource
+  GROUP BY diaobjectid, processing_version;
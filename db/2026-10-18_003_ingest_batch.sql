@@ -0,0 +1,15 @@
+-- Every import of sources (SourceImporter.import_from_mongo, the SNANA
+--   loader) gets a row here, created (see db.IngestBatch.new) with
+--   the table locked right before the import commits.  That way,
+--   batches commit in order of id, so if you can see batch N, you
+--   can see everything from batches before it.
+CREATE TABLE ingest_batch(
+  id bigserial PRIMARY KEY,
+  t timestamp with time zone NOT NULL DEFAULT NOW(),
+  description text
+);
+
+-- The last ingest batch that added sources or forced sources to each object.
+--   Used by ltcv.get_hot_ltcvs to find just what changed since a previous call.
+ALTER TABLE diaobject_detstats ADD COLUMN last_ingest_batch bigint;
+CREATE INDEX idx_diaobject_detstats_ingest ON diaobject_detstats(processing_version, last_ingest_batch);
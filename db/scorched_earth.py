@@ -4,7 +4,7 @@ all_tables = [ 'authuser', 'passwordlink',
                'processing_version', 'processing_version_alias', 'snapshot',
                'host_galaxy', 'root_diaobject', 'diaobject', 'diasource', 'diaforcedsource',
                'diaobject_root_map', 'diaobject_snapshot', 'diasource_snapshot', 'diaforcedsource_snapshot',
-               'diasource_import_time', 'query_queue', 'migrations_applied',
+               'diasource_import_time', 'diaobject_detstats', 'ingest_batch', 'query_queue', 'migrations_applied',
                'spectruminfo', 'wantedspectra', 'plannedspectra',
                'ppdb_alerts_sent', 'ppdb_diaforcedsource', 'ppdb_diaobject', 'ppdb_diasource', 'ppdb_host_galaxy' ]
 
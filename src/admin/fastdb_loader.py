@@ -18,6 +18,7 @@ class FastDBLoader:
 
     with side-effects on
 
+        diaobject_detstats
         processing_version
         snapshot
         diasource_snapshot
@@ -28,7 +29,7 @@ class FastDBLoader:
     def __init__( self ):
         self._all_tables = [ 'wantedspectra', 'plannedspectra', 'spectruminfo',
                              'host_galaxy', 'root_diaobject', 'diaobject', 'diaobject_root_map',
-                             'diasource', 'diaforcedsource',
+                             'diasource', 'diaforcedsource', 'diaobject_detstats',
                              'processing_version_alias', 'processing_version', 'snapshot',
                              'diaobject_snapshot', 'diasource_snapshot', 'diaforcedsource_snapshot',
                              'ppdb_alerts_sent', 'ppdb_diaobject', 'ppdb_diaforcedsource', 'ppdb_diasource',
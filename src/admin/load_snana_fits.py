@@ -19,8 +19,8 @@ import astropy.table
 
 from fastdb_loader import FastDBLoader
 from util import NULLUUID
-from db import ( DB, HostGalaxy, DiaObject, DiaSource, DiaForcedSource,
-                 DiaObjectSnapshot, DiaSourceSnapshot, DiaForcedSourceSnapshot,
+from db import ( DB, load_all_table_meta, HostGalaxy, DiaObject, DiaSource, DiaForcedSource,
+                 DiaObjectDetStats, IngestBatch, DiaObjectSnapshot, DiaSourceSnapshot, DiaForcedSourceSnapshot,
                  PPDBDiaObject, PPDBHostGalaxy, PPDBDiaSource,PPDBDiaForcedSource )
 
 
@@ -198,7 +198,6 @@ class FITSFileHandler( ColumnMapper ):
                 hostgal.add_column( self.processing_version, name='processing_version' )
 
             # At this point, hostgal should be ready for feeding to bulk_insert_or_upsert
-            #   (onced processed through dict()).
 
             # Build the diaobject table in head
             self.diaobject_map_columns( head )
@@ -243,25 +242,26 @@ class FITSFileHandler( ColumnMapper ):
             if self.really_do:
                 with DB() as conn:
                     cls = PPDBHostGalaxy if self.ppdb else HostGalaxy
-                    nhost = cls.bulk_insert_or_upsert( dict(hostgal), assume_no_conflict=True, dbcon=conn )
+                    nhost = cls.bulk_insert_or_upsert( hostgal, assume_no_conflict=True, dbcon=conn )
                     self.logger.info( f"PID {os.getpid()} loaded {nhost} host galaxies from {headfile.name}" )
 
                     cls = PPDBDiaObject if self.ppdb else DiaObject
-                    q = cls.bulk_insert_or_upsert( dict(head), assume_no_conflict=True,
-                                                   dbcon=conn, nocommit=True )
+                    q = cls.bulk_insert_or_upsert( head, assume_no_conflict=True, dbcon=conn,
+                                                   nocommit=True, staging_table="temp_snana_diaobject" )
                     cursor = conn.cursor()
-                    cursor.execute( "UPDATE temp_bulk_upsert SET nearbyextobj1=NULL, nearbyextobj1id=NULL, "
-                                    "                            nearbyextobj1sep=NULL "
+                    cursor.execute( "UPDATE temp_snana_diaobject SET nearbyextobj1=NULL, nearbyextobj1id=NULL, "
+                                    "                                nearbyextobj1sep=NULL "
                                     "WHERE nearbyextobj1 <= 0" )
-                    cursor.execute( "UPDATE temp_bulk_upsert SET nearbyextobj2=NULL, nearbyextobj2id=NULL, "
-                                    "                            nearbyextobj2sep=NULL "
+                    cursor.execute( "UPDATE temp_snana_diaobject SET nearbyextobj2=NULL, nearbyextobj2id=NULL, "
+                                    "                                nearbyextobj2sep=NULL "
                                     "WHERE nearbyextobj2 <= 0" )
                     if 'nearbyextobj3' in head.columns:
-                        cursor.execute( "UPDATE temp_bulk_upsert SET nearbyextobj3=NULL, nearbyextobj3id=NULL, "
-                                        "                            nearbyextobj3sep=NULL "
+                        cursor.execute( "UPDATE temp_snana_diaobject SET nearbyextobj3=NULL, nearbyextobj3id=NULL, "
+                                        "                                nearbyextobj3sep=NULL "
                                         "WHERE nearbyextobj3 <= 0" )
                     cursor.execute( q )
                     nobj = cursor.rowcount
+                    cursor.execute( "DROP TABLE temp_snana_diaobject" )
                     conn.commit()
                     self.logger.info( f"PID {os.getpid()} loaded {nhost} hosts and {nobj} objects "
                                       f"from {headfile.name}" )
@@ -281,7 +281,7 @@ class FITSFileHandler( ColumnMapper ):
                     o_ss.add_column( self.snapshot, name='snapshot' )
 
                     if self.really_do:
-                        no_ss = DiaObjectSnapshot.bulk_insert_or_upsert( dict(o_ss), assume_no_conflict=True )
+                        no_ss = DiaObjectSnapshot.bulk_insert_or_upsert( o_ss, assume_no_conflict=True )
                         self.logger.info( f"PID {os.getpid()} loaded {no_ss} "
                                           f"DiaObjectSnapshot from {headfile.name}" )
                     else:
@@ -362,12 +362,15 @@ class FITSFileHandler( ColumnMapper ):
                 forcedphot = astropy.table.Table( phot )
                 forcedphot.remove_column( 'photflag' )
                 cls = PPDBDiaForcedSource if self.ppdb else DiaForcedSource
-                nfrc = cls.bulk_insert_or_upsert( dict(forcedphot), assume_no_conflict=True )
+                nfrc = cls.bulk_insert_or_upsert( forcedphot, assume_no_conflict=True )
                 self.logger.info( f"PID {os.getpid()} loaded {nfrc} forced photometry points from {photfile.name}" )
                 del forcedphot
+                # Tell the parent which objects got photometry, so it can update their detection stats
+                loadedobjids = np.unique( phot['diaobjectid'] )
             else:
                 nfrc = len(phot)
                 self.logger.info( f"PID {os.getpid()} would try to load {nfrc} forced photometry points" )
+                loadedobjids = np.array( [], dtype=np.int64 )
 
             # Load the diaforcedsource_snapshot table
             if not self.ppdb:
@@ -379,7 +382,7 @@ class FITSFileHandler( ColumnMapper ):
                     fs_ss.add_column( self.snapshot, name='snapshot' )
 
                     if self.really_do:
-                        nfs_ss = DiaForcedSourceSnapshot.bulk_insert_or_upsert( dict(fs_ss), assume_no_conflict=True )
+                        nfs_ss = DiaForcedSourceSnapshot.bulk_insert_or_upsert( fs_ss, assume_no_conflict=True )
                         self.logger.info( f"PID {os.getpid()} loaded {nfs_ss} "
                                           f"DiaForcedSourceSnapshot from {photfile.name}" )
                     else:
@@ -395,7 +398,7 @@ class FITSFileHandler( ColumnMapper ):
 
             if self.really_do:
                 cls = PPDBDiaSource if self.ppdb else DiaSource
-                nsrc = cls.bulk_insert_or_upsert( dict(phot), assume_no_conflict=True )
+                nsrc = cls.bulk_insert_or_upsert( phot, assume_no_conflict=True )
                 self.logger.info( f"PID {os.getpid()} loaded {nsrc} sources from {photfile.name}" )
             else:
                 nsrc = len(phot)
@@ -411,7 +414,7 @@ class FITSFileHandler( ColumnMapper ):
                     s_ss.add_column( self.snapshot, name='snapshot' )
 
                     if self.really_do:
-                        ns_ss = DiaSourceSnapshot.bulk_insert_or_upsert( dict(s_ss), assume_no_conflict=True )
+                        ns_ss = DiaSourceSnapshot.bulk_insert_or_upsert( s_ss, assume_no_conflict=True )
                         self.logger.info( f"PID {os.getpid()} loaded {ns_ss} DiaSourceSnapshot from {photfile.name}" )
                     else:
                         ns_ss = len( s_ss )
@@ -423,7 +426,8 @@ class FITSFileHandler( ColumnMapper ):
             else:
                 return { 'ok': True, 'msg': ( f"Loaded {nobj} objects, {nsrc} sources, {nfrc} forced, "
                                               f"{no_ss} object_snapshot, {nfs_ss} forced_snapshot, "
-                                              f"{ns_ss} source_snapshot" ) }
+                                              f"{ns_ss} source_snapshot" ),
+                         'diaobjectids': loadedobjids }
         except Exception:
             self.logger.error( f"Exception loading {headfile}: {traceback.format_exc()}" )
             return { "ok": False, "msg": traceback.format_exc() }
@@ -545,9 +549,15 @@ class FITSLoader( FastDBLoader ):
         if not self.dont_disable_indexes_fks:
             self.disable_indexes_and_fks()
 
+        # Ids of the objects that the loader processes put photometry in
+        loadedobjids = []
+
         # Do the long stuff
         try:
 
+            # Get the table metadata here so the subprocesses inherit it
+            load_all_table_meta()
+
             self.logger.info( f'Launching {self.nprocs} processes to load the db.' )
 
             def launchFITSFileHandler( pipe ):
@@ -606,6 +616,8 @@ class FITSLoader( FastDBLoader ):
                         donefiles.add( msg['headfile'] )
                         if msg['retval']['ok']:
                             self.logger.info( f"{msg['headfile']} done: {msg['retval']['msg']}" )
+                            if 'diaobjectids' in msg['retval']:
+                                loadedobjids.append( msg['retval']['diaobjectids'] )
                         else:
                             errfiles.add( msg['headfile'] )
                             self.logger.error( f"{msg['headfile']} failed {msg['retval']['msg']}" )
@@ -641,6 +653,30 @@ class FITSLoader( FastDBLoader ):
             if not self.dont_disable_indexes_fks:
                 self.recreate_indexes_and_fks()
 
+        # The loader processes just bulk copy sources, so update the
+        #   detection statistics of the objects they touched all at once
+        #   at the end.  (Do it after the indexes are back, as the upsert
+        #   needs the primary key.)  Only those objects get the new
+        #   ingest batch, so that get_hot_ltcvs( changed_since=... )
+        #   doesn't think everything else changed too.
+        if not self.ppdb:
+            objids = ( np.unique( np.concatenate( loadedobjids ) ) if len( loadedobjids ) > 0
+                       else np.array( [], dtype=np.int64 ) )
+            if len( objids ) == 0:
+                self.logger.info( "No objects loaded, not updating diaobject_detstats" )
+            else:
+                self.logger.info( f"Updating diaobject_detstats for {len(objids)} objects" )
+                with DB() as con:
+                    cursor = con.cursor()
+                    cursor.execute( "CREATE TEMP TABLE temp_snana_loaded( diaobjectid bigint, "
+                                    "                                 processing_version integer ) ON COMMIT DROP" )
+                    cursor.execute( "INSERT INTO temp_snana_loaded(diaobjectid,processing_version) "
+                                    "SELECT unnest(%(ids)s::bigint[]), %(pv)s",
+                                    { 'ids': objids.tolist(), 'pv': self.processing_version } )
+                    batch = IngestBatch.new( con, description=f"load_snana_fits {self.processing_version}" )
+                    n = DiaObjectDetStats.recompute( fromtable='temp_snana_loaded', ingest_batch=batch, dbcon=con )
+                self.logger.info( f"Updated detection stats for {n} objects" )
+
 
 # ======================================================================
 
@@ -1,24 +1,38 @@
 # IMPORTANT : make sure that everything in here stays synced with the
 #   database schema managed by migrations in ../db
 #
-# WARNING : code here will drop the table "temp_bulk_upsert" if you make it, so don't make that table.
+# WARNING : bulk_insert_or_upsert makes (and drops) temp tables named "temp_bulk_upsert_<hex>", so
+#   don't make tables with names like that.
 #
 # WARNING : code assumes all column names are lowercase.  Don't mix case in column names.
 
 # import sys
 import os
+import re
+import json
+import time
+import functools
+import hashlib
+import pathlib
 import uuid
+import threading
+import asyncio
 import collections
 import types
+import warnings
 
-from contextlib import contextmanager
+from contextlib import contextmanager, asynccontextmanager
 
 import numpy as np
 import psycopg
+import psycopg.pq
 import psycopg.rows
+import psycopg.sql
 import psycopg.types.json
 import pymongo
 
+import util
+
 
 # ======================================================================
 # Global config
@@ -53,32 +67,489 @@ dbname = config.dbdatabase
 
 # ======================================================================
 
-def get_dbcon():
+def get_dbcon( host=None, port=None ):
     """Get a database connection.
 
     It's your responsibility to roll it back, close it, etc!
 
     Consider using the DB context manager instead of this.
+
+    Parameters
+    ----------
+      host, port : str, int, or None
+        Connect to this database server instead of the one in the
+        config (config.dbhost and config.dbport).  Used for read-only
+        replicas (see DB()).
+
     """
 
     global dbuser, dbpasswd, dbhost, dbport, dbname
-    conn = psycopg.connect( dbname=dbname, user=dbuser, password=dbpasswd, host=dbhost, port=dbport )
+    conn = psycopg.connect( dbname=dbname, user=dbuser, password=dbpasswd,
+                            host=dbhost if host is None else host,
+                            port=dbport if port is None else port )
     return conn
 
 
+class ConnectionPool:
+    """A per-process pool of database connections.
+
+    Opening a connection to postgres means a TCP connection plus
+    authentication, which is a large fraction of the time of a short
+    query.  This keeps connections around after DB() is done with them
+    so the next DB() can reuse them.
+
+    Connections are rolled back and have their session state reset
+    (temp tables, session variables, etc. go away) when they are
+    returned to the pool.  A connection that has been
+    sitting idle for more than check_idle seconds is pinged before it's
+    handed out; if that fails (or if the connection is closed or broken
+    or otherwise in a weird state), it's thrown away and another one is
+    used.
+
+    The pool knows what process it was created in.  If it finds itself
+    in a different process (i.e. somebody forked), it forgets about all
+    the connections it had (without closing them, since they belong to
+    the parent process) and starts over.  This means it's safe to use
+    DB() both before and after multiprocessing forks.
+
+    There are at most max_open connections (checked out plus idle) at
+    once.  If they're all checked out, getconn waits up to timeout
+    seconds for one to be returned, and then raises a RuntimeError.
+    (So a single thread that nests more than max_open DB() calls will
+    fail rather than deadlock.)  If more than max_size connections are
+    checked out at once, the extras are closed when they're returned
+    rather than kept idle.  The first getconn in a process opens
+    min_size connections.
+
+    Don't make one of these yourself, use DB() (or get_dbpool() if
+    you really need to).
+
+    """
+
+    # This is everything DISCARD ALL does except for DEALLOCATE ALL.
+    #   psycopg keeps track of the statements it has prepared on a
+    #   connection, and gets very confused if they vanish out from
+    #   under it.  (Besides, keeping them around is a feature.)
+    _reset_session_query = ( "CLOSE ALL; SET SESSION AUTHORIZATION DEFAULT; RESET ALL; UNLISTEN *; "
+                             "SELECT pg_advisory_unlock_all(); DISCARD TEMP; DISCARD SEQUENCES" )
+
+    def __init__( self, connect=get_dbcon, min_size=0, max_size=10, max_open=None, timeout=30.,
+                  max_idle=600., check_idle=30. ):
+        """Create a pool.
+
+        Parameters
+        ----------
+          connect : callable
+            Function that returns a new psycopg.Connection
+
+          min_size : int, default 0
+            Open this many connections the first time a connection is
+            asked for, and keep at least this many idle connections
+            around, even if they've been idle for more than max_idle
+            seconds.
+
+          max_size : int, default 10
+            Keep at most this many idle connections.  If 0, then
+            connections are never reused.
+
+          max_open : int or None, default None
+            Never have more than this many connections open (checked
+            out plus idle) at once.  None means no limit.
+
+          timeout : float, default 30.
+            If max_open connections are checked out, how long getconn
+            waits for one to be returned before giving up.
+
+          max_idle : float, default 600.
+            Close connections that have been idle for longer than this
+            many seconds.
+
+          check_idle : float, default 30.
+            Ping connections that have been idle for longer than this
+            many seconds before handing them out.
+
+        """
+        self._connect = connect
+        self.min_size = int( min_size )
+        self.max_size = int( max_size )
+        self.max_open = None if max_open is None else int( max_open )
+        self.timeout = float( timeout )
+        self.max_idle = float( max_idle )
+        self.check_idle = float( check_idle )
+        if ( self.max_open is not None ) and ( self.max_open < max( self.min_size, 1 ) ):
+            raise ValueError( f"max_open ({self.max_open}) must be at least 1 and at least min_size "
+                              f"({self.min_size})" )
+        self._reset()
+
+    def _reset( self ):
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._cond = threading.Condition( self._lock )
+        # Each element is ( connection, time.monotonic() when returned to the pool )
+        self._idle = collections.deque()
+        # Connections checked out plus idle ones
+        self._nopen = 0
+        self._filled = False
+
+    def _fork_check( self ):
+        # Don't touch connections we inherited from a parent process.
+        #   In particular, don't close them, because that would close
+        #   the session that the parent is still using.
+        if os.getpid() != self._pid:
+            self._reset()
+            return False
+        return True
+
+    def _prune( self ):
+        # Must be called with self._lock held
+        now = time.monotonic()
+        toclose = []
+        while ( len( self._idle ) > self.min_size ) and ( now - self._idle[0][1] > self.max_idle ):
+            toclose.append( self._idle.popleft()[0] )
+        self._forget( len( toclose ) )
+        return toclose
+
+    def _forget( self, n=1 ):
+        # Must be called with self._lock held.  n connections that were
+        #   counted in self._nopen have been (or are about to be) closed.
+        if n > 0:
+            self._nopen = max( self._nopen - n, 0 )
+            self._cond.notify( n )
+
+    def _release( self, n=1 ):
+        with self._lock:
+            self._forget( n )
+
+    def _full( self ):
+        # Must be called with self._lock held
+        return ( self.max_open is not None ) and ( self._nopen >= self.max_open )
+
+    def _reserve( self ):
+        # Must be called with self._lock held.  Returns ( conn, t, nnew ):
+        #   an idle connection and when it went idle, or ( None, None,
+        #   nnew ) if we need to make nnew new connections (which have
+        #   been counted in self._nopen already).  nnew is 0 if the pool
+        #   is full.
+        if len( self._idle ) > 0:
+            conn, t = self._idle.pop()
+            return conn, t, 0
+        if self._full():
+            return None, None, 0
+        nnew = 1
+        if not self._filled:
+            # First time: make min_size connections (one for the caller, the rest go into the pool)
+            self._filled = True
+            nnew = max( nnew, self.min_size - self._nopen )
+        self._nopen += nnew
+        return None, None, nnew
+
+    def _timeout_error( self ):
+        return RuntimeError( f"Timed out after {self.timeout} s waiting for a database connection; "
+                             f"all {self.max_open} are in use" )
+
+    @staticmethod
+    def _close( conn ):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy( self, conn, idletime ):
+        if conn.closed or conn.broken:
+            return False
+        if conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+            return False
+        if idletime > self.check_idle:
+            try:
+                conn.autocommit = True
+                conn.execute( "SELECT 1" )
+                conn.autocommit = False
+            except Exception:
+                return False
+        return True
+
+    def getconn( self ):
+        """Get a connection from the pool, making a new one if necessary.
+
+        Waits (up to self.timeout seconds) if max_open connections are
+        already checked out.
+
+        """
+
+        self._fork_check()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                toclose = self._prune()
+                conn, t, nnew = self._reserve()
+                while ( conn is None ) and ( nnew == 0 ):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait( remaining )
+                    toclose.extend( self._prune() )
+                    conn, t, nnew = self._reserve()
+            for c in toclose:
+                self._close( c )
+            if ( conn is None ) and ( nnew == 0 ):
+                raise self._timeout_error()
+            if conn is None:
+                return self._open( nnew )
+            if self._healthy( conn, time.monotonic() - t ):
+                return conn
+            self._close( conn )
+            self._release()
+
+    def _open( self, nnew ):
+        # Make nnew connections (already counted in self._nopen); return
+        #   one and put the rest in the pool.
+        conns = []
+        try:
+            for i in range( nnew ):
+                conns.append( self._connect() )
+        except Exception:
+            self._release( nnew - len( conns ) )
+            if len( conns ) == 0:
+                raise
+            nnew = len( conns )
+        with self._lock:
+            now = time.monotonic()
+            for c in conns[1:]:
+                self._idle.append( ( c, now ) )
+            self._cond.notify( nnew - 1 )
+        return conns[0]
+
+    def putconn( self, conn ):
+        """Roll back a connection and return it to the pool (or close it if the pool is full)."""
+
+        if not self._fork_check():
+            return
+
+        try:
+            if not conn.closed:
+                conn.rollback()
+                conn.read_only = None
+                if self.max_size > 0:
+                    conn.autocommit = True
+                    conn.execute( self._reset_session_query )
+                    conn.autocommit = False
+        except Exception:
+            self._close( conn )
+            self._release()
+            return
+
+        if conn.closed or conn.broken:
+            self._release()
+            return
+
+        with self._lock:
+            toclose = self._prune()
+            if len( self._idle ) < self.max_size:
+                self._idle.append( ( conn, time.monotonic() ) )
+                self._cond.notify()
+                conn = None
+            else:
+                self._forget()
+        if conn is not None:
+            toclose.append( conn )
+        for c in toclose:
+            self._close( c )
+
+    def close( self ):
+        """Close all idle connections in the pool."""
+
+        if not self._fork_check():
+            return
+        with self._lock:
+            toclose = [ c for c, t in self._idle ]
+            self._idle.clear()
+            self._forget( len( toclose ) )
+        for c in toclose:
+            self._close( c )
+
+
+_dbpool = None
+_dbpool_lock = threading.Lock()
+
+
+def get_dbpool():
+    """Get this process' ConnectionPool, creating it if necessary."""
+
+    global _dbpool
+    if _dbpool is None:
+        with _dbpool_lock:
+            if _dbpool is None:
+                _dbpool = ConnectionPool( get_dbcon,
+                                          min_size=config.dbpool_min_size,
+                                          max_size=config.dbpool_max_size,
+                                          max_open=config.dbpool_max_open,
+                                          timeout=config.dbpool_timeout,
+                                          max_idle=config.dbpool_max_idle,
+                                          check_idle=config.dbpool_check_idle )
+    return _dbpool
+
+
+# ======================================================================
+# Read-only replicas
+#
+# config.dbreplicas is a list of "host" or "host:port" strings for
+#   streaming replicas of the primary database (config.dbhost).  (Same
+#   database name, user, and password as the primary.)  DB(readonly=True)
+#   hands out connections to these in turn.  If a replica can't be
+#   connected to, it's skipped for config.dbreplica_retry_secs seconds.
+#   If none of them work (or there aren't any), you get a connection to
+#   the primary.
+
+_replica_lock = threading.Lock()
+_replica_next = 0
+_replica_down_until = {}
+_replica_pools = {}
+
+
+def _parse_replica( replica ):
+    replica = str( replica )
+    if ':' in replica:
+        host, port = replica.rsplit( ':', 1 )
+        return host, int( port )
+    return replica, int( dbport )
+
+
+def replica_hosts():
+    """Return a list of ( host, port ) of the replicas that aren't known to be down.
+
+    Successive calls rotate which replica comes first, so just trying
+    them in order spreads the load around.
+
+    """
+    global _replica_next
+
+    replicas = [ _parse_replica( r ) for r in config.dbreplicas ]
+    if len( replicas ) == 0:
+        return []
+    with _replica_lock:
+        start = _replica_next % len( replicas )
+        _replica_next += 1
+        now = time.monotonic()
+        return [ r for r in replicas[start:] + replicas[:start] if _replica_down_until.get( r, 0. ) <= now ]
+
+
+def mark_replica_down( host, port ):
+    """Don't try the replica at ( host, port ) again for config.dbreplica_retry_secs seconds."""
+    with _replica_lock:
+        _replica_down_until[ ( host, port ) ] = time.monotonic() + config.dbreplica_retry_secs
+    util.logger.warning( f"Can't connect to database replica {host}:{port}, "
+                         f"not trying it for {config.dbreplica_retry_secs} s" )
+
+
+def connect_readonly( connect ):
+    """Connect to a read-only replica if possible, otherwise the primary.
+
+    Calls connect( host, port ) for each replica from replica_hosts()
+    until one doesn't raise a psycopg.OperationalError; replicas that
+    fail are marked as down.  If they all fail, calls connect( dbhost,
+    dbport ) and lets any exception through.  Returns whatever connect
+    returned.
+
+    You only need this if you're making connections yourself (e.g. as a
+    different database user); otherwise use DB( readonly=True ).
+
+    """
+    for host, port in replica_hosts():
+        try:
+            return connect( host, port )
+        except psycopg.OperationalError:
+            mark_replica_down( host, port )
+    return connect( dbhost, dbport )
+
+
+def get_replica_pool( host, port ):
+    """Get this process' ConnectionPool for the replica at ( host, port ), creating it if necessary."""
+
+    key = ( host, port )
+    if key not in _replica_pools:
+        with _dbpool_lock:
+            if key not in _replica_pools:
+                _replica_pools[key] = ConnectionPool( functools.partial( get_dbcon, host=host, port=port ),
+                                                      min_size=config.dbpool_min_size,
+                                                      max_size=config.dbpool_max_size,
+                                                      max_open=config.dbpool_max_open,
+                                                      timeout=config.dbpool_timeout,
+                                                      max_idle=config.dbpool_max_idle,
+                                                      check_idle=config.dbpool_check_idle )
+    return _replica_pools[key]
+
+
+def checkout_dbcon( readonly=False ):
+    """Get a connection from the right pool.
+
+    This is what DB() uses.  Only use it directly if you can't use a
+    context manager (e.g. the web server, which holds a connection for
+    the length of a request).
+
+    Parameters
+    ----------
+      readonly : bool, default False
+        If True, get a connection to a replica if there are any (see
+        above).  The connection is set to read only (even if it's to the
+        primary), so anything that tries to write, or that makes temp
+        tables, will fail.
+
+    Returns
+    -------
+      ( psycopg.Connection, ConnectionPool )
+
+      When you're done, give the connection back with pool.putconn( conn ).
+
+    """
+    if readonly:
+        def _getconn( host, port ):
+            isprimary = ( host, int( port ) ) == ( dbhost, int( dbport ) )
+            pool = get_dbpool() if isprimary else get_replica_pool( host, port )
+            return pool.getconn(), pool
+        conn, pool = connect_readonly( _getconn )
+        conn.read_only = True
+    else:
+        pool = get_dbpool()
+        conn = pool.getconn()
+        conn.read_only = None
+
+    if query_stats.enabled:
+        conn.cursor_factory = InstrumentedCursor
+        conn.server_cursor_factory = InstrumentedServerCursor
+    else:
+        conn.cursor_factory = psycopg.Cursor
+        conn.server_cursor_factory = HintedServerCursor
+
+    return conn, pool
+
+
 @contextmanager
-def DB( dbcon=None ):
+def DB( dbcon=None, readonly=False ):
     """Get a database connection in a context manager.
 
     Always call this as "with DB() as ..."
 
+    Connections come from a per-process pool (see ConnectionPool).  The
+    connection is rolled back and returned to the pool when it goes out
+    of scope, so make sure to commit anything you want to keep, and
+    don't hold on to the connection after the with block.
+
     Parameters
     ----------
        dbcon: psycopg.connection or None
           If not None, just returns that.  (Doesn't check the type, so
-          don't pass the wrong thing.)  Otherwise, makes a new
-          connection, and then rolls back and closes that connection
-          after it goes out of scope.
+          don't pass the wrong thing.)  Otherwise, gets a connection
+          from the pool, and then rolls back and returns that
+          connection to the pool after it goes out of scope.
+
+       readonly: bool, default False
+          If True, the connection will be to a read-only replica if
+          any are configured (see "Read-only replicas" above), and will
+          be read only even if it's to the primary.  Use this for heavy
+          queries that don't write anything (and don't make temp
+          tables), so they don't compete with ingestion.  Replicas can
+          lag the primary slightly, so don't use this to read back
+          something you just wrote.  Ignored if dbcon is not None.
 
     Returns
     -------
@@ -92,12 +563,752 @@ def DB( dbcon=None ):
 
     conn = None
     try:
-        conn = get_dbcon()
+        conn, pool = checkout_dbcon( readonly )
         yield conn
     finally:
         if conn is not None:
-            conn.rollback()
-            conn.close()
+            pool.putconn( conn )
+
+
+# ======================================================================
+# Query instrumentation
+#
+# Off by default.  Turn it on with config.dbquery_stats, or with
+#   db.query_stats.enable() at runtime.  When on, connections handed
+#   out by DB() make cursors that record how long each statement took
+#   and how many rows it returned (or changed) in db.query_stats.
+#   Statements that look the same except for constants and parameters
+#   are lumped together (see query_fingerprint).  Connections you make
+#   yourself (get_dbcon) and async connections (ADB) are not
+#   instrumented.
+
+# In order: comments (including pg_hint_plan hints), the uuid hex on the names of
+#   temp tables and cursors, string constants, query parameters, numbers, lists of
+#   constants, and whitespace.
+_fingerprint_subs = [ ( re.compile( r"/\*.*?\*/", re.DOTALL ), " " ),
+                      ( re.compile( r"--[^\n]*" ), " " ),
+                      ( re.compile( r"_[0-9a-f]{32}\b" ), "_?" ),
+                      ( re.compile( r"'(?:[^']|'')*'" ), "?" ),
+                      ( re.compile( r"%\(\w+\)s|%[sbt]|\$\d+" ), "?" ),
+                      ( re.compile( r"(?<![\w.])\d+(?:\.\d*)?(?:[eE][-+]?\d+)?" ), "?" ),
+                      ( re.compile( r"\?(?:\s*,\s*\?)+" ), "?,..." ),
+                      ( re.compile( r"\s+" ), " " ) ]
+
+
+@functools.lru_cache( maxsize=4096 )
+def query_fingerprint( query ):
+    """Normalize a SQL statement so that statements that differ only in constants and parameters match.
+
+    Comments (including pg_hint_plan hints) are removed, constants and
+    query parameters are replaced with ?, and whitespace is collapsed.
+
+    """
+    for regex, sub in _fingerprint_subs:
+        query = regex.sub( sub, query )
+    return query.strip()
+
+
+def _query_string( query, conn ):
+    if isinstance( query, str ):
+        return query
+    if isinstance( query, bytes ):
+        return query.decode( 'utf-8', errors='replace' )
+    return query.as_string( conn )
+
+
+class QueryStats:
+    """Per-process statistics on SQL statements run on connections from DB().
+
+    Use the module-level instance db.query_stats; don't make your own.
+
+    Attributes
+    ----------
+      enabled : bool
+        Whether connections handed out by DB() record statistics.
+        (Changing this only affects connections handed out afterwards.)
+
+      slow_query_secs : float or None
+        Log (at WARNING level, to util.logger) any statement that takes
+        at least this many seconds.  None means never.
+
+      explain_slow_queries : bool
+        If True, slow statements are re-run under EXPLAIN (ANALYZE,
+        BUFFERS) in a savepoint that is then rolled back, and the plan
+        is logged along with the statement.  This doubles the time of
+        every slow statement, so only turn it on when you're looking
+        for trouble.  It doesn't work for statements that can't be run
+        twice (e.g. SELECT ... INTO TEMP TABLE), for server-side cursors,
+        or on connections in autocommit mode.
+
+      slow_queries : collections.deque
+        The most recent (up to 100) slow statements, as dicts with keys
+        query, fingerprint, secs, rows, and plan (None if not explained).
+
+    """
+
+    def __init__( self, enabled=False, slow_query_secs=None, explain_slow_queries=False ):
+        self.enabled = enabled
+        self.slow_query_secs = slow_query_secs
+        self.explain_slow_queries = explain_slow_queries
+        self.reset()
+
+    def reset( self ):
+        """Forget everything that's been recorded."""
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.slow_queries = collections.deque( maxlen=100 )
+
+    def enable( self, slow_query_secs=None, explain_slow_queries=False ):
+        self.enabled = True
+        self.slow_query_secs = slow_query_secs
+        self.explain_slow_queries = explain_slow_queries
+
+    def disable( self ):
+        self.enabled = False
+
+    def record( self, fingerprint, secs, rows, calls=1 ):
+        """Add to the totals for a statement fingerprint."""
+        with self._lock:
+            stat = self._stats.get( fingerprint )
+            if stat is None:
+                self._stats[fingerprint] = [ calls, secs, secs, rows ]
+            else:
+                stat[0] += calls
+                stat[1] += secs
+                stat[2] = max( stat[2], secs )
+                stat[3] += rows
+
+    def summary( self, sortby='total_secs', limit=None ):
+        """Get the accumulated statistics.
+
+        Parameters
+        ----------
+          sortby : str, default 'total_secs'
+            One of the keys of the returned dicts; the list is sorted by
+            this, biggest first.
+
+          limit : int or None
+            Only return this many statements.
+
+        Returns
+        -------
+          list of dict, each with keys fingerprint, calls, total_secs,
+          mean_secs, max_secs, rows.  (Time spent fetching from
+          server-side cursors is included in total_secs, but max_secs
+          only considers the execute.)
+
+        """
+        with self._lock:
+            stats = [ { 'fingerprint': fp, 'calls': s[0], 'total_secs': s[1],
+                        'mean_secs': s[1] / s[0] if s[0] > 0 else 0., 'max_secs': s[2], 'rows': s[3] }
+                      for fp, s in self._stats.items() ]
+        stats.sort( key=lambda s: s[sortby], reverse=True )
+        return stats if limit is None else stats[:limit]
+
+    def log_summary( self, limit=20 ):
+        """Write the statements that took the most total time to util.logger at INFO level."""
+        strio = [ f"Top {limit} SQL statements by total time in process {os.getpid()}:" ]
+        for s in self.summary( limit=limit ):
+            strio.append( f"{s['total_secs']:10.3f}s {s['calls']:8d} calls {s['mean_secs']:9.4f}s mean "
+                          f"{s['max_secs']:9.4f}s max {s['rows']:10d} rows : {s['fingerprint']}" )
+        util.logger.info( "\n".join( strio ) )
+
+    def _executed( self, cursor, query, params, secs, rows, explain=True ):
+        querystr = _query_string( query, cursor.connection )
+        fingerprint = query_fingerprint( querystr )
+        self.record( fingerprint, secs, rows )
+        if ( self.slow_query_secs is not None ) and ( secs >= self.slow_query_secs ):
+            plan = None
+            if explain and self.explain_slow_queries:
+                plan = self._explain( cursor.connection, querystr, params )
+            self.slow_queries.append( { 'query': querystr, 'fingerprint': fingerprint,
+                                        'secs': secs, 'rows': rows, 'plan': plan } )
+            msg = f"Slow query ({secs:.3f}s, {rows} rows): {querystr}"
+            if plan is not None:
+                msg += f"\n{plan}"
+            util.logger.warning( msg )
+        return fingerprint
+
+    @staticmethod
+    def _explain( conn, querystr, params ):
+        if conn.autocommit:
+            return None
+        # Use a plain cursor so that this doesn't itself get recorded (and explained...)
+        with psycopg.Cursor( conn ) as cursor:
+            cursor.execute( "SAVEPOINT fastdb_explain" )
+            try:
+                cursor.execute( f"EXPLAIN (ANALYZE, BUFFERS) {querystr}", params )
+                return "\n".join( row[0] for row in cursor.fetchall() )
+            except Exception as ex:
+                return f"(Failed to EXPLAIN: {ex})"
+            finally:
+                cursor.execute( "ROLLBACK TO SAVEPOINT fastdb_explain" )
+                cursor.execute( "RELEASE SAVEPOINT fastdb_explain" )
+
+
+class InstrumentedCursor( psycopg.Cursor ):
+    """A cursor that records statement timings in db.query_stats.  DB() makes these when query_stats is enabled."""
+
+    def execute( self, query, params=None, **kwargs ):
+        t0 = time.perf_counter()
+        super().execute( query, params, **kwargs )
+        query_stats._executed( self, query, params, time.perf_counter() - t0, max( self.rowcount, 0 ) )
+        return self
+
+    def executemany( self, query, params_seq, **kwargs ):
+        t0 = time.perf_counter()
+        super().executemany( query, params_seq, **kwargs )
+        query_stats._executed( self, query, None, time.perf_counter() - t0, max( self.rowcount, 0 ), explain=False )
+
+
+_leading_hint_re = re.compile( r'^\s*(/\*\+.*?\*/)(.*)$', re.DOTALL )
+
+
+class HintedServerCursor( psycopg.ServerCursor ):
+    """A server-side cursor that pg_hint_plan hints still work on.
+
+    psycopg runs a server cursor's query as DECLARE "<name>" CURSOR FOR
+    <query>.  pg_hint_plan only notices a /*+ ... */ comment if there's
+    nothing before it but letters, digits, whitespace, and _,()[], so
+    the quotes around the cursor name would hide a hint at the start of
+    <query>.  This moves such a hint to the front of the DECLARE.
+    server_cursor() always makes one of these (or a subclass).
+
+    """
+
+    def _make_declare_statement( self, query ):
+        if isinstance( query, bytes ):
+            query = query.decode( self._encoding )
+        if isinstance( query, str ):
+            match = _leading_hint_re.match( query )
+            if match is not None:
+                declare = super()._make_declare_statement( match.group(2) )
+                return psycopg.sql.SQL( " " ).join( [ psycopg.sql.SQL( match.group(1) ), declare ] )
+        return super()._make_declare_statement( query )
+
+
+class InstrumentedServerCursor( HintedServerCursor ):
+    """A server-side cursor that records statement timings in db.query_stats.
+
+    The time to execute (i.e. DECLARE) counts as a call; the time and
+    rows of every subsequent fetch are added to the same statement.
+
+    """
+
+    def execute( self, query, params=None, **kwargs ):
+        t0 = time.perf_counter()
+        super().execute( query, params, **kwargs )
+        self._fingerprint = query_stats._executed( self, query, params, time.perf_counter() - t0, 0, explain=False )
+        return self
+
+    def _fetched( self, t0, rows ):
+        query_stats.record( self._fingerprint, time.perf_counter() - t0, rows, calls=0 )
+
+    def fetchone( self ):
+        t0 = time.perf_counter()
+        row = super().fetchone()
+        self._fetched( t0, 0 if row is None else 1 )
+        return row
+
+    def fetchmany( self, size=0 ):
+        t0 = time.perf_counter()
+        rows = super().fetchmany( size )
+        self._fetched( t0, len(rows) )
+        return rows
+
+    def fetchall( self ):
+        t0 = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched( t0, len(rows) )
+        return rows
+
+    def __iter__( self ):
+        while True:
+            rows = self.fetchmany( self.itersize )
+            if len( rows ) == 0:
+                return
+            yield from rows
+
+
+query_stats = QueryStats( enabled=config.dbquery_stats,
+                          slow_query_secs=config.dbslow_query_secs,
+                          explain_slow_queries=config.dbslow_query_explain )
+os.register_at_fork( after_in_child=query_stats.reset )
+
+
+# ======================================================================
+# asyncio versions of the connection stuff above
+
+async def get_async_dbcon():
+    """Get an async database connection.
+
+    It's your responsibility to roll it back, close it, etc!
+
+    Consider using the ADB context manager instead of this.
+    """
+
+    global dbuser, dbpasswd, dbhost, dbport, dbname
+    conn = await psycopg.AsyncConnection.connect( dbname=dbname, user=dbuser, password=dbpasswd,
+                                                  host=dbhost, port=dbport )
+    return conn
+
+
+class AsyncConnectionPool( ConnectionPool ):
+    """A per-process pool of psycopg.AsyncConnection.
+
+    Works just like ConnectionPool, except that getconn, putconn, and
+    close are coroutines.  The lock is only ever held while fiddling
+    with the list of idle connections, never across an await, so it's
+    fine to use from inside an event loop.  (For the same reason, when
+    all max_open connections are checked out, getconn polls for one to
+    come back rather than waiting on the lock's condition.)
+
+    Don't make one of these yourself, use ADB() (or get_async_dbpool()
+    if you really need to).
+
+    """
+
+    def __init__( self, connect=get_async_dbcon, **kwargs ):
+        super().__init__( connect, **kwargs )
+
+    @staticmethod
+    async def _close( conn ):
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def _healthy( self, conn, idletime ):
+        if conn.closed or conn.broken:
+            return False
+        if conn.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+            return False
+        if idletime > self.check_idle:
+            try:
+                await conn.set_autocommit( True )
+                await conn.execute( "SELECT 1" )
+                await conn.set_autocommit( False )
+            except Exception:
+                return False
+        return True
+
+    async def getconn( self ):
+        """Get a connection from the pool, making a new one if necessary."""
+
+        self._fork_check()
+        deadline = time.monotonic() + self.timeout
+        while True:
+            with self._lock:
+                toclose = self._prune()
+                conn, t, nnew = self._reserve()
+            for c in toclose:
+                await self._close( c )
+            if ( conn is None ) and ( nnew == 0 ):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timeout_error()
+                await asyncio.sleep( min( 0.01, remaining ) )
+                continue
+            if conn is None:
+                return await self._open( nnew )
+            if await self._healthy( conn, time.monotonic() - t ):
+                return conn
+            await self._close( conn )
+            self._release()
+
+    async def _open( self, nnew ):
+        conns = []
+        try:
+            for i in range( nnew ):
+                conns.append( await self._connect() )
+        except Exception:
+            self._release( nnew - len( conns ) )
+            if len( conns ) == 0:
+                raise
+        with self._lock:
+            now = time.monotonic()
+            for c in conns[1:]:
+                self._idle.append( ( c, now ) )
+        return conns[0]
+
+    async def putconn( self, conn ):
+        """Roll back a connection and return it to the pool (or close it if the pool is full)."""
+
+        if not self._fork_check():
+            return
+
+        try:
+            if not conn.closed:
+                await conn.rollback()
+                if self.max_size > 0:
+                    await conn.set_autocommit( True )
+                    await conn.execute( self._reset_session_query )
+                    await conn.set_autocommit( False )
+        except Exception:
+            await self._close( conn )
+            self._release()
+            return
+
+        if conn.closed or conn.broken:
+            self._release()
+            return
+
+        with self._lock:
+            toclose = self._prune()
+            if len( self._idle ) < self.max_size:
+                self._idle.append( ( conn, time.monotonic() ) )
+                conn = None
+            else:
+                self._forget()
+        if conn is not None:
+            toclose.append( conn )
+        for c in toclose:
+            await self._close( c )
+
+    async def close( self ):
+        """Close all idle connections in the pool."""
+
+        if not self._fork_check():
+            return
+        with self._lock:
+            toclose = [ c for c, t in self._idle ]
+            self._idle.clear()
+            self._forget( len( toclose ) )
+        for c in toclose:
+            await self._close( c )
+
+
+_async_dbpool = None
+
+
+def get_async_dbpool():
+    """Get this process' AsyncConnectionPool, creating it if necessary."""
+
+    global _async_dbpool
+    if _async_dbpool is None:
+        with _dbpool_lock:
+            if _async_dbpool is None:
+                _async_dbpool = AsyncConnectionPool( min_size=config.dbpool_min_size,
+                                                     max_size=config.dbpool_max_size,
+                                                     max_open=config.dbpool_max_open,
+                                                     timeout=config.dbpool_timeout,
+                                                     max_idle=config.dbpool_max_idle,
+                                                     check_idle=config.dbpool_check_idle )
+    return _async_dbpool
+
+
+@asynccontextmanager
+async def ADB( dbcon=None ):
+    """Get an async database connection in a context manager.
+
+    Always call this as "async with ADB() as ..."
+
+    This is the asyncio version of DB(); see that for more.  A
+    psycopg.AsyncConnection can only run one query at a time, so to run
+    queries concurrently (e.g. with asyncio.gather), give each one its
+    own ADB().
+
+    The pool is per-process, not per-event-loop.  If you use more than
+    one event loop in a process (e.g. by calling asyncio.run() more than
+    once), it's safest to call "await get_async_dbpool().close()" before
+    each loop finishes so that no connection outlives its loop.
+
+    Parameters
+    ----------
+       dbcon: psycopg.AsyncConnection or None
+          If not None, just returns that.  Otherwise, gets a connection
+          from the pool, and then rolls back and returns that
+          connection to the pool after it goes out of scope.
+
+    Returns
+    -------
+       psycopg.AsyncConnection
+
+    """
+
+    if dbcon is not None:
+        yield dbcon
+        return
+
+    conn = None
+    pool = get_async_dbpool()
+    try:
+        conn = await pool.getconn()
+        yield conn
+    finally:
+        if conn is not None:
+            await pool.putconn( conn )
+
+
+# ======================================================================
+# Server-side cursors
+
+def server_cursor( con, fetch_size=None, binary=False ):
+    """Make a named (server-side) cursor on a connection.
+
+    Use this instead of con.cursor() for queries that might return a
+    lot of rows.  The rows stay on the server until you ask for them,
+    and iterating over the cursor (or using iter_batches) fetches
+    fetch_size rows at a time, so client memory doesn't grow with the
+    size of the result.
+
+    The cursor only lives as long as the transaction it's in, so don't
+    commit or roll back the connection until you're done reading.  (If
+    the connection is in autocommit mode, the cursor is made WITH HOLD,
+    which works, but postgres then builds the whole result before
+    returning anything.)  It's also a context manager; use it in a
+    "with" so that it gets closed.
+
+    The cursor is a HintedServerCursor, so pg_hint_plan hints at the
+    start of the query work.
+
+    Parameters
+    ----------
+      con : psycopg.Connection
+        The connection.
+
+      fetch_size : int or None
+        Number of rows to pull from the server at a time.  Defaults to
+        config.db_fetch_size.
+
+      binary : bool, default False
+        Make a binary cursor.
+
+    Returns
+    -------
+      HintedServerCursor
+
+    """
+    factory = con.server_cursor_factory
+    if not issubclass( factory, HintedServerCursor ):
+        factory = HintedServerCursor
+    cursor = factory( con, name=f"fastdb_cursor_{uuid.uuid4().hex}", row_factory=con.row_factory,
+                      withhold=con.autocommit )
+    if binary:
+        cursor.format = psycopg.pq.Format.BINARY
+    cursor.itersize = config.db_fetch_size if fetch_size is None else int( fetch_size )
+    return cursor
+
+
+def iter_batches( cursor, fetch_size=None ):
+    """Yield lists of rows from a cursor that has had a query executed.
+
+    Each list has (at most) fetch_size rows (default: the cursor's
+    itersize if it has one, otherwise config.db_fetch_size).  Meant to
+    be used with a cursor from server_cursor(), in which case only one
+    batch of rows is ever in memory at a time.
+
+    """
+    if fetch_size is None:
+        fetch_size = getattr( cursor, 'itersize', config.db_fetch_size )
+    while True:
+        rows = cursor.fetchmany( fetch_size )
+        if len( rows ) == 0:
+            return
+        yield rows
+
+
+# ======================================================================
+# Processing versions
+#
+# Lots of things need to turn a processing version description or alias
+#   into an id.  Use procver_id() for that.  It caches the (small)
+#   processing_version and processing_version_alias tables in each
+#   process, so it usually doesn't need to talk to the database.
+#
+# A trigger (see db/2026-10-18_001_procver_notify.sql) sends a NOTIFY on
+#   channel fastdb_procver whenever either table changes, and each
+#   process keeps one connection LISTENing for that.  Checking for a
+#   notification just reads whatever the server has already sent on
+#   that connection's socket, so it doesn't need a round trip.  When
+#   there is a notification, the cache is thrown away and reloaded.  As
+#   a backstop (e.g. if the listening connection can't be made, or dies
+#   silently), the cache is also reloaded after config.procver_cache_ttl
+#   seconds.
+
+class ProcessingVersionCache:
+    """In-process cache of processing versions and their aliases.
+
+    Use the module-level instance db.procver_cache (or just procver_id());
+    don't make your own.
+
+    """
+
+    channel = 'fastdb_procver'
+
+    def __init__( self, ttl=300. ):
+        self.ttl = float( ttl )
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._listener = None
+        self._listen_retry = 0.
+        self._byname = None
+        self._descriptions = None
+        self._aliases = None
+        self._expires = 0.
+
+    def invalidate( self ):
+        """Throw away the cache, so it gets reloaded next time it's used."""
+        with self._lock:
+            self._byname = None
+
+    def _close_listener( self ):
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except Exception:
+                pass
+            self._listener = None
+
+    def _still_good( self ):
+        # Must be called with self._lock held.  Returns False if the cache must be reloaded.
+
+        if os.getpid() != self._pid:
+            # We've forked.  The listener belongs to the parent, so don't touch it.
+            self._pid = os.getpid()
+            self._listener = None
+            self._listen_retry = 0.
+            return False
+
+        now = time.monotonic()
+        good = ( self._byname is not None ) and ( now < self._expires )
+
+        if self._listener is not None:
+            try:
+                pgconn = self._listener.pgconn
+                pgconn.consume_input()
+                while pgconn.notifies() is not None:
+                    good = False
+                if pgconn.status != psycopg.pq.ConnStatus.OK:
+                    raise RuntimeError( "listener connection is dead" )
+            except Exception:
+                self._close_listener()
+                good = False
+
+        if ( self._listener is None ) and ( now >= self._listen_retry ):
+            # Have to start listening before loading, or we might miss a change.
+            try:
+                conn = get_dbcon()
+                conn.autocommit = True
+                conn.execute( f"LISTEN {self.channel}" )
+                self._listener = conn
+            except Exception as ex:
+                util.logger.warning( f"Failed to LISTEN for processing version changes ({ex}); "
+                                     f"will just reload the cache every {self.ttl} s" )
+                self._listen_retry = now + self.ttl
+            good = False
+
+        return good
+
+    def _load( self, dbcon=None ):
+        # Must be called with self._lock held
+        with DB( dbcon ) as con:
+            cursor = con.cursor()
+            cursor.execute( "SELECT id, description, FALSE FROM processing_version "
+                            "UNION ALL "
+                            "SELECT id, description, TRUE FROM processing_version_alias" )
+            rows = cursor.fetchall()
+
+        descriptions = {}
+        aliases = collections.defaultdict( list )
+        for pvid, desc, isalias in rows:
+            if isalias:
+                aliases[ pvid ].append( desc )
+            else:
+                descriptions[ pvid ] = desc
+        # Descriptions win if an alias is the same as a description
+        byname = { a: pvid for pvid, al in aliases.items() for a in al }
+        byname.update( { desc: pvid for pvid, desc in descriptions.items() } )
+
+        self._descriptions = descriptions
+        self._aliases = { pvid: sorted( al ) for pvid, al in aliases.items() }
+        self._byname = byname
+        self._expires = time.monotonic() + self.ttl
+
+    def _tables( self, dbcon=None, reload=False ):
+        with self._lock:
+            if ( not self._still_good() ) or reload:
+                self._load( dbcon )
+            return self._byname, self._descriptions, self._aliases
+
+    def _find( self, pvid, name, dbcon=None ):
+        # Returns the id (or None) of processing version with id pvid or description or alias name.  If it's not
+        #   found, reloads and tries again, in case it's new and the notification hasn't gotten here yet.
+        for reload in ( False, True ):
+            byname, descriptions, _ = self._tables( dbcon, reload=reload )
+            if ( pvid is not None ) and ( pvid in descriptions ):
+                return pvid
+            if ( name is not None ) and ( name in byname ):
+                return byname[ name ]
+        return None
+
+    def id( self, processing_version, must_exist=False, dbcon=None ):
+        """Get the id of a processing version.
+
+        Parameters
+        ----------
+          processing_version : int or str
+            The id, description, or alias of a processing version.  A
+            string that's an integer is an id.
+
+          must_exist : bool, default False
+            Normally, an integer (or a string that is an integer) is
+            just returned as an int without checking anything.  If this
+            is True, make sure it's the id of a processing version; if
+            it's not, and it's a string, look it up as a description or
+            alias.  Pass True for anything that came from a user (e.g. a
+            web request), so that an unknown id is an error rather than
+            an empty result.
+
+          dbcon : psycopg.Connection or None
+            Database connection to use if the cache needs (re)loading.
+
+        Returns
+        -------
+          int
+
+          Raises ValueError if processing_version isn't known.
+
+        """
+        try:
+            pvid = int( processing_version )
+        except ( TypeError, ValueError ):
+            pvid = None
+        if ( pvid is not None ) and ( not must_exist ):
+            return pvid
+
+        found = self._find( pvid, processing_version if isinstance( processing_version, str ) else None, dbcon )
+        if found is None:
+            raise ValueError( f"Unknown processing version {processing_version}" )
+        return found
+
+    def description( self, pvid, dbcon=None ):
+        """Get the description of processing version with id pvid, or None if there isn't one."""
+        if self._find( pvid, None, dbcon ) is None:
+            return None
+        return self._tables( dbcon )[1].get( pvid )
+
+    def aliases( self, pvid, dbcon=None ):
+        """Get a (sorted) list of the aliases of processing version with id pvid."""
+        self._find( pvid, None, dbcon )
+        return list( self._tables( dbcon )[2].get( pvid, [] ) )
+
+    def descriptions( self, dbcon=None ):
+        """Get a dict of { id: description } of all processing versions."""
+        return dict( self._tables( dbcon )[1] )
+
+    def all_aliases( self, dbcon=None ):
+        """Get a dict of { alias: id } of all processing version aliases."""
+        byname, descriptions, aliases = self._tables( dbcon )
+        return { a: pvid for pvid, al in aliases.items() for a in al }
+
+
+procver_cache = ProcessingVersionCache( ttl=config.procver_cache_ttl )
+
+
+def procver_id( processing_version, must_exist=False, dbcon=None ):
+    """Turn a processing version id, description, or alias into an id.  See ProcessingVersionCache.id."""
+    return procver_cache.id( processing_version, must_exist=must_exist, dbcon=dbcon )
 
 
 # ======================================================================
@@ -173,6 +1384,8 @@ class ColumnMeta:
         'integer': np.int32,
         'bigint': np.int64,
         'text': str,
+        'character': str,
+        'character varying': str,
         'jsonb': dict,
         'boolean': bool,
         'real': np.float32,
@@ -207,6 +1420,19 @@ class ColumnMeta:
     def pytype( self ):
         return self.typedict[ self.data_type ]
 
+    @property
+    def npdtype( self ):
+        """The numpy dtype for an array of values from this column.
+
+        Numbers, booleans, and text get real numpy dtypes; everything
+        else (including things not in typedict) is object.
+
+        """
+        pytype = self.typedict.get( self.data_type, object )
+        if ( pytype is bool ) or ( pytype is str ) or issubclass( pytype, np.generic ):
+            return np.dtype( pytype )
+        return np.dtype( object )
+
 
     def py_to_pg( self, pyobj ):
         """Convert a python object to the corresponding postgres object for this column.
@@ -231,6 +1457,16 @@ class ColumnMeta:
         return pyobj
 
 
+    @property
+    def pg_to_py_is_identity( self ):
+        """True if pg_to_py doesn't do anything, so you can skip calling it."""
+        if 'pg_to_py' in self.__dict__:
+            # DBBase.load_table_meta replaced it because of a colconverter
+            return False
+        dt = self.element_type if self.data_type == "ARRAY" else self.data_type
+        return ( dt not in self.typeconverters ) or ( self.typeconverters[dt][1] is None )
+
+
     def pg_to_py( self, pgobj ):
         """Convert a postgres object to python object for this column.
 
@@ -261,31 +1497,545 @@ class ColumnMeta:
 
 
 # ======================================================================
-# ogod, it's like I'm writing my own ORM, and I hate ORMs
+# Binary COPY
 #
-# But, two things.  (1) I'm writing it, so I know actually what it's doing
-#   backend with the PostgreSQL queries, (2) I'm not trying to create a whole
-#   new language to learn in place of SQL, I still intend mostly to just use
-#   SQL, and (3) sometimes it's worth re-inventing the wheel so that you get
-#   just a wheel (and also so that you really get a wheel and not massive tank
-#   treads that you are supposed to think act like a wheel)
+# Postgres' binary COPY format is: a header; then, for each row, a
+# 16-bit field count followed by each field as a 32-bit length (-1 for
+# NULL) and that many bytes of the field in the type's binary "send"
+# format; and then a 16-bit -1 as a trailer.  All integers are
+# big-endian.  (See https://www.postgresql.org/docs/current/sql-copy.html )
+#
+# The functions here build that straight out of numpy arrays, so bulk
+# loads of columnar data never have to look at individual rows in
+# Python.  Only the column types below are supported; for anything
+# else (jsonb, arrays, ...), or for data numpy can't turn into the
+# right thing, we raise _NoBinaryCopy and the caller falls back to text
+# COPY.
 
-class DBBase:
-    """A base class from which all other table classes derive themselves.
+_pgcopy_header = b'PGCOPY\n\xff\r\n\x00' + b'\x00\x00\x00\x00' + b'\x00\x00\x00\x00'
+_pgcopy_trailer = b'\xff\xff'
 
-    All subclasses must include:
+# Microseconds from the unix epoch to the postgres epoch (2000-01-01)
+_pg_epoch_us = 946684800000000
 
-    __tablename__ = "<name of table in databse>"
-    _tablemeta = None
-    _pk = <list>
+_pgbinary_ints = { 'smallint': '>i2', 'integer': '>i4', 'bigint': '>i8' }
+_pgbinary_floats = { 'real': '>f4', 'double precision': '>f8' }
+_pgbinary_texts = { 'text', 'character', 'character varying' }
+_pgbinary_timestamps = { 'timestamp with time zone', 'timestamp without time zone' }
 
-    _pk must be a list of strings with the names of the primary key
-    columns.  Uusally (but not always) this will be a single-element
-    list.
 
-    """
+class _NoBinaryCopy( Exception ):
+    pass
 
-    # A dictionary of "<colum name>": <2-element tuple>
+
+def _columnar_data( data ):
+    """Pull columns out of columnar data.
+
+    Returns ( columns, arrays ) if data is a numpy structured array, a
+    pandas DataFrame, an astropy Table, or a dict of numpy arrays
+    (astropy Columns count).  arrays is a list of things that
+    _column_values_and_nulls can handle.  Returns None if data is
+    anything else.
+
+    """
+    if isinstance( data, np.ndarray ):
+        if data.dtype.names is None:
+            raise TypeError( "numpy arrays must be structured arrays to be used as table data" )
+        return list( data.dtype.names ), [ data[c] for c in data.dtype.names ]
+    if hasattr( data, 'colnames' ):
+        # astropy Table
+        return list( data.colnames ), [ data[c] for c in data.colnames ]
+    if hasattr( data, 'columns' ) and hasattr( data, 'iloc' ):
+        # pandas DataFrame
+        return [ str(c) for c in data.columns ], [ data[c] for c in data.columns ]
+    if isinstance( data, dict ) and all( isinstance( v, np.ndarray ) for v in data.values() ):
+        return list( data.keys() ), list( data.values() )
+    return None
+
+
+def _data_nrows( data ):
+    """Number of rows in a list of rows, a dict of lists, or columnar data.
+
+    (len() of a dict of columns is the number of columns, not rows.)
+
+    """
+    columnar = _columnar_data( data )
+    if columnar is not None:
+        return 0 if len( columnar[1] ) == 0 else len( columnar[1][0] )
+    if isinstance( data, dict ):
+        return 0 if len( data ) == 0 else len( next( iter( data.values() ) ) )
+    return len( data )
+
+
+def _column_values_and_nulls( col ):
+    """Return ( numpy array, boolean array of which values are NULL or None if none are ).
+
+    col can be a numpy array, a numpy masked array (including astropy
+    Column and MaskedColumn), or a pandas Series.  Masked values, None,
+    pandas NA and NaT are all NULL.  Floating-point NaN is *not* NULL
+    (except in pandas object or extension columns, where NaN is how
+    pandas says "missing").
+
+    """
+    nulls = None
+    if hasattr( col, 'isna' ) and hasattr( col, 'to_numpy' ):
+        # pandas Series
+        if getattr( col.dtype, 'tz', None ) is not None:
+            nulls = col.isna().to_numpy()
+            col = col.dt.tz_convert( 'UTC' ).dt.tz_localize( None ).to_numpy()
+        elif isinstance( col.dtype, np.dtype ) and ( col.dtype.kind != 'O' ):
+            col = col.to_numpy()
+        else:
+            nulls = col.isna().to_numpy()
+            col = col.to_numpy( dtype=object, na_value=None )
+    elif np.ma.isMaskedArray( col ):
+        nulls = np.ma.getmaskarray( col )
+        col = np.ma.getdata( col )
+
+    arr = np.asarray( col )
+    if arr.ndim != 1:
+        raise ValueError( f"Table columns must be one-dimensional, got shape {arr.shape}" )
+    if arr.dtype.kind == 'O':
+        isnone = np.equal( arr, None ).astype( bool )
+        nulls = isnone if nulls is None else ( nulls | isnone )
+    elif arr.dtype.kind == 'M':
+        isnat = np.isnat( arr )
+        nulls = isnat if nulls is None else ( nulls | isnat )
+
+    if ( nulls is not None ) and ( not nulls.any() ):
+        nulls = None
+    return arr, nulls
+
+
+def _fill_nulls( arr, nulls, val ):
+    if nulls is None:
+        return arr
+    arr = arr.copy()
+    arr[ nulls ] = val
+    return arr
+
+
+def _pgbinary_int( arr, nulls, pgdtype ):
+    arr = _fill_nulls( arr, nulls, 0 )
+    if arr.dtype.kind == 'O':
+        try:
+            arr = arr.astype( np.int64 )
+        except ( TypeError, ValueError, OverflowError ):
+            raise _NoBinaryCopy()
+    elif arr.dtype.kind == 'f':
+        if not np.all( np.isfinite( arr ) & ( arr == np.floor( arr ) ) ):
+            raise ValueError( "Non-integer values for an integer column" )
+    elif arr.dtype.kind not in ( 'i', 'u', 'b' ):
+        raise _NoBinaryCopy()
+    if ( arr.dtype.kind != 'b' ) and ( len(arr) > 0 ):
+        lim = np.iinfo( pgdtype )
+        if ( arr.min() < lim.min ) or ( arr.max() > lim.max ):
+            raise ValueError( f"Values out of range for a {np.dtype(pgdtype).itemsize*8}-bit integer column" )
+    return arr.astype( pgdtype ).view( np.uint8 ).reshape( len(arr), -1 ), None
+
+
+def _pgbinary_float( arr, nulls, pgdtype ):
+    arr = _fill_nulls( arr, nulls, 0 )
+    if arr.dtype.kind == 'O':
+        try:
+            arr = arr.astype( np.float64 )
+        except ( TypeError, ValueError ):
+            raise _NoBinaryCopy()
+    elif arr.dtype.kind not in ( 'f', 'i', 'u', 'b' ):
+        raise _NoBinaryCopy()
+    return arr.astype( pgdtype ).view( np.uint8 ).reshape( len(arr), -1 ), None
+
+
+def _pgbinary_bool( arr, nulls ):
+    arr = _fill_nulls( arr, nulls, False )
+    if arr.dtype.kind not in ( 'b', 'i', 'u' ):
+        raise _NoBinaryCopy()
+    return ( arr != 0 ).astype( np.uint8 ).reshape( len(arr), 1 ), None
+
+
+def _pgbinary_text( arr, nulls ):
+    n = len( arr )
+    if arr.dtype.kind not in ( 'U', 'S' ):
+        arr = _fill_nulls( arr, nulls, '' ).astype( str )
+    if arr.dtype.kind == 'U':
+        arr = np.ascontiguousarray( arr, dtype=arr.dtype.newbyteorder( '=' ) )
+        codes = arr.view( np.uint32 ).reshape( n, -1 )
+        if np.all( codes < 128 ):
+            # Pure ASCII, don't need to run the encoder
+            return codes.astype( np.uint8 ), np.char.str_len( arr ).astype( np.int32 )
+        arr = np.char.encode( arr, 'utf-8' )
+    arr = np.ascontiguousarray( arr )
+    return arr.view( np.uint8 ).reshape( n, -1 ), np.char.str_len( arr ).astype( np.int32 )
+
+
+def _pgbinary_uuid( arr, nulls ):
+    n = len( arr )
+    if arr.dtype.kind not in ( 'U', 'S' ):
+        # Probably uuid.UUID objects, whose str() is the canonical form
+        arr = _fill_nulls( arr, nulls, '00000000-0000-0000-0000-000000000000' ).astype( str )
+    else:
+        arr = _fill_nulls( arr, nulls, '00000000-0000-0000-0000-000000000000' )
+    if arr.dtype.kind == 'S':
+        arr = arr.astype( str )
+    hexes = np.char.replace( arr, '-', '' )
+    if not np.all( np.char.str_len( hexes ) == 32 ):
+        # Let postgres figure out (or complain about) unusual formats
+        raise _NoBinaryCopy()
+    codes = np.ascontiguousarray( hexes, dtype='=U32' ).view( np.uint32 ).reshape( n, 32 )
+    nibbles = np.full( codes.shape, 255, dtype=np.uint8 )
+    for lo, hi, offset in ( ( 48, 57, 48 ), ( 97, 102, 87 ), ( 65, 70, 55 ) ):
+        w = ( codes >= lo ) & ( codes <= hi )
+        nibbles[w] = codes[w] - offset
+    if np.any( nibbles == 255 ):
+        raise _NoBinaryCopy()
+    return ( nibbles[:, 0::2] << 4 ) | nibbles[:, 1::2], None
+
+
+def _pgbinary_timestamp( arr, nulls ):
+    if arr.dtype.kind == 'O':
+        arr = _fill_nulls( arr, nulls, np.datetime64( 0, 'us' ) )
+        try:
+            # numpy converts timezone-aware datetimes to UTC, but warns about it
+            with warnings.catch_warnings():
+                warnings.simplefilter( 'ignore', UserWarning )
+                arr = arr.astype( 'datetime64[us]' )
+        except ( TypeError, ValueError ):
+            raise _NoBinaryCopy()
+    elif arr.dtype.kind == 'M':
+        arr = _fill_nulls( arr, nulls, np.datetime64( 0, 'us' ) )
+    else:
+        raise _NoBinaryCopy()
+    us = arr.astype( 'datetime64[us]' ).astype( np.int64 ) - _pg_epoch_us
+    return us.astype( '>i8' ).view( np.uint8 ).reshape( len(arr), 8 ), None
+
+
+def _pgbinary_encode_column( meta, arr, nulls ):
+    """Returns ( data, lens ).
+
+    data is an n×w uint8 array with the field contents for each row
+    (padded on the right to w), lens is an array of the number of bytes
+    each row actually uses, or None if that's always w.
+
+    """
+    if len( arr ) == 0:
+        # The encoders' reshapes can't infer a width from no data
+        return np.empty( ( 0, 0 ), dtype=np.uint8 ), None
+    dtype = meta.data_type
+    if dtype in _pgbinary_ints:
+        return _pgbinary_int( arr, nulls, _pgbinary_ints[dtype] )
+    if dtype in _pgbinary_floats:
+        return _pgbinary_float( arr, nulls, _pgbinary_floats[dtype] )
+    if dtype in _pgbinary_texts:
+        return _pgbinary_text( arr, nulls )
+    if dtype == 'boolean':
+        return _pgbinary_bool( arr, nulls )
+    if dtype == 'uuid':
+        return _pgbinary_uuid( arr, nulls )
+    if dtype in _pgbinary_timestamps:
+        return _pgbinary_timestamp( arr, nulls )
+    raise _NoBinaryCopy()
+
+
+def _pgbinary_rows( fields, i0, i1 ):
+    """Return a uint8 array with binary COPY data for rows i0:i1 (no header or trailer).
+
+    fields is a list of ( data, lens, nulls ) for each column, where
+    data and lens are what came from _pgbinary_encode_column.
+
+    """
+    n = i1 - i0
+    # Build every row padded out to the same width, and keep track
+    #   of which bytes are padding.  Then throw away the padding.
+    width = 2 + sum( 4 + f[0].shape[1] for f in fields )
+    rec = np.empty( ( n, width ), dtype=np.uint8 )
+    keep = None
+    rec[ :, 0:2 ] = np.array( [ len(fields) ], dtype='>i2' ).view( np.uint8 )
+    off = 2
+    for data, lens, nulls in fields:
+        w = data.shape[1]
+        if ( lens is None ) and ( nulls is None ):
+            rec[ :, off:off+4 ] = np.array( [ w ], dtype='>i4' ).view( np.uint8 )
+        else:
+            lens = np.full( n, w, dtype=np.int32 ) if lens is None else lens[i0:i1]
+            if nulls is not None:
+                lens = np.where( nulls[i0:i1], np.int32(-1), lens )
+            rec[ :, off:off+4 ] = lens.astype( '>i4' ).view( np.uint8 ).reshape( n, 4 )
+            if keep is None:
+                keep = np.ones( ( n, width ), dtype=bool )
+            keep[ :, off+4:off+4+w ] = np.arange( w ) < lens[ :, np.newaxis ]
+        rec[ :, off+4:off+4+w ] = data[i0:i1]
+        off += 4 + w
+
+    return rec.reshape( -1 ) if keep is None else rec[ keep ]
+
+
+def _pgbinary_chunks( fields, n, chunksize ):
+    yield _pgcopy_header
+    for i0 in range( 0, n, chunksize ):
+        yield memoryview( _pgbinary_rows( fields, i0, min( i0 + chunksize, n ) ) )
+    yield _pgcopy_trailer
+
+
+def _pgbinary_copy_data( metas, arrays, nulls, chunksize=100000 ):
+    """Get binary COPY data for columnar data.
+
+    Returns a generator; pass each chunk that it yields to psycopg's
+    Copy.write() for a "COPY ... FROM STDIN (FORMAT BINARY)".
+
+    Parameters
+    ----------
+      metas : list of ColumnMeta
+        The columns being copied, in order.
+
+      arrays : list of numpy arrays
+        The data for each column.  All must have the same length.
+
+      nulls : list of (numpy boolean array or None)
+        Which values of each column are NULL.  (The corresponding
+        entries in arrays are ignored.)  None means nothing in that
+        column is NULL.  (_column_values_and_nulls returns arrays and
+        nulls.)
+
+      chunksize : int, default 100000
+        Encode this many rows at a time, to keep memory use down.
+
+    Raises _NoBinaryCopy if any of the columns are of a type not
+    supported here, or have data that can't be converted.  All
+    conversion happens before this returns, so once you start copying
+    you won't get that exception partway through.
+
+    """
+    n = len( arrays[0] )
+    if any( len(a) != n for a in arrays ):
+        raise ValueError( "All columns must have the same length" )
+    if n == 0:
+        return iter( [ _pgcopy_header, _pgcopy_trailer ] )
+    fields = [ _pgbinary_encode_column( m, a, nl ) + ( nl, ) for m, a, nl in zip( metas, arrays, nulls ) ]
+    return _pgbinary_chunks( fields, n, chunksize )
+
+
+def _pgbinary_array_to_numpy( buf, meta ):
+    """Turn the output of array_send() on a 1-d array with no NULLs into a numpy array.
+
+    Only works for fixed-width types (integers, floats, booleans).
+
+    Parameters
+    ----------
+      buf : bytes-like or None
+        The bytea that came back from postgres.  None (which is what you
+        get from array_agg over zero rows) means an empty array.
+
+      meta : ColumnMeta
+        The column the array's elements came from.
+
+    Returns
+    -------
+      numpy array with native byte order
+
+    """
+    if meta.data_type in _pgbinary_ints:
+        dtype = np.dtype( _pgbinary_ints[ meta.data_type ] )
+    elif meta.data_type in _pgbinary_floats:
+        dtype = np.dtype( _pgbinary_floats[ meta.data_type ] )
+    elif meta.data_type == 'boolean':
+        dtype = np.dtype( '?' )
+    else:
+        raise TypeError( f"Can't decode binary arrays of {meta.data_type}" )
+
+    if buf is None:
+        return np.empty( 0, dtype=dtype.newbyteorder( '=' ) )
+
+    ndim, hasnull = np.frombuffer( buf, dtype='>i4', count=2 )
+    if ndim == 0:
+        return np.empty( 0, dtype=dtype.newbyteorder( '=' ) )
+    if ( ndim != 1 ) or ( hasnull != 0 ):
+        raise ValueError( f"Expected a 1-d array with no NULLs, got ndim={ndim}, hasnull={hasnull}" )
+    n = np.frombuffer( buf, dtype='>i4', count=1, offset=12 )[0]
+    elems = np.frombuffer( buf, dtype=[ ( 'len', '>i4' ), ( 'val', dtype ) ], count=n, offset=20 )
+    if np.any( elems['len'] != dtype.itemsize ):
+        raise ValueError( f"Unexpected element lengths in binary {meta.data_type} array" )
+    return elems['val'].astype( dtype.newbyteorder( '=' ) )
+
+
+# ======================================================================
+# Table metadata
+#
+# Asking information_schema about table columns is slow enough that it
+#   adds up for short-lived processes.  So, the first time any DBBase
+#   class needs its metadata, get it for all of the DBBase tables with
+#   one query, and save that in a file (in config.dbmeta_cache_dir)
+#   keyed by the migrations that have been applied to the database, so
+#   later processes can just read the file.  Processes forked after the
+#   metadata is loaded inherit _all_tablemeta and don't have to do
+#   anything.
+
+_tablemeta_cache_version = 1
+_all_tablemeta = None
+_all_tablemeta_lock = threading.Lock()
+
+_tablemeta_query = ( "SELECT c.table_name,c.column_name,c.data_type,c.column_default,c.is_nullable,"
+                     "       e.data_type AS element_type "
+                     "FROM information_schema.columns c "
+                     "LEFT JOIN information_schema.element_types e "
+                     "  ON ( (c.table_catalog, c.table_schema, c.table_name, "
+                     "        'TABLE', c.dtd_identifier) "
+                     "      =(e.object_catalog, e.object_schema, e.object_name, "
+                     "        e.object_type, e.collection_type_identifier) ) "
+                     "WHERE c.table_name=ANY(%(tables)s)" )
+
+
+def _dbbase_tablenames():
+    tables = set()
+    classes = list( DBBase.__subclasses__() )
+    while len( classes ) > 0:
+        cls = classes.pop()
+        if getattr( cls, '__tablename__', None ) is not None:
+            tables.add( cls.__tablename__ )
+        classes.extend( cls.__subclasses__() )
+    return sorted( tables )
+
+
+def _tablemeta_cache_file( cursor, tables ):
+    """Figure out the file the metadata cache should be in, or None if there shouldn't be one."""
+    cachedir = getattr( config, 'dbmeta_cache_dir', None )
+    if cachedir is None:
+        return None
+
+    cursor.execute( "SELECT to_regclass('migrations_applied') IS NOT NULL AS exists" )
+    if not cursor.fetchone()['exists']:
+        return None
+    cursor.execute( "SELECT filename,md5sum FROM migrations_applied ORDER BY filename" )
+    migrations = [ [ row['filename'], str( row['md5sum'] ) ] for row in cursor.fetchall() ]
+
+    keymd5 = hashlib.md5( json.dumps( [ _tablemeta_cache_version, dbhost, dbport, dbname,
+                                        tables, migrations ] ).encode( 'utf-8' ) )
+    return pathlib.Path( cachedir ) / f"fastdb_tablemeta_{os.getuid()}_{keymd5.hexdigest()}.json"
+
+
+def load_all_table_meta( dbcon=None, reload=False ):
+    """Get column metadata for all DBBase tables.
+
+    Normally you don't need to call this, as DBBase.load_table_meta
+    calls it.  You might want to call it before forking a bunch of
+    processes, so that none of them have to go get it.
+
+    Parameters
+    ----------
+      dbcon : psycopg.Connection or None
+        Database connection to use.  If None, will get one from the
+        pool and return it when done.
+
+      reload : bool, default False
+        Ignore what's already been loaded (in this process or in the
+        cache file) and ask the database again.
+
+    Returns
+    -------
+      dict of { table_name: list of dict }
+        Each dict in the list has the keyword arguments for a ColumnMeta.
+
+    """
+    global _all_tablemeta
+
+    with _all_tablemeta_lock:
+        if ( _all_tablemeta is not None ) and ( not reload ):
+            return _all_tablemeta
+
+        tables = _dbbase_tablenames()
+        with DB( dbcon ) as con:
+            cursor = con.cursor( row_factory=psycopg.rows.dict_row )
+            cachefile = _tablemeta_cache_file( cursor, tables )
+
+            if ( not reload ) and ( cachefile is not None ) and cachefile.is_file():
+                try:
+                    with open( cachefile ) as ifp:
+                        _all_tablemeta = json.load( ifp )
+                    return _all_tablemeta
+                except ( OSError, ValueError ):
+                    # Corrupted or vanished; just get it from the database
+                    pass
+
+            cursor.execute( _tablemeta_query, { 'tables': tables } )
+            meta = { t: [] for t in tables }
+            for row in cursor.fetchall():
+                meta[ row.pop( 'table_name' ) ].append( row )
+
+        if cachefile is not None:
+            try:
+                cachefile.parent.mkdir( parents=True, exist_ok=True )
+                tmpfile = cachefile.parent / f"{cachefile.name}.{os.getpid()}.tmp"
+                with open( tmpfile, "w" ) as ofp:
+                    json.dump( meta, ofp )
+                tmpfile.replace( cachefile )
+            except OSError:
+                # Not being able to write the cache just means the next process will be slower
+                pass
+
+        _all_tablemeta = meta
+        return _all_tablemeta
+
+
+# ======================================================================
+# ogod, it's like I'm writing my own ORM, and I hate ORMs
+#
+# But, two things.  (1) I'm writing it, so I know actually what it's doing
+#   backend with the PostgreSQL queries, (2) I'm not trying to create a whole
+#   new language to learn in place of SQL, I still intend mostly to just use
+#   SQL, and (3) sometimes it's worth re-inventing the wheel so that you get
+#   just a wheel (and also so that you really get a wheel and not massive tank
+#   treads that you are supposed to think act like a wheel)
+
+class _DBBaseMeta( type ):
+    """Metaclass for DBBase.
+
+    All it does is give every class that doesn't define __slots__ an
+    empty __slots__, so that objects don't get a __dict__.  (The slots
+    for the columns are added by DBBase._make_rowclass.)
+
+    """
+
+    def __new__( mcls, name, bases, namespace, **kwargs ):
+        namespace.setdefault( '__slots__', () )
+        return super().__new__( mcls, name, bases, namespace, **kwargs )
+
+
+def _unpickle_dbbase( cls, columns, state ):
+    # Unpickling shouldn't need a database, so if the table metadata
+    #   hasn't been loaded, make the row class from the pickled columns.
+    if ( cls.__dict__.get( '_rowclass' ) is None ) and ( cls._tablemeta is None ):
+        cls._make_rowclass( columns )
+    obj = cls( _noinit=True )
+    for col, val in state.items():
+        setattr( obj, col, val )
+    return obj
+
+
+class DBBase( metaclass=_DBBaseMeta ):
+    """A base class from which all other table classes derive themselves.
+
+    All subclasses must include:
+
+    __tablename__ = "<name of table in databse>"
+    _tablemeta = None
+    _pk = <list>
+
+    _pk must be a list of strings with the names of the primary key
+    columns.  Uusally (but not always) this will be a single-element
+    list.
+
+    Objects don't have a __dict__; the columns are stored in __slots__.
+    When you make an object of a subclass, what you actually get is an
+    object of a class made on the fly (by _make_rowclass) that is a
+    subclass of the one you asked for and has a slot for each column of
+    the table.  This means you can't set attributes on objects other
+    than columns of the table.  (If a subclass really needs more
+    attributes, it can list them in its own __slots__.)
+
+    """
+
+    _rowclass = None
+
+    # A dictionary of "<colum name>": <2-element tuple>
     # The first element is the converter that converts a value into something you can throw to postgres.
     # The second element is the converter that takes what you got from postgres and turns it into what
     #   you want the object to have.
@@ -309,34 +2059,102 @@ class DBBase:
         if cls._tablemeta is not None:
             return
 
-        with DB( dbcon ) as con:
-            cursor = con.cursor( row_factory=psycopg.rows.dict_row )
-            cursor.execute( "SELECT c.column_name,c.data_type,c.column_default,c.is_nullable,"
-                            "       e.data_type AS element_type "
-                            "FROM information_schema.columns c "
-                            "LEFT JOIN information_schema.element_types e "
-                            "  ON ( (c.table_catalog, c.table_schema, c.table_name, "
-                            "        'TABLE', c.dtd_identifier) "
-                            "      =(e.object_catalog, e.object_schema, e.object_name, "
-                            "        e.object_type, e.collection_type_identifier) ) "
-                            "WHERE table_name=%(table)s",
-                            { 'table': cls.__tablename__ } )
-            cols = cursor.fetchall()
-
-            cls._tablemeta = { c['column_name']: ColumnMeta(**c) for c in cols }
-
-            # See Issue #4!!!!
-            for col, meta in cls._tablemeta.items():
-                if col in cls.colconverters:
-                    if cls.colconverters[col][0] is not None:
-                        # Play crazy games because of the confusingness of python late binding
-                        def _tmp_py_to_pg( self, pyobj, col=col ):
-                            return cls.colconverters[col][0]( pyobj )
-                        meta.py_to_pg = types.MethodType( _tmp_py_to_pg, meta )
-                    if cls.colconverters[col][1] is not None:
-                        def _tmp_pg_to_py( self, pgobj, col=col ):
-                            return cls.colconverters[col][1]( pgobj )
-                        meta.pg_to_py = types.MethodType( _tmp_pg_to_py, meta )
+        allmeta = load_all_table_meta( dbcon=dbcon )
+        if cls.__tablename__ in allmeta:
+            cols = allmeta[ cls.__tablename__ ]
+        else:
+            # Must be a class defined after load_all_table_meta ran
+            with DB( dbcon ) as con:
+                cursor = con.cursor( row_factory=psycopg.rows.dict_row )
+                cursor.execute( _tablemeta_query, { 'tables': [ cls.__tablename__ ] } )
+                cols = cursor.fetchall()
+            for col in cols:
+                del col['table_name']
+
+        cls._tablemeta = { c['column_name']: ColumnMeta(**c) for c in cols }
+
+        # See Issue #4!!!!
+        for col, meta in cls._tablemeta.items():
+            if col in cls.colconverters:
+                if cls.colconverters[col][0] is not None:
+                    # Play crazy games because of the confusingness of python late binding
+                    def _tmp_py_to_pg( self, pyobj, col=col ):
+                        return cls.colconverters[col][0]( pyobj )
+                    meta.py_to_pg = types.MethodType( _tmp_py_to_pg, meta )
+                if cls.colconverters[col][1] is not None:
+                    def _tmp_pg_to_py( self, pgobj, col=col ):
+                        return cls.colconverters[col][1]( pgobj )
+                    meta.pg_to_py = types.MethodType( _tmp_pg_to_py, meta )
+
+        cls._make_rowclass()
+
+
+    @classmethod
+    def _make_rowclass( cls, columns=None ):
+        """Make the class that objects of this class actually are; see DBBase docstring.
+
+        The slots are columns, or the columns of the table if that's None.
+
+        """
+        columns = tuple( cls._tablemeta.keys() ) if columns is None else tuple( columns )
+        cls._rowclass = _DBBaseMeta( cls.__name__, ( cls, ),
+                                     { '__slots__': columns,
+                                       '__module__': cls.__module__,
+                                       '__qualname__': cls.__qualname__,
+                                       '__doc__': cls.__doc__ } )
+        cls._rowclass._rowclass = cls._rowclass
+
+
+    def __new__( cls, *args, **kwargs ):
+        # Look in cls.__dict__ so that a subclass doesn't use its parent's rowclass
+        if cls.__dict__.get( '_rowclass' ) is None:
+            if cls._tablemeta is None:
+                cls.load_table_meta( dbcon=kwargs.get( 'dbcon', args[0] if len(args) > 0 else None ) )
+            else:
+                cls._make_rowclass()
+        return super().__new__( cls._rowclass )
+
+
+    @classmethod
+    def _objects_from_rows( cls, cols, rows ):
+        """Make a list of objects from rows that came from cursor.fetch*.
+
+        Does the same thing as calling _set_self_from_fetch_cols_row on
+        a new object for each row, only faster, which matters when
+        there are lots of rows.
+
+        """
+        cls.load_table_meta()
+        rowclass = type( cls( _noinit=True ) )
+        # Set the slots directly with their descriptors, and only call
+        #   pg_to_py for columns where it does something.
+        setters = []
+        for col in cols:
+            setslot = getattr( rowclass, col ).__set__
+            meta = cls._tablemeta[col]
+            if meta.pg_to_py_is_identity:
+                setters.append( setslot )
+            else:
+                def _convert_and_set( obj, val, setslot=setslot, pg_to_py=meta.pg_to_py ):
+                    setslot( obj, pg_to_py( val ) )
+                setters.append( _convert_and_set )
+
+        objs = []
+        newobj = object.__new__
+        for row in rows:
+            obj = newobj( rowclass )
+            for setter, val in zip( setters, row ):
+                setter( obj, val )
+            objs.append( obj )
+
+        return objs
+
+
+    def __reduce__( self ):
+        columns = type(self).__slots__
+        state = { col: getattr( self, col ) for col in columns if hasattr( self, col ) }
+        # type(self) is the rowclass, which pickle can't find by name, so pickle its parent
+        return ( _unpickle_dbbase, ( type(self).__bases__[0], columns, state ) )
 
 
     def __init__( self, dbcon=None, cols=None, vals=None, _noinit=False, noconvert=True, **kwargs):
@@ -499,103 +2317,265 @@ class DBBase:
         return obj
 
     @classmethod
-    def get_batch( cls, pks, dbcon=None ):
+    def get_batch( cls, pks, dbcon=None, columns=None, chunksize=10000 ):
         """Get a list of objects based on primary keys.
 
+        The primary keys are sent to postgres as one array per primary
+        key column, and joined against with unnest(), so the query
+        doesn't get any bigger as you ask for more objects.
+
         Arguments
         ---------
           pks : list of lists
             Each element of the list must be a list whose length matches
             the length of self._pk.
 
+          dbcon : psycopg.Connection or None
+            Database connection to use.  If None, will get one from the
+            pool and return it when done.
+
+          columns : list of str or None
+            If given, only read these columns from the database.  The
+            returned objects will only have these attributes.  By
+            default, gets all columns.
+
+          chunksize : int, default 10000
+            Ask the database for at most this many primary keys at once.
+
         Returns
         -------
           list of objects
             Each object will be an instance of the class this class
-            method was called on.
+            method was called on.  If the same primary key shows up more
+            than once in pks, you'll get that object back more than once.
 
         """
 
+        q, subdicts = cls._get_batch_query( pks, columns, chunksize, dbcon=dbcon )
+        objs = []
+        if len( subdicts ) == 0:
+            return objs
+
+        # The size of the result is bounded by the number of pks asked
+        #   for, so just use a plain cursor; a server cursor would be
+        #   extra round trips for no benefit.
+        with DB( dbcon ) as con:
+            cursor = con.cursor()
+            for subdict in subdicts:
+                cursor.execute( q, subdict )
+                cols = [ desc[0] for desc in cursor.description ]
+                objs.extend( cls._objects_from_rows( cols, cursor.fetchall() ) )
+
+        return objs
+
+    @classmethod
+    def _get_batch_query( cls, pks, columns, chunksize, dbcon=None ):
+        """Returns the query and a list of substitution dictionaries (one per chunk) for get_batch."""
+
         if ( not isinstance( pks, collections.abc.Sequence ) ) or ( isinstance( pks, str ) ):
             raise TypeError( f"Must past a list of lists, each list having {len(cls._pk)} elwements." )
 
+        if len( pks ) == 0:
+            return None, []
+
         if cls._tablemeta is None:
             cls.load_table_meta( dbcon )
 
-        comma = ""
-        mess = ""
-        subdict = {}
-        pktypes = [ cls._tablemeta[k]['data_type'] for k in cls._pk ]
-        for dex, pk in enumerate( pks ):
+        if columns is None:
+            collist = f"{cls.__tablename__}.*"
+        else:
+            unknown = set( columns ) - set( cls._tablemeta.keys() )
+            if len( unknown ) > 0:
+                raise ValueError( f"Unknown columns for {cls.__tablename__}: {unknown}" )
+            collist = ",".join( f"{cls.__tablename__}.{c}" for c in columns )
+
+        pkvals = [ [] for k in cls._pk ]
+        for pk in pks:
             if len( pk ) != len( cls._pk ):
                 raise ValueError( f"{pk} doesn't have {len(cls._pk)} elements, should match {cls._pk}" )
-            mess += f"{comma}("
-            subcomma=""
             for subdex, ( pkval, pkcol ) in enumerate( zip( pk, cls._pk ) ):
-                mess += f"{subcomma}%(pk_{dex}_{subdex})s"
-                subdict[ f'pk_{dex}_{subdex}' ] = cls._tablemeta[pkcol].py_to_pg( pkval )
-                subcomma = ","
-            mess += ")"
-            comma = ","
-        comma = ""
-        _and = ""
-        collist = ""
-        onlist = ""
-        for subdex, ( pk, pktyp ) in enumerate( zip( cls._pk, pktypes ) ):
-            collist += f"{comma}{pk}"
-            # # SCARY.  Specific coding for uuid.  Really I probably ought to
-            # #   do something with a converter dictionary to make this more
-            # #   general, but I know that the only case I'll need it (at least
-            # #   as of this writing) is with uuids.
-            # if pktyp == 'uuid':
-            #     onlist += f"{_and} CAST( t.{pk} AS uuid)={cls.__tablename__}.{pk} "
-            # else:
-            onlist += f"{_and} t.{pk}={cls.__tablename__}.{pk} "
-            _and = "AND"
-            comma = ","
-
-        with DB( dbcon ) as con:
-            cursor = con.cursor()
-            q = f"SELECT * FROM {cls.__tablename__} JOIN (VALUES {mess}) AS t({collist}) ON {onlist} "
-            cursor.execute( q, subdict )
-            cols = [ desc[0] for desc in cursor.description ]
-            rows = cursor.fetchall()
+                pkvals[subdex].append( cls._tablemeta[pkcol].py_to_pg( pkval ) )
 
-        objs = []
-        for row in rows:
-            obj = cls( _noinit=True )
-            obj._set_self_from_fetch_cols_row( cols, row )
-            objs.append( obj )
+        arrays = ",".join( f"%(pk_{subdex})s::{cls._tablemeta[pk]['data_type']}[]"
+                           for subdex, pk in enumerate( cls._pk ) )
+        onlist = " AND ".join( f"t.{pk}={cls.__tablename__}.{pk}" for pk in cls._pk )
+        q = ( f"SELECT {collist} FROM {cls.__tablename__} "
+              f"JOIN unnest({arrays}) AS t({','.join(cls._pk)}) ON {onlist}" )
+        subdicts = [ { f'pk_{subdex}': vals[i0:i0+chunksize] for subdex, vals in enumerate( pkvals ) }
+                     for i0 in range( 0, len( pks ), chunksize ) ]
 
-        return objs
+        return q, subdicts
 
     @classmethod
-    def getbyattrs( cls, dbcon=None, **attrs ):
+    def _byattrs_query( cls, attrs, dbcon=None ):
+        """Returns the query and substitution dictionary for getbyattrs and iter_byattrs."""
         if cls._tablemeta is None:
             cls.load_table_meta( dbcon )
 
-        # WORRY : when we edit attrs below, will that also affect anything outside
-        #   this function?  E.g. if it's called with a ** itself.
         q = f"SELECT * FROM {cls.__tablename__} WHERE "
         _and = ""
-        for k in attrs.keys():
-            attrs[k] = cls._tablemeta[k].py_to_pg( attrs[k] )
+        subdict = {}
+        for k, v in attrs.items():
+            subdict[k] = cls._tablemeta[k].py_to_pg( v )
             q += f"{_and} {k}=%({k})s "
             _and = "AND"
 
+        return q, subdict
+
+    @classmethod
+    def getbyattrs( cls, dbcon=None, **attrs ):
+        """Get a list of all objects whose columns match attrs.
+
+        This is usually used for lookups that find a handful of rows,
+        so it reads them all at once with a plain cursor.  If there
+        might be a lot of rows, use iter_byattrs.
+
+        """
+        q, subdict = cls._byattrs_query( attrs, dbcon=dbcon )
         with DB( dbcon ) as con:
             cursor = con.cursor()
-            cursor.execute( q, attrs )
+            cursor.execute( q, subdict )
             cols = [ desc[0] for desc in cursor.description ]
             rows = cursor.fetchall()
 
-        objs = []
-        for row in rows:
-            obj = cls( _noinit=True )
-            obj._set_self_from_fetch_cols_row( cols, row )
-            objs.append( obj )
+        return cls._objects_from_rows( cols, rows )
 
-        return objs
+    @classmethod
+    def iter_byattrs( cls, dbcon=None, fetch_size=None, **attrs ):
+        """Like getbyattrs, but a generator that yields objects as they're read.
+
+        Rows are read from a server-side cursor fetch_size (default
+        config.db_fetch_size) at a time, so memory use doesn't depend on
+        how many rows match.  The database connection is held until the
+        generator is exhausted or closed.  If you pass a dbcon, don't
+        commit or roll it back until you're done iterating.
+
+        (You can't search on a column named "fetch_size" with this.)
+
+        """
+        q, subdict = cls._byattrs_query( attrs, dbcon=dbcon )
+        with DB( dbcon ) as con:
+            with server_cursor( con, fetch_size ) as cursor:
+                cursor.execute( q, subdict )
+                cols = [ desc[0] for desc in cursor.description ]
+                for rows in iter_batches( cursor ):
+                    yield from cls._objects_from_rows( cols, rows )
+
+    @classmethod
+    def fetch_columns( cls, columns=None, where=None, subdict=None, dbcon=None, **attrs ):
+        """Read columns from the table into numpy arrays.
+
+        This is for when you want a lot of rows, and don't want to pay
+        for making an object for each one of them.  Each column comes
+        back from postgres as a single array (via array_agg) on a binary
+        cursor.  Integer, float, and boolean columns are turned straight
+        into numpy arrays from the binary data without ever making a
+        python object per value.  Other columns go through psycopg's
+        usual conversions, and end up in numpy arrays of dtype str or
+        object.
+
+        Everything comes back in one go, and postgres limits a single
+        value to 1GB, so don't use this for more than ~100 million rows
+        at a time.
+
+        Parameters
+        ----------
+          columns : list of str or None
+            The columns to read.  Defaults to all columns of the table.
+
+          where : str or None
+            SQL for a WHERE clause (without the "WHERE"), e.g.
+            "mjd>%(t0)s AND band=%(band)s".
+
+          subdict : dict or None
+            Substitution dictionary for the parameters in where.
+
+          dbcon : psycopg.Connection or None
+            Database connection to use.  If None, will get one from the
+            pool and return it when done.
+
+          **attrs : column=value
+            Only get rows where column is value.  (Combined with where
+            using AND.)
+
+        Returns
+        -------
+          dict of { column_name: numpy array }
+            dtypes are from ColumnMeta.npdtype (so, from
+            ColumnMeta.typedict); columns of other types are object
+            arrays.  A column that has any NULLs comes back as a numpy
+            masked array with the NULLs masked.
+
+        """
+        cls.load_table_meta( dbcon )
+
+        if columns is None:
+            columns = list( cls._tablemeta.keys() )
+        else:
+            columns = list( columns )
+            unknown = set( columns ) - set( cls._tablemeta.keys() )
+            if len( unknown ) > 0:
+                raise ValueError( f"Unknown columns for {cls.__tablename__}: {unknown}" )
+        metas = [ cls._tablemeta[c] for c in columns ]
+
+        subdict = {} if subdict is None else dict( subdict )
+        conditions = [] if where is None else [ f"({where})" ]
+        for k, v in attrs.items():
+            if k not in cls._tablemeta:
+                raise ValueError( f"Unknown column for {cls.__tablename__}: {k}" )
+            subdict[ f'_attr_{k}' ] = cls._tablemeta[k].py_to_pg( v )
+            conditions.append( f"{k}=%(_attr_{k})s" )
+
+        # For numeric and boolean columns, ask for the raw binary array
+        #   (with NULLs replaced, since they'd make the elements different
+        #   sizes), plus a separate array of which ones were NULL if the
+        #   column is nullable.  Everything else is just array_agg.
+        aggs = []
+        for col, meta in zip( columns, metas ):
+            if ( meta.data_type in _pgbinary_ints ) or ( meta.data_type in _pgbinary_floats ):
+                aggs.append( f"array_send(array_agg(COALESCE({col},0)::{meta.data_type}))" )
+            elif meta.data_type == 'boolean':
+                aggs.append( f"array_send(array_agg(COALESCE({col},false)))" )
+            else:
+                aggs.append( f"array_agg({col})" )
+            if meta.is_nullable != 'NO':
+                aggs.append( f"array_send(array_agg({col} IS NULL))" )
+        q = f"SELECT {','.join(aggs)} FROM {cls.__tablename__}"
+        if len( conditions ) > 0:
+            q += f" WHERE {' AND '.join(conditions)}"
+
+        with DB( dbcon ) as con:
+            cursor = con.cursor( binary=True )
+            cursor.execute( q, subdict )
+            row = cursor.fetchone()
+
+        retval = {}
+        dex = 0
+        for col, meta in zip( columns, metas ):
+            val = row[dex]
+            dex += 1
+            nulls = None
+            if meta.is_nullable != 'NO':
+                nulls = _pgbinary_array_to_numpy( row[dex], ColumnMeta( data_type='boolean' ) )
+                dex += 1
+
+            if ( ( meta.data_type in _pgbinary_ints ) or ( meta.data_type in _pgbinary_floats )
+                 or ( meta.data_type == 'boolean' ) ):
+                arr = _pgbinary_array_to_numpy( val, meta )
+            else:
+                val = [] if val is None else val
+                dtype = meta.npdtype
+                if dtype.kind == 'O':
+                    arr = np.empty( len(val), dtype=object )
+                    arr[:] = val
+                else:
+                    if ( nulls is not None ) and nulls.any():
+                        val = [ dtype.type() if v is None else v for v in val ]
+                    arr = np.array( val, dtype=dtype )
+
+            retval[col] = np.ma.masked_array( arr, mask=nulls ) if ( nulls is not None ) and nulls.any() else arr
+
+        return retval
 
     def refresh( self, dbcon=None ):
         q, subdict = self._construct_pk_query_where( *self.pks )
@@ -661,20 +2641,264 @@ class DBBase:
                 if refresh:
                     self.refresh( con )
 
+    @classmethod
+    def copy_columnar_data( cls, cursor, table, data ):
+        """COPY columnar data into a table that has (some of) the columns of this class' table.
+
+        Usually table will be a temp table created with "LIKE
+        {cls.__tablename__}".  Uses binary COPY if all of the columns
+        are of types that it supports (integers, floats, booleans, text,
+        uuid, timestamps), and if the data can be converted to those
+        types.  Otherwise, falls back to (much slower) text COPY.
+
+        Masked values (numpy masked arrays, astropy MaskedColumns), None
+        in object arrays, pandas NA and NaT all become NULL.  NaN in
+        floating-point columns is sent as NaN, not NULL.  Timestamps
+        without a time zone are assumed to be UTC.
+
+        Does not commit.
+
+        Parameters
+        ----------
+          cursor : psycopg.Cursor
+
+          table : str
+            Name of the table to copy into.
+
+          data : columnar data
+            A dict of numpy arrays, a numpy structured array, a pandas
+            DataFrame, or an astropy Table.  The keys/column names
+            must be column names of this class' table.
+
+        Returns
+        -------
+          int : the number of rows copied
+
+        """
+        statement, binary, things, nrows = cls._columnar_copy_plan( table, data, dbcon=cursor.connection )
+        if statement is not None:
+            with cursor.copy( statement ) as copier:
+                write = copier.write if binary else copier.write_row
+                for thing in things:
+                    write( thing )
+        return nrows
+
+
+    @classmethod
+    def _columnar_copy_plan( cls, table, data, dbcon=None ):
+        """Figure out how to COPY columnar data; used by copy_columnar_data.
+
+        Returns ( statement, binary, things, nrows ).  If binary is True,
+        pass each of things to Copy.write(), otherwise pass each of them
+        to Copy.write_row().  statement is None if there's nothing to
+        copy.
+
+        """
+        columnar = _columnar_data( data )
+        if columnar is None:
+            raise TypeError( f"Don't know how to copy a {type(data)}; need columnar data." )
+        columns, cols = columnar
+        if len( cols ) == 0:
+            return None, False, [], 0
+
+        cls.load_table_meta( dbcon=dbcon )
+        unknown = set( c.lower() for c in columns ) - set( cls._tablemeta.keys() )
+        if len( unknown ) > 0:
+            raise ValueError( f"Unknown columns for {cls.__tablename__}: {unknown}" )
+        metas = [ cls._tablemeta[ c.lower() ] for c in columns ]
+        arrays, nulls = zip( *[ _column_values_and_nulls( c ) for c in cols ] )
+        nrows = len( arrays[0] )
+        if nrows == 0:
+            return None, False, [], 0
+
+        try:
+            chunks = _pgbinary_copy_data( metas, arrays, nulls )
+            return ( f"COPY {table}({','.join(columns)}) FROM STDIN (FORMAT BINARY)", True, chunks, nrows )
+        except _NoBinaryCopy:
+            pass
+
+        # Fall back to text COPY
+        rows = []
+        for arr, nl in zip( arrays, nulls ):
+            if arr.dtype.kind == 'M':
+                arr = arr.astype( 'datetime64[us]' )
+            elif arr.dtype.kind == 'S':
+                arr = arr.astype( str )
+            vals = arr.tolist()
+            if nl is not None:
+                for i in np.nonzero( nl )[0]:
+                    vals[i] = None
+            rows.append( vals )
+        return ( f"COPY {table}({','.join(columns)}) FROM STDIN", False, zip( *rows ), nrows )
+
+
+    @classmethod
+    def _bulk_copy_to_staging( cls, cursor, staging, data ):
+        """COPY one chunk of bulk_insert_or_upsert data into the staging table.
+
+        Returns the list of columns copied.
+
+        """
+        columns, statement, binary, things = cls._bulk_copy_plan( staging, data, dbcon=cursor.connection )
+        if statement is not None:
+            with cursor.copy( statement ) as copier:
+                write = copier.write if binary else copier.write_row
+                for thing in things:
+                    write( thing )
+        return columns
+
+
+    @classmethod
+    def _bulk_copy_plan( cls, staging, data, dbcon=None ):
+        """Figure out how to COPY one chunk of bulk_insert_or_upsert data into the staging table.
+
+        Returns ( columns, statement, binary, things ); see _columnar_copy_plan.
+
+        """
+        columnar = _columnar_data( data )
+        if columnar is not None:
+            statement, binary, things, _ = cls._columnar_copy_plan( staging, data, dbcon=dbcon )
+            return list( columnar[0] ), statement, binary, things
+
+        if isinstance( data, list ) and isinstance( data[0], dict ):
+            columns = list( data[0].keys() )
+            # Alas, psycopg's copy seems to index the thing it's passed,
+            #   so we can't just pass it d.values()
+            values = [ list( d.values() ) for d in data ]
+        elif isinstance( data, dict ):
+            columns = list( data.keys() )
+            values = [ [ data[c][i] for c in columns ] for i in range(len(data[columns[0]])) ]
+        elif isinstance( data, list ) and isinstance( data[0], cls ):
+            # This isn't entirely satisfying.  But, we're going
+            #   to assume that things that are None because they
+            #   want to use database defaults are going to be
+            #   the same in every object.
+            sd0 = data[0]._build_subdict()
+            columns = list( sd0.keys() )
+            data = [ d._build_subdict( columns=columns ) for d in data ]
+            # Alas, psycopg's copy seems to index the thing it's passed,
+            #   so we can't just pass it d.values()
+            values = [ list( d.values() ) for d in data ]
+        else:
+            raise TypeError( f"data must be something other than a {type(data)}" )
+
+        return columns, f"COPY {staging}({','.join(columns)}) FROM STDIN", False, values
+
+
+    @classmethod
+    def _bulk_merge_query( cls, staging, columns, upsert, assume_no_conflict ):
+        if not assume_no_conflict:
+            if not upsert:
+                conflict = f"ON CONFLICT ({','.join(cls._pk)}) DO NOTHING"
+            else:
+                conflict = ( f"ON CONFLICT ({','.join(cls._pk)}) DO UPDATE SET "
+                             + ",".join( f"{c}=EXCLUDED.{c}" for c in columns ) )
+        else:
+            conflict = ""
+
+        return f"INSERT INTO {cls.__tablename__} SELECT * FROM {staging} {conflict}"
+
+
+    @staticmethod
+    def _bulk_chunks( data, chunksize ):
+        """Turn the iterator passed to bulk_insert_or_upsert into a sequence of chunks.
+
+        Things that are already chunks (lists, columnar data) are passed
+        through; single rows (dicts or objects) are gathered into lists
+        of at most chunksize rows.
+
+        """
+        rows = []
+        for thing in data:
+            if isinstance( thing, list ) or ( _columnar_data( thing ) is not None ):
+                if len( rows ) > 0:
+                    yield rows
+                    rows = []
+                if _data_nrows( thing ) > 0:
+                    yield thing
+            else:
+                rows.append( thing )
+                if len( rows ) >= chunksize:
+                    yield rows
+                    rows = []
+        if len( rows ) > 0:
+            yield rows
+
+
     @classmethod
     def bulk_insert_or_upsert( cls, data, upsert=False, assume_no_conflict=False,
-                               dbcon=None, nocommit=False ):
+                               dbcon=None, nocommit=False, staging_table=None,
+                               chunksize=100000, commit_each_chunk=False ):
         """Try to efficiently insert a bunch of data into the database.
 
-        ROB TODO DOCUMENT QUIRKS
+        Data are COPYed into a temporary staging table, and then copied
+        from there into the real table with a single INSERT.
+
+        Quirks:
+
+          * The staging table is a TEMP table made with "LIKE" the real
+            table, so it has the column defaults but none of the
+            constraints.  Constraint violations only show up when the
+            staging table is merged into the real table.  On success it
+            is dropped before returning (unless nocommit is True).  If
+            you pass staging_table, "DROP TABLE IF EXISTS" runs on that
+            name first.  That drops a temp table of that name if there
+            is one, and otherwise a *permanent* table of that name, so
+            pick a name that can't collide with anything real.
+
+          * Everything happens in the transaction on dbcon, and the
+            commit at the end commits whatever else was pending on
+            dbcon too.  If something fails (and commit_each_chunk is
+            False), nothing has been committed.  The transaction on the
+            connection is left open (and usually aborted), staging
+            table and all.  If you
+            passed a dbcon, it's up to you to roll it back; if you
+            didn't, DB() does that when it returns the connection to
+            the pool.
+
+          * nocommit=True raises a ValueError if data is an iterator.
+            Iterator data is merged and the staging table truncated
+            chunk by chunk, so no single staging table ever holds all of
+            the data to hand back to you.
+
+          * With commit_each_chunk=True, a failure partway through
+            leaves every chunk before the failing one committed in the
+            real table.  The failing chunk is rolled back, the staging
+            table (which was committed along with the first chunk) is
+            dropped and that drop committed, and the exception is
+            re-raised.  There's no record of how far it got, so make
+            sure rerunning with the same data is harmless (e.g. use
+            upsert=True, or rely on ON CONFLICT DO NOTHING).
+
+          * If data isn't an iterator and has no rows, nothing happens
+            (no connection is even used) and it returns None.
 
         Parmeters
         ---------
-          data: dict or list
+          data: dict, list, columnar data, or an iterator
             Can be one of:
               * a list of dicts.  The keys in all dicts (including order!) must be the same
               * a dict of lists
               * a list of objects of type cls
+              * a dict of numpy arrays (astropy Columns are fine)
+              * a numpy structured array
+              * a pandas DataFrame
+              * an astropy Table
+              * an iterator (e.g. a generator)
+
+            The numpy/pandas/astropy things are "columnar data", and are
+            sent to the database with binary COPY without ever building
+            rows in Python, which is much faster for lots of rows.  See
+            copy_columnar_data for how NULLs work.
+
+            If data is an iterator, it can yield single rows (dicts or
+            objects of type cls), which get gathered up into chunks of
+            chunksize rows, or whole chunks (lists of dicts, lists of
+            objects, or columnar data).  (It can't yield a dict of
+            lists; that would look like a single row.)  Each chunk is
+            COPYed to the staging table and then merged into the real
+            table before the next chunk is pulled from the iterator, so
+            you never need to have more than one chunk in memory.
 
           upsert: bool, default False
              If False, then objects whose primary key is already in the
@@ -691,80 +2915,248 @@ class DBBase:
              where the conflict clauses cause the sql to fail.  Set this
              to True to avoid having those clauses.
 
+          dbcon : psycopg.Connection or None
+             Database connection to use.  If None, will get one from the
+             pool and return it when done.
+
           nocommit : bool, default False
              This one is very scary and you should only use it if you
              really know what you're doing.  If this is True, not only
              will we not commit to the database, but we won't copy from
-             the table temp_bulk_upsert to the table of interest.  It
-             doesn't make sense to set this to True unless you also
-             pass a dbcon.  This is for things that want to do stuff to
-             the temp table before copying it over to the main table, in
-             which case it's the caller's responsibility to do that copy
-             and commit to the database.
+             the staging table to the table of interest.  It doesn't
+             make sense to set this to True unless you also pass a dbcon
+             and a staging_table.  This is for things that want to do
+             stuff to the staging table before copying it over to the
+             main table, in which case it's the caller's responsibility
+             to do that copy, drop the staging table, and commit to the
+             database.  Can't be used when data is an iterator.
+
+          staging_table : str or None
+             The name of the temp table to stage the data in.  If None,
+             a unique name (temp_bulk_upsert_<hex>) is made up, so
+             several bulk_insert_or_upsert calls can be going on on the
+             same connection at once.  If you pass a name, any existing
+             table with that name will be dropped!  Mostly useful with
+             nocommit=True, so you know what table to mess with.
+
+          chunksize : int, default 100000
+             Only used if data is an iterator that yields single rows;
+             this many rows are COPYed and merged at a time.
+
+          commit_each_chunk : bool, default False
+             Only used if data is an iterator.  Normally, everything is
+             committed at the end, so either all the data gets loaded or
+             none of it does.  Set this to True to commit after each
+             chunk is merged; that keeps transactions short, but if
+             something goes wrong partway through, the chunks before
+             the failure will already be in the database.
 
         Returns
         -------
            int OR string
              If nocommit=False, returns the number of rows actually
-             inserted (which may be less than len(data)).
+             inserted (which may be less than the number of rows in
+             data).
 
              If nocommit=True, returns the string to execute to copy
-             from the temp table to the final table.
+             from the staging table to the final table.
 
         """
 
-        if len(data) == 0:
-            return
-
-        if isinstance( data, list ) and isinstance( data[0], dict ):
-            columns = data[0].keys()
-            # Alas, psycopg's copy seems to index the thing it's passed,
-            #   so we can't just pass it d.values()
-            values = [ list( d.values() ) for d in data ]
-        elif isinstance( data, dict ):
-            columns = list( data.keys() )
-            values = [ [ data[c][i] for c in columns ] for i in range(len(data[columns[0]])) ]
-        elif isinstance( data, list ) and isinstance( data[0], cls ):
-            # This isn't entirely satisfying.  But, we're going
-            #   to assume that things that are None because they
-            #   want to use database defaults are going to be
-            #   the same in every object.
-            sd0 = data[0]._build_subdict()
-            columns = sd0.keys()
-            data = [ d._build_subdict( columns=columns ) for d in data ]
-            # Alas, psycopg's copy seems to index the thing it's passed,
-            #   so we can't just pass it d.values()
-            values = [ list( d.values() ) for d in data ]
-        else:
-            raise TypeError( f"data must be something other than a {cls.__name__}" )
+        steps = cls._bulk_upsert_steps( data, upsert, assume_no_conflict, nocommit, staging_table,
+                                        chunksize, commit_each_chunk )
+        try:
+            step = next( steps )
+        except StopIteration as ex:
+            # Nothing to do, don't bother getting a connection
+            return ex.value
 
         with DB( dbcon ) as con:
             cursor = con.cursor()
-            cursor.execute( "DROP TABLE IF EXISTS temp_bulk_upsert" )
-            cursor.execute( f"CREATE TEMP TABLE temp_bulk_upsert (LIKE {cls.__tablename__})" )
-            with cursor.copy( f"COPY temp_bulk_upsert({','.join(columns)}) FROM STDIN" ) as copier:
-                for v in values:
-                    copier.write_row( v )
-
-            if not assume_no_conflict:
-                if not upsert:
-                    conflict = f"ON CONFLICT ({','.join(cls._pk)}) DO NOTHING"
-                else:
-                    conflict = ( f"ON CONFLICT ({','.join(cls._pk)}) DO UPDATE SET "
-                                 + ",".join( f"{c}=EXCLUDED.{c}" for c in columns ) )
-            else:
-                conflict = ""
+            while True:
+                what, arg = step
+                try:
+                    if what == 'execute':
+                        cursor.execute( arg )
+                        result = cursor.rowcount
+                    elif what == 'copy':
+                        result = cls._bulk_copy_to_staging( cursor, *arg )
+                    elif what == 'commit':
+                        result = con.commit()
+                    else:
+                        result = con.rollback()
+                except Exception as ex:
+                    # Give _bulk_upsert_steps a chance to clean up; it re-raises
+                    step = steps.throw( ex )
+                    continue
+                try:
+                    step = steps.send( result )
+                except StopIteration as ex:
+                    return ex.value
+
+
+    @classmethod
+    def _bulk_upsert_steps( cls, data, upsert, assume_no_conflict, nocommit, staging_table,
+                            chunksize, commit_each_chunk ):
+        """What bulk_insert_or_upsert and abulk_insert_or_upsert do, without doing any I/O.
+
+        This is a generator that yields ( what, arg ) and expects to be
+        sent back the result of doing it:
+          ( 'execute', sql ) : execute sql; send back cursor.rowcount
+          ( 'copy', ( staging, chunk ) ) : _bulk_copy_to_staging; send back the list of columns
+          ( 'commit', None ), ( 'rollback', None ) : send back anything
+
+        If doing one of those raises an exception, throw it into the
+        generator.  What bulk_insert_or_upsert returns is the value of
+        the generator's StopIteration.  If it stops without yielding
+        anything, there's nothing to do.
 
-            q = f"INSERT INTO {cls.__tablename__} SELECT * FROM temp_bulk_upsert {conflict}"
+        """
+
+        iterating = hasattr( data, '__next__' )
+        if iterating:
+            if nocommit:
+                raise ValueError( "bulk_insert_or_upsert can't do nocommit with an iterator" )
+        elif _data_nrows( data ) == 0:
+            return
+
+        staging = f"temp_bulk_upsert_{uuid.uuid4().hex}" if staging_table is None else staging_table
+
+        if staging_table is not None:
+            yield 'execute', f"DROP TABLE IF EXISTS {staging}"
+        yield 'execute', f"CREATE TEMP TABLE {staging} (LIKE {cls.__tablename__})"
 
+        if not iterating:
+            columns = yield 'copy', ( staging, data )
+            q = cls._bulk_merge_query( staging, columns, upsert, assume_no_conflict )
             if nocommit:
                 return q
-            else:
-                cursor.execute( q )
-                ninserted = cursor.rowcount
-                cursor.execute( "DROP TABLE temp_bulk_upsert" )
-                con.commit()
-                return ninserted
+            ninserted = yield 'execute', q
+            yield 'execute', f"DROP TABLE {staging}"
+            yield 'commit', None
+            return ninserted
+
+        ninserted = 0
+        try:
+            for chunk in cls._bulk_chunks( data, chunksize ):
+                columns = yield 'copy', ( staging, chunk )
+                ninserted += yield 'execute', cls._bulk_merge_query( staging, columns, upsert, assume_no_conflict )
+                yield 'execute', f"TRUNCATE TABLE {staging}"
+                if commit_each_chunk:
+                    yield 'commit', None
+        except Exception:
+            # If we've been committing chunks, the staging table
+            #   was committed along with the first one, so rolling
+            #   back won't get rid of it.
+            if commit_each_chunk:
+                yield 'rollback', None
+                yield 'execute', f"DROP TABLE IF EXISTS {staging}"
+                yield 'commit', None
+            raise
+
+        yield 'execute', f"DROP TABLE {staging}"
+        yield 'commit', None
+        return ninserted
+
+
+    # ======================================================================
+    # asyncio versions of some of the above.
+    #
+    # These all take an optional dbcon that is a psycopg.AsyncConnection,
+    #   and otherwise get a connection from ADB().  (If the table metadata
+    #   hasn't been loaded yet, that will be done synchronously the first
+    #   time, which briefly blocks the event loop.)
+
+    @classmethod
+    async def aget( cls, *args, dbcon=None ):
+        """Async version of get."""
+
+        q, subdict = cls._construct_pk_query_where( *args )
+        q = f"SELECT * FROM {cls.__tablename__} {q}"
+        async with ADB( dbcon ) as con:
+            cursor = con.cursor()
+            await cursor.execute( q, subdict )
+            cols = [ desc[0] for desc in cursor.description ]
+            rows = await cursor.fetchall()
+
+        if len(rows) > 1:
+            raise RuntimeError( f"Found multiple rows of {cls.__tablename__} with primary keys {args}; "
+                                f"this should never happen." )
+        if len(rows) == 0:
+            return None
+
+        return cls._objects_from_rows( cols, rows )[0]
+
+
+    @classmethod
+    async def aget_batch( cls, pks, dbcon=None, columns=None, chunksize=10000 ):
+        """Async version of get_batch."""
+
+        q, subdicts = cls._get_batch_query( pks, columns, chunksize )
+        objs = []
+        if len( subdicts ) == 0:
+            return objs
+
+        async with ADB( dbcon ) as con:
+            cursor = con.cursor()
+            for subdict in subdicts:
+                await cursor.execute( q, subdict )
+                cols = [ desc[0] for desc in cursor.description ]
+                objs.extend( cls._objects_from_rows( cols, await cursor.fetchall() ) )
+
+        return objs
+
+
+    @classmethod
+    async def _abulk_copy_to_staging( cls, cursor, staging, data ):
+        columns, statement, binary, things = cls._bulk_copy_plan( staging, data )
+        if statement is not None:
+            async with cursor.copy( statement ) as copier:
+                write = copier.write if binary else copier.write_row
+                for thing in things:
+                    await write( thing )
+        return columns
+
+
+    @classmethod
+    async def abulk_insert_or_upsert( cls, data, upsert=False, assume_no_conflict=False,
+                                      dbcon=None, nocommit=False, staging_table=None,
+                                      chunksize=100000, commit_each_chunk=False ):
+        """Async version of bulk_insert_or_upsert.
+
+        If data is an iterator, it must be a regular iterator, not an
+        async iterator.
+
+        """
+
+        steps = cls._bulk_upsert_steps( data, upsert, assume_no_conflict, nocommit, staging_table,
+                                        chunksize, commit_each_chunk )
+        try:
+            step = next( steps )
+        except StopIteration as ex:
+            return ex.value
+
+        async with ADB( dbcon ) as con:
+            cursor = con.cursor()
+            while True:
+                what, arg = step
+                try:
+                    if what == 'execute':
+                        await cursor.execute( arg )
+                        result = cursor.rowcount
+                    elif what == 'copy':
+                        result = await cls._abulk_copy_to_staging( cursor, *arg )
+                    elif what == 'commit':
+                        result = await con.commit()
+                    else:
+                        result = await con.rollback()
+                except Exception as ex:
+                    step = steps.throw( ex )
+                    continue
+                try:
+                    step = steps.send( result )
+                except StopIteration as ex:
+                    return ex.value
 
 
 # ======================================================================
@@ -858,6 +3250,199 @@ class DiaForcedSource( DBBase ):
     _pk = [ 'diaforcedsourceid', 'processing_version' ]
 
 
+# ======================================================================
+
+class DiaObjectDetStats( DBBase ):
+    """Per-object detection statistics.
+
+    This table is derived entirely from diasource; there's one row for
+    each (diaobjectid, processing_version) that has sources in
+    processing_version.  Anything that adds sources must call recompute()
+    for the objects it touched (SourceImporter and the SNANA loader do),
+    otherwise object_search will be working from stale numbers.
+
+    """
+
+    __tablename__ = "diaobject_detstats"
+    _tablemeta = None
+    _pk = [ 'diaobjectid', 'processing_version' ]
+    _statcols = [ 'ndet', 'firstdetmjd', 'lastdetmjd', 'nbandsdetected', 'bandsdetected',
+                  'maxdetflux', 'maxdetfluxerr', 'maxdetfluxmjd', 'maxdetfluxband',
+                  'lastdetflux', 'lastdetfluxerr', 'lastdetfluxmjd', 'lastdetfluxband' ]
+
+    @staticmethod
+    def aggregate_query( where="" ):
+        """Return a query that calculates the contents of this table from diasource.
+
+        Parameters
+        ----------
+          where : str
+            A WHERE clause to apply to diasource before aggregating.
+            If you put substitutions in here, you have to pass them
+            along when you execute the query.
+
+        Returns
+        -------
+          str; columns are the same, and in the same order, as diaobject_detstats.
+
+        """
+        return ( f"SELECT diaobjectid, processing_version, COUNT(*) AS ndet, "
+                 f"       MIN(midpointmjdtai) AS firstdetmjd, MAX(midpointmjdtai) AS lastdetmjd, "
+                 f"       COUNT(DISTINCT band) AS nbandsdetected, "
+                 f"       string_agg(DISTINCT band::text, '' ORDER BY band::text) AS bandsdetected, "
+                 f"       (array_agg(psfflux ORDER BY psfflux DESC))[1] AS maxdetflux, "
+                 f"       (array_agg(psffluxerr ORDER BY psfflux DESC))[1] AS maxdetfluxerr, "
+                 f"       (array_agg(midpointmjdtai ORDER BY psfflux DESC))[1] AS maxdetfluxmjd, "
+                 f"       (array_agg(band ORDER BY psfflux DESC))[1] AS maxdetfluxband, "
+                 f"       (array_agg(psfflux ORDER BY midpointmjdtai DESC))[1] AS lastdetflux, "
+                 f"       (array_agg(psffluxerr ORDER BY midpointmjdtai DESC))[1] AS lastdetfluxerr, "
+                 f"       (array_agg(midpointmjdtai ORDER BY midpointmjdtai DESC))[1] AS lastdetfluxmjd, "
+                 f"       (array_agg(band ORDER BY midpointmjdtai DESC))[1] AS lastdetfluxband "
+                 f"FROM diasource {where} "
+                 f"GROUP BY diaobjectid, processing_version" )
+
+
+    @classmethod
+    def recompute( cls, processing_version=None, diaobjectids=None, fromtable=None, ingest_batch=None,
+                   dbcon=None, commit=True ):
+        """Recalculate the detection statistics for some objects.
+
+        Recalculates from all of the sources of each object, so it
+        doesn't matter if some of the object's sources were already
+        there before; calling this more than once is harmless.  Give
+        exactly one of:
+
+          * processing_version and diaobjectids : refresh just those objects
+          * fromtable : refresh all (diaobjectid, processing_version) in
+                 that table (e.g. a temp table of just-imported sources),
+                 or list of tables
+          * processing_version by itself : refresh everything in that
+                 processing version
+
+        Parameters
+        ----------
+          processing_version : int or str
+            The processing version of the sources.
+
+          diaobjectids : list of int
+
+          fromtable : str or list of str
+            Name of a table (or tables) that has (at least) columns
+            diaobjectid and processing_version.
+
+          ingest_batch : int or None
+            If not None, set last_ingest_batch to this for all of the
+            refreshed objects (see IngestBatch).  If None,
+            last_ingest_batch is left alone.
+
+          dbcon : psycopg.Connection or None
+
+          commit : bool, default True
+            Commit when done.  Set to False if this is part of a larger transaction.
+
+        Returns
+        -------
+          int, the number of rows of diaobject_detstats inserted or updated
+
+        """
+        if fromtable is not None:
+            if ( processing_version is not None ) or ( diaobjectids is not None ):
+                raise ValueError( "Pass either fromtable, or processing_version (and maybe diaobjectids), not both" )
+            fromtable = [ fromtable ] if isinstance( fromtable, str ) else fromtable
+            subq = " UNION ".join( f"SELECT diaobjectid, processing_version FROM {t}" for t in fromtable )
+            where = f"WHERE (diaobjectid, processing_version) IN ( {subq} )"
+        elif processing_version is None:
+            raise ValueError( "Must pass either processing_version or fromtable" )
+        else:
+            where = "WHERE processing_version=%(pv)s"
+            if diaobjectids is not None:
+                where += " AND diaobjectid=ANY(%(ids)s::bigint[])"
+
+        cols = cls._pk + cls._statcols
+        setcols = list( cls._statcols )
+        agg = cls.aggregate_query( where )
+        if ingest_batch is not None:
+            agg = f"SELECT a.*, %(batch)s AS last_ingest_batch FROM ( {agg} ) a"
+            cols.append( 'last_ingest_batch' )
+            setcols.append( 'last_ingest_batch' )
+        q = ( f"INSERT INTO {cls.__tablename__}({','.join(cols)}) {agg} "
+              f"ON CONFLICT ({','.join(cls._pk)}) DO UPDATE SET "
+              + ",".join( f"{c}=EXCLUDED.{c}" for c in setcols ) )
+
+        with DB( dbcon ) as con:
+            subdict = { 'batch': ingest_batch }
+            if processing_version is not None:
+                subdict['pv'] = procver_id( processing_version, dbcon=con )
+                subdict['ids'] = None if diaobjectids is None else list( diaobjectids )
+            cursor = con.cursor()
+            cursor.execute( q, subdict )
+            n = cursor.rowcount
+            if commit:
+                con.commit()
+
+        return n
+
+
+# ======================================================================
+
+class IngestBatch( DBBase ):
+    """One import of sources into the database.
+
+    Used to tell what changed since when; see
+    DiaObjectDetStats.recompute and ltcv.get_hot_ltcvs.  Batch ids are
+    only useful if they become visible in order, so that once somebody
+    can see batch N they can also see everything that was in batches
+    before N.  new() makes sure of that by locking the table, which
+    means you must call it right before you commit the import, not at
+    the beginning.
+
+    """
+
+    __tablename__ = "ingest_batch"
+    _tablemeta = None
+    _pk = [ 'id' ]
+
+    @classmethod
+    def new( cls, dbcon, description=None ):
+        """Create a new ingest batch.
+
+        Does NOT commit; the lock taken here is held until dbcon
+        commits (or rolls back), so commit soon afterwards.
+
+        Parameters
+        ----------
+          dbcon : psycopg.Connection
+            The connection doing the import.  (Required, unlike
+            most places, as this has to be part of the import's
+            transaction.)
+
+          description : str or None
+
+        Returns
+        -------
+          int, the id of the new batch
+
+        """
+        cursor = dbcon.cursor()
+        # EXCLUSIVE conflicts with itself but not with the ACCESS SHARE
+        #   lock that readers take, so this serializes imports' commits
+        #   without getting in the way of anybody reading.
+        cursor.execute( f"LOCK TABLE {cls.__tablename__} IN EXCLUSIVE MODE" )
+        cursor.execute( f"INSERT INTO {cls.__tablename__}(description) VALUES (%(desc)s) RETURNING id",
+                        { 'desc': description } )
+        return cursor.fetchone()[0]
+
+
+    @classmethod
+    def latest( cls, dbcon=None ):
+        """Return the id of the most recent committed ingest batch (0 if there aren't any)."""
+        with DB( dbcon ) as con:
+            cursor = con.cursor()
+            cursor.execute( f"SELECT COALESCE(MAX(id),0) FROM {cls.__tablename__}" )
+            return cursor.fetchone()[0]
+
+
+
 # ======================================================================
 
 class DiaObjectSnapshot( DBBase ):
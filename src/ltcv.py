@@ -1,5 +1,8 @@
 import datetime
-import numbers
+import heapq
+import operator
+import itertools
+import contextlib
 
 import numpy
 import pandas
@@ -10,25 +13,161 @@ import util
 
 
 def procver_int( processing_version, dbcon=None ):
-    if isinstance( processing_version, numbers.Integral ):
-        return processing_version
-    try:
-        ipv = int( processing_version )
-        return ipv
-    except Exception:
-        pass
-    with db.DB( dbcon ) as con:
-        cursor = con.cursor()
-        cursor.execute( "SELECT id FROM processing_version WHERE description=%(pv)s", { 'pv': processing_version } )
-        row = cursor.fetchone()
-        if row is not None:
-            return row[0]
-        cursor.execute( "SELECT id FROM processing_version_alias WHERE description=%(pv)s",
-                        { 'pv': processing_version } )
-        row = cursor.fetchone()
-        if row is None:
-            raise ValueError( f"Unknown processing version {processing_version}" )
-        return row[0]
+    return db.procver_id( processing_version, dbcon=dbcon )
+
+
+def _read_dataframe( con, q, subdict=None, fetch_size=None ):
+    """Run a query on a server-side cursor, reading the result into a DataFrame a batch at a time.
+
+    This way, all the rows of the result never exist as python tuples
+    at the same time (which takes several times the memory of the
+    DataFrame).
+
+    """
+    with db.server_cursor( con, fetch_size ) as cursor:
+        cursor.execute( q, subdict )
+        columns = [ d[0] for d in cursor.description ]
+        dfs = [ pandas.DataFrame( rows, columns=columns ) for rows in db.iter_batches( cursor ) ]
+    if len( dfs ) == 0:
+        return pandas.DataFrame( [], columns=columns )
+    if len( dfs ) == 1:
+        return dfs[0]
+    return pandas.concat( dfs, axis='index', ignore_index=True )
+
+
+def merge_photometry( forced, sources, objcol='diaobjectid', mjdcol='midpointmjdtai', patch=True ):
+    """Match up forced photometry with detections, and patch in detections that have no forced photometry.
+
+    A forced photometry point and a detection are the same measurement
+    if they have the same object, visit, and detector.  This does all
+    the matching at once with sorts over the full arrays, so it doesn't
+    matter how many objects there are.
+
+    Parameters
+    ----------
+      forced : pandas.DataFrame or dict of array-like
+        Forced photometry.  Must have columns objcol, mjdcol, visit, and
+        detector; all other columns are just carried along.
+
+      sources : pandas.DataFrame or dict of array-like
+        Detections.  Must have the same columns as forced.
+
+      objcol : str, default 'diaobjectid'
+        The column that identifies the object.  Can be anything that
+        can be sorted (e.g. ints or UUIDs).
+
+      mjdcol : str, default 'midpointmjdtai'
+        The column with the time of the observation
+
+      patch : bool, default True
+        If True, include detections that don't have corresponding forced
+        photometry.  If False, only return forced photometry.
+
+    Returns
+    -------
+      dict of numpy arrays
+
+      Has all the columns of forced, plus two bool columns:
+        isdet : True if there's a detection of this measurement
+        ispatch : True if this row came from sources rather than forced
+
+      Sorted by objcol, then mjdcol.
+
+    """
+
+    columns = list( forced.keys() )
+    nforced = len( forced[mjdcol] )
+    n = nforced + len( sources[mjdcol] )
+
+    def _both( col ):
+        return numpy.concatenate( [ numpy.asarray( forced[col] ), numpy.asarray( sources[col] ) ] )
+
+    obj = _both( objcol )
+    if obj.dtype.kind not in ( 'i', 'u' ):
+        obj = pandas.factorize( obj, sort=True )[0]
+    visit = _both( 'visit' )
+    detector = _both( 'detector' )
+    issource = numpy.zeros( n, dtype=bool )
+    issource[ nforced: ] = True
+
+    # Sort by ( object, visit, detector ); each run of equal keys is one
+    #   measurement, with (usually) one forced row, one source row, or both.
+    order = numpy.lexsort( ( issource, detector, visit, obj ) )
+    sobj = obj[ order ]
+    svisit = visit[ order ]
+    sdetector = detector[ order ]
+    sissource = issource[ order ]
+    newgroup = numpy.ones( n, dtype=bool )
+    newgroup[1:] = ( sobj[1:] != sobj[:-1] ) | ( svisit[1:] != svisit[:-1] ) | ( sdetector[1:] != sdetector[:-1] )
+    group = numpy.cumsum( newgroup ) - 1
+    ngroups = group[-1] + 1 if n > 0 else 0
+    hassource = numpy.bincount( group, weights=sissource, minlength=ngroups )[ group ] > 0
+    hasforced = numpy.bincount( group, weights=~sissource, minlength=ngroups )[ group ] > 0
+
+    keep = ~sissource
+    if patch:
+        keep |= ~hasforced
+    dex = order[ keep ]
+    isdet = hassource[ keep ]
+    ispatch = sissource[ keep ]
+
+    # Rows are still sorted by object; now sort by time within each object
+    mjdsort = numpy.lexsort( ( _both( mjdcol )[dex], obj[dex] ) )
+    dex = dex[ mjdsort ]
+
+    merged = { c: _both( c )[dex] for c in columns }
+    merged['isdet'] = isdet[ mjdsort ]
+    merged['ispatch'] = ispatch[ mjdsort ]
+    return merged
+
+
+def _ltcv_photometry( processing_version, diaobjectids, bands, which, dbcon=None, server_cursor=True ):
+    # Pull down the forced photometry and detections of objects, and match
+    #   them up with merge_photometry.  Used by both object_ltcv and
+    #   object_ltcvs, so that one object's lightcurve is the same whichever
+    #   of them you ask.  Both tables come back from one statement (a
+    #   UNION ALL, with issource saying which table each row came from),
+    #   so it's one round trip.  For a single object, the result is
+    #   small, so server_cursor=False just uses an ordinary cursor.
+    #
+    # Returns ( merged, columns ); merged is from merge_photometry,
+    #   columns is the columns that go in the lightcurve.
+
+    bandfilter = "AND band=ANY(%(bands)s) " if bands is not None else ""
+    subq = ( "SELECT diaobjectid,visit,detector,midpointmjdtai AS mjd,band,psfflux,psffluxerr,"
+             "       {issource} AS issource "
+             "FROM {table} "
+             "WHERE diaobjectid=ANY(%(ids)s::bigint[]) AND processing_version=%(pv)s " + bandfilter )
+    q = subq.format( issource='TRUE', table='diasource' )
+    if which != 'detections':
+        q += " UNION ALL " + subq.format( issource='FALSE', table='diaforcedsource' )
+
+    with db.DB( dbcon ) as dbcon:
+        subdict = { 'ids': list( diaobjectids ), 'pv': procver_int( processing_version, dbcon=dbcon ),
+                    'bands': bands }
+        if server_cursor:
+            df = _read_dataframe( dbcon, q, subdict )
+        else:
+            cursor = dbcon.cursor()
+            cursor.execute( q, subdict )
+            df = pandas.DataFrame( cursor.fetchall(), columns=[ d[0] for d in cursor.description ] )
+
+    issource = df['issource'].values.astype( bool )
+    df = df.drop( columns='issource' )
+    merged = merge_photometry( df[ ~issource ], df[ issource ], mjdcol='mjd', patch=( which != 'forced' ) )
+    columns = [ 'mjd', 'band', 'psfflux', 'psffluxerr', 'isdet' ]
+    if which != 'detections':
+        columns.append( 'ispatch' )
+    return merged, columns
+
+
+def _ltcv_json( merged, columns ):
+    retval = { c: merged[c].tolist() for c in columns }
+    # Gotta de-bool the bool columns since JSON, sadly, can't handle it
+    for c in ( 'isdet', 'ispatch' ):
+        if c in retval:
+            retval[c] = merged[c].astype( int ).tolist()
+    return retval
 
 
 def object_ltcv( processing_version, diaobjectid, return_format='json', bands=None, which='patch', dbcon=None ):
@@ -55,15 +194,18 @@ def object_ltcv( processing_version, diaobjectid, return_format='json', bands=No
 
     Returns
     -------
-       Either a pandas dataframe, or a json which is a dict of lists.
-       Fields:
+       Either a pandas dataframe, or a json which is a dict of lists,
+       sorted by mjd.  Fields (in this order):
          mjd : float
          band : str
-         flux : float
-         fluxerr : float
+         psfflux : float
+         psffluxerr : float
          isdet : bool (True if this is detected, false otherwise)
          ispatch : bool (True if this is detected but had no forced photometry, false otherwise;
-                         this field is only present if which='patch'.)
+                         this field is not present if which='detections'.)
+
+       Forced photometry and detections are matched up with
+       merge_photometry, exactly as in object_ltcvs.
 
     """
 
@@ -73,113 +215,114 @@ def object_ltcv( processing_version, diaobjectid, return_format='json', bands=No
     if return_format not in ( 'json', 'pandas' ):
         raise ValueError( f"Unknown return_format {return_format}" )
 
-    # Just pull down all sources and forced sources, and do
-    # post-processing in python.  This is going to be hundreds or
-    # thousands of points for a single object, so it's not really
-    # necessary to try to do lots of processing SQL-side to filter stuff
-    # out like we do in get_hot_ltcvs.
-    sources = []
-    forced = []
-    with db.DB( dbcon ) as dbcon:
-        pv = procver_int( processing_version, dbcon=dbcon )
-        cursor = dbcon.cursor()
-        q =  ( "SELECT midpointmjdtai AS mjd, band, psfflux, psffluxerr "
-               "FROM diasource "
-               "WHERE diaobjectid=%(id)s AND processing_version=%(pv)s " )
-        if bands is not None:
-            q += "AND band=ANY(%(bands)s) "
-        q += "ORDER BY mjd "
-        cursor.execute( q, { 'id': diaobjectid, 'pv': pv, 'bands': bands } )
-        columns = [ d[0] for d in cursor.description ]
-        sources = pandas.DataFrame( cursor.fetchall(), columns=columns )
-        if which in ( 'forced', 'patch' ):
-            q = ( "SELECT midpointmjdtai AS mjd, band, psfflux, psffluxerr "
-                  "FROM diaforcedsource "
-                  "WHERE diaobjectid=%(id)s AND processing_version=%(pv)s " )
-            if bands is not None:
-                q += "AND band=ANY(%(bands)s) "
-            q += "ORDER BY mjd "
-            cursor.execute( q, { 'id': diaobjectid, 'pv': pv, 'bands': bands } )
-            columns = [ d[0] for d in cursor.description ]
-            forced = pandas.DataFrame( cursor.fetchall(), columns=columns )
-
-    if which == 'detections':
-        # If we're only asking for detections, this is easy
-        retframe = sources
-        retframe['isdet'] = True
+    merged, columns = _ltcv_photometry( processing_version, [ int( diaobjectid ) ], bands, which,
+                                        dbcon=dbcon, server_cursor=False )
 
+    if return_format == 'pandas':
+        return pandas.DataFrame( { c: merged[c] for c in columns } )
+    elif return_format == 'json':
+        return _ltcv_json( merged, columns )
     else:
-        # Otherwise, we have to think a lot.  We need to find
-        # corresponences between forced points and source points.  I
-        # don't trust the floating-point MJDs from corresponding rows of
-        # the two tables to be identical (because you should never trust
-        # floating point numbers to be identical), so multiply them by
-        # 10⁴ and convert to bigints for matching purposes.  That gives
-        # a resolution of ~10 seconds; we're making the implicit
-        # assumption that no two exposures will have been taken less
-        # than 10 seconds apart.  Stick my head in the sand re: the edge
-        # case of two corresponding things flooring in different
-        # directions because of floating point underflow.  Going to 4
-        # decimal places = 10 digits of precision (for 5 digits in the
-        # intger part of MJD), and doubles have 15 or 16 digits of
-        # precision, so presumably we're OK, but there may still be a
-        # rare 99999 vs 000000 edge case.
-        #
-        # FUTURE NOTE : we should probably filter on visit and detector
-        # with actual LSST data!  Presumably those will be properly
-        # unique.  And, I think I populate those with SNANA, so maybe
-        # we should just do that now.  That would save us from thinking
-        # about anything floating point for joining.
-
-        forced['mjde4'] = ( forced.mjd * 10000 ).astype( numpy.int64 )
-        sources['mjde4'] = ( sources.mjd * 10000 ).astype( numpy.int64 )
-        forced.set_index( [ 'mjde4', 'band' ], inplace=True )
-        sources.set_index( [ 'mjde4', 'band' ], inplace=True )
-        joined = forced.join( sources, on=[ 'mjde4', 'band' ], how='outer',
-                              lsuffix='_f', rsuffix='_s' ).reset_index()
-        joined['isdet'] = ~joined.mjd_s.isna()
-        joined['ispatch'] = joined.mjd_f.isna()
-
-        if which == 'patch':
-            # Patch in the detections where there is no forced photometry
-            # (Pandas is mysterious; have to use ".loc" to set columns, can't
-            # use the simpler indexing you'd use to read columns.)
-            joined.loc[ joined['ispatch'], 'mjd_f' ] = joined[ joined['ispatch'] ].mjd_s
-            joined.loc[ joined['ispatch'], 'psfflux_f' ] = joined[ joined['ispatch'] ].psfflux_s
-            joined.loc[ joined['ispatch'], 'psffluxerr_f' ] = joined[ joined['ispatch'] ].psffluxerr_s
-
-        # Remove columns that don't have forced or patched photometry
-        joined = joined[ ~joined.mjd_f.isna() ]
-
-        # Remove columns we don't want to return
-        joined.drop( columns=[ 'mjd_s', 'psfflux_s', 'psffluxerr_s', 'mjde4' ], inplace=True )
-        joined.rename( inplace=True, columns={ 'mjd_f': 'mjd',
-                                               'psfflux_f': 'psfflux',
-                                               'psffluxerr_f': 'psffluxerr' } )
-        retframe = joined
-
-    retframe.sort_values( [ 'mjd', 'band' ], inplace=True )
+        raise RuntimeError( "This should never happen." )
+
+
+def object_ltcvs( processing_version, diaobjectids, return_format='json', bands=None, which='patch', dbcon=None ):
+    """Get the lightcurves for a bunch of objects
+
+    This is the same as object_ltcv, only it gets all the objects with
+    one query, so it's a lot faster than calling object_ltcv in a
+    loop.
+
+    Parameters
+    ----------
+       processing_version : int or str
+          The processing verson (or alias) to search
+
+       diaobjectids : list of int
+          The object ids.  Duplicates are ignored.
+
+       return_format : str, default 'json'
+          'json' or 'pandas'
+
+       bands, which : see object_ltcv
+
+    Returns
+    -------
+       If return_format is 'pandas', a dataframe with the same columns
+       as object_ltcv, plus diaobjectid as the first column, sorted by
+       diaobjectid and mjd.
+
+       If return_format is 'json', a dict of lists.  diaobjectid has the
+       requested object ids, sorted.  offset has one more element than
+       diaobjectid; the points for diaobjectid[i] are elements
+       offset[i]:offset[i+1] of all the other lists (mjd, band, psfflux,
+       psffluxerr, isdet, and, unless which is 'detections', ispatch).
+       Objects that have no points (including objects that don't exist)
+       have offset[i] == offset[i+1].
+
+    """
+
+    if which not in ( 'detections', 'forced', 'patch' ):
+        raise ValueError( f"Unknown value of which for object_ltcvs: {which}" )
+
+    if return_format not in ( 'json', 'pandas' ):
+        raise ValueError( f"Unknown return_format {return_format}" )
+
+    objids = numpy.unique( numpy.array( diaobjectids, dtype=numpy.int64 ) )
+    merged, columns = _ltcv_photometry( processing_version, objids, bands, which, dbcon=dbcon )
+
     if return_format == 'pandas':
-        return retframe
+        return pandas.DataFrame( { c: merged[c] for c in [ 'diaobjectid' ] + columns } )
     elif return_format == 'json':
-        retval = { c: list( joined[c].values ) for c in joined.columns }
-        # Gotta de-bool the bool columns since JSON, sadly, can't handle it
-        retval['isdet'] = [ 1 if r else 0 for r in retval['isdet'] ]
-        if ( 'ispatch' in retval ):
-            retval['ispatch'] = [ 1 if r else 0 for r in retval['ispatch'] ]
-        return retval
+        # Rows are sorted by diaobjectid, so each object's points are
+        #   a contiguous block that we can find with a binary search.
+        offsets = numpy.searchsorted( merged['diaobjectid'], objids, side='left' )
+        return { 'diaobjectid': objids.tolist(),
+                 'offset': offsets.tolist() + [ len( merged['mjd'] ) ],
+                 **_ltcv_json( merged, columns ) }
     else:
         raise RuntimeError( "This should never happen." )
 
 
-def object_search( processing_version, return_format='json', **kwargs ):
+def object_search( processing_version, return_format='json', dbcon=None, **kwargs ):
+    """Search for objects.
+
+    Parameters
+    ----------
+      processing_version : int or str
+        The processing version (or alias) to search.
+
+      return_format : str, default 'json'
+        'json' for a dict of lists, 'pandas' for a DataFrame.  Either
+        way, there's one row per object, sorted by diaobjectid.
+
+      dbcon : psycopg.Connection or None
+
+      **kwargs : search criteria
+        At least one of ra/dec (with optional radius in arcsec,
+        default 10) or one of the detection cuts is required.  The
+        detection cuts are mint_firstdetection, maxt_firstdetection,
+        mint_lastdetection, maxt_lastdetection, min_numdetections,
+        mindt_firstlastdetection, maxdt_firstlastdetection,
+        min_bandsdetected, min_lastmag, max_lastmag.  statbands (str or
+        list of str) restricts the statistics to just those bands.
+
+        For paging through big results, pass limit, and then pass the
+        last diaobjectid you got back as after_diaobjectid to get the
+        next page.  A page with fewer than limit objects is the last one.
+
+    Returns
+    -------
+      dict or pandas.DataFrame
+
+    """
     util.logger.debug( f"In object_search : kwargs = {kwargs}" )
     knownargs = { 'ra', 'dec', 'radius',
                   'mint_firstdetection', 'maxt_firstdetection',
                   'mint_lastdetection', 'maxt_lastdetection',
                   'min_numdetections', 'mindt_firstlastdetection','maxdt_firstlastdetection',
                   'min_bandsdetected', 'min_lastmag', 'max_lastmag',
-                  'statbands' }
+                  'statbands', 'after_diaobjectid', 'limit' }
     unknownargs = set( kwargs.keys() ) - knownargs
     if len( unknownargs ) != 0:
         raise ValueError( f"Unknown search keywords: {unknownargs}" )
@@ -199,23 +342,8 @@ def object_search( processing_version, return_format='json', **kwargs ):
             if not all( isinstance(b, str) for b in statbands ):
                 return TypeError( 'statbands must be a str or a list of str' )
 
-    with db.DB() as con:
-        cursor = con.cursor()
-
-        # Figure out processing version
-        try:
-            procver = int( processing_version)
-        except Exception:
-            cursor.execute( "SELECT id FROM processing_version WHERE description=%(procver)s",
-                            { 'procver': processing_version } )
-            rows = cursor.fetchall()
-            if len(rows) == 0:
-                cursor.execute( "SELECT id FROM processing_version_alias WHERE description=%(procver)s",
-                                { 'procver': processing_version } )
-                rows = cursor.fetchall()
-                if len(rows) == 0:
-                    raise ValueError( f"Unknown processing version {processing_version}" )
-            procver = rows[0][0]
+    with db.DB( dbcon ) as con:
+        procver = db.procver_id( processing_version, dbcon=con )
 
         # Filter by ra and dec if given
         ra = util.float_or_none_from_dict_float_or_hms( kwargs, 'ra' )
@@ -223,124 +351,210 @@ def object_search( processing_version, return_format='json', **kwargs ):
         if ( ra is None ) != ( dec is None ):
             raise ValueError( "Must give either both or neither of ra and dec, not just one." )
 
-        nexttable = 'diaobject'
+        subdict = { 'pv': procver, 'bands': statbands }
+        objcond = ""
         if ra is not None:
             radius = util.float_or_none_from_dict( kwargs, 'radius' )
             radius = radius if radius is not None else 10.
-            q = ( "SELECT * INTO TEMP TABLE objsearch_tmp1 "
-                  "FROM diaobject "
-                  "WHERE processing_version=%(pv)s "
-                  "AND q3c_radial_query( ra, dec, %(ra)s, %(dec)s, %(rad)s )" )
-            subdict = { 'pv': procver, 'ra': ra, 'dec': dec, 'rad': radius/3600. }
-            util.logger.debug( f"Sending query: {q} with subdict {subdict}" )
-            cursor.execute( q, subdict )
-            nexttable = 'objsearch_tmp1'
+            objcond = "AND q3c_radial_query( o.ra, o.dec, %(ra)s, %(dec)s, %(rad)s ) "
+            subdict.update( { 'ra': ra, 'dec': dec, 'rad': radius/3600. } )
+
+        # Everything else is a cut on the detection statistics
+        statconds = []
+
+        def _statcond( kw, cond, parse ):
+            val = parse( kwargs, kw )
+            if val is not None:
+                statconds.append( cond.format( kw=kw ) )
+                subdict[kw] = val
+
+        _statcond( 'mint_firstdetection', "s.firstdetmjd>=%({kw})s", util.mjd_or_none_from_dict_mjd_or_timestring )
+        _statcond( 'maxt_firstdetection', "s.firstdetmjd<=%({kw})s", util.mjd_or_none_from_dict_mjd_or_timestring )
+        _statcond( 'mint_lastdetection', "s.lastdetmjd>=%({kw})s", util.mjd_or_none_from_dict_mjd_or_timestring )
+        _statcond( 'maxt_lastdetection', "s.lastdetmjd<=%({kw})s", util.mjd_or_none_from_dict_mjd_or_timestring )
+        _statcond( 'min_numdetections', "s.ndet>=%({kw})s", util.int_or_none_from_dict )
+        _statcond( 'mindt_firstlastdetection', "(s.lastdetmjd-s.firstdetmjd)>=%({kw})s", util.float_or_none_from_dict )
+        _statcond( 'maxdt_firstlastdetection', "(s.lastdetmjd-s.firstdetmjd)<=%({kw})s", util.float_or_none_from_dict )
+        _statcond( 'min_bandsdetected', "s.nbandsdetected>=%({kw})s", util.int_or_none_from_dict )
+
+        # Fluxes are in nJy, so m = -2.5*log10(f) + 31.4.  Convert the magnitude
+        #   limits to flux limits so the cut can use the index on lastdetflux.
+        #   (Brighter is smaller magnitude, so the limits swap.)
+        min_lastmag = util.float_or_none_from_dict( kwargs, 'min_lastmag' )
+        max_lastmag = util.float_or_none_from_dict( kwargs, 'max_lastmag' )
+        if ( min_lastmag is not None ) or ( max_lastmag is not None ):
+            statconds.append( "s.lastdetflux>0" )
+        if min_lastmag is not None:
+            statconds.append( "s.lastdetflux<=%(max_lastflux)s" )
+            subdict['max_lastflux'] = 10. ** ( ( 31.4 - min_lastmag ) / 2.5 )
+        if max_lastmag is not None:
+            statconds.append( "s.lastdetflux>=%(min_lastflux)s" )
+            subdict['min_lastflux'] = 10. ** ( ( 31.4 - max_lastmag ) / 2.5 )
+
+        if ( ra is None ) and ( len( statconds ) == 0 ):
+            raise RuntimeError( "Error, no search criterion given" )
 
-        mint_firstdet = util.mjd_or_none_from_dict_mjd_or_timestring( kwargs, 'mint_firstdetection' )
-        maxt_firstdet = util.mjd_or_none_from_dict_mjd_or_timestring( kwargs, 'maxt_firstdetection' )
-        mint_lastdet = util.mjd_or_none_from_dict_mjd_or_timestring( kwargs, 'mint_lastdetection' )
-        maxt_lastdet = util.mjd_or_none_from_dict_mjd_or_timestring( kwargs, 'maxt_lastdetection' )
-        if any( i is not None for i in [ mint_firstdet, maxt_firstdet, mint_lastdet, maxt_lastdet ] ):
-            raise NotImplementedError( "Filtering by detection times not yet implemented" )
+        # Keyset pagination: results are sorted by diaobjectid, so the
+        #   next page starts after the last diaobjectid of this one.
+        after = util.int_or_none_from_dict( kwargs, 'after_diaobjectid' )
+        limit = util.int_or_none_from_dict( kwargs, 'limit' )
+        if ( limit is not None ) and ( limit <= 0 ):
+            raise ValueError( f"limit must be positive, not {limit}" )
+        if after is not None:
+            statconds.append( "s.diaobjectid>%(after)s" )
+            subdict['after'] = after
+
+        # diaobject_detstats has the statistics over all bands.  If we only want
+        #   some bands, we have to calculate them from diasource, which is slower.
+        #   (Do the positional cut first in that case, since we can.)
+        if statbands is None:
+            statsrc = "diaobject_detstats"
+        else:
+            where = "WHERE processing_version=%(pv)s AND band=ANY(%(bands)s) "
+            if ra is not None:
+                where += ( "AND diaobjectid IN ( SELECT diaobjectid FROM diaobject o "
+                           f"                    WHERE o.processing_version=%(pv)s {objcond} ) " )
+            if after is not None:
+                where += "AND diaobjectid>%(after)s "
+            statsrc = f"( {db.DiaObjectDetStats.aggregate_query( where )} )"
+
+        # The last forced source comes from a lateral join, so it's only
+        #   looked up for objects that pass all the cuts.  (Objects with
+        #   no forced photometry are dropped, which happens before the
+        #   limit, so a short page really is the last page.)
+        # For some reason, Postgres was deciding not to use the index on the forced
+        #   source query, which raised the runtime by two orders of magnitude.  Hint fixed it.
+        bandfilter = "AND f.band=ANY(%(bands)s) " if statbands is not None else ""
+        q = ( f"/*+ IndexScan(f idx_diaforcedsource_diaobjectidpv ) */ "
+              f"SELECT o.diaobjectid, o.ra, o.dec, s.ndet, "
+              f"       s.maxdetflux, s.maxdetfluxerr, s.maxdetfluxmjd, s.maxdetfluxband, "
+              f"       s.lastdetflux, s.lastdetfluxerr, s.lastdetfluxmjd, s.lastdetfluxband, "
+              f"       lf.lastforcedflux, lf.lastforcedfluxerr, lf.lastforcedfluxmjd, lf.lastforcedfluxband "
+              f"FROM {statsrc} s "
+              f"INNER JOIN diaobject o ON o.diaobjectid=s.diaobjectid AND o.processing_version=%(pv)s "
+              f"CROSS JOIN LATERAL "
+              f"  ( SELECT f.psfflux AS lastforcedflux, f.psffluxerr AS lastforcedfluxerr, "
+              f"           f.midpointmjdtai AS lastforcedfluxmjd, f.band AS lastforcedfluxband "
+              f"    FROM diaforcedsource f "
+              f"    WHERE f.diaobjectid=s.diaobjectid AND f.processing_version=%(pv)s {bandfilter}"
+              f"    ORDER BY f.midpointmjdtai DESC LIMIT 1 ) lf "
+              f"WHERE s.processing_version=%(pv)s {objcond}" )
+        for cond in statconds:
+            q += f"AND {cond} "
+        q += "ORDER BY s.diaobjectid"
+        if limit is not None:
+            q += " LIMIT %(limit)s"
+            subdict['limit'] = limit
+        util.logger.debug( f"Sending query: {q} with subdict {subdict}" )
+        if return_format == 'json':
+            with db.server_cursor( con ) as sscursor:
+                sscursor.execute( q, subdict )
+                columns = [ d[0] for d in sscursor.description ]
+                retval = { c: [] for c in columns }
+                for rows in db.iter_batches( sscursor ):
+                    for i, c in enumerate( columns ):
+                        retval[c].extend( r[i] for r in rows )
+            nobjs = len( retval[ columns[0] ] )
+
+        elif return_format == 'pandas':
+            retval = _read_dataframe( con, q, subdict )
+            nobjs = len( retval )
 
-        min_numdets = util.int_or_none_from_dict( kwargs, 'min_numdetections' )
-        if min_numdets is not None:
-            raise NotImplementedError( "Filtering by number of detections not yet implemented" )
+        else:
+            raise RuntimeError( "This should never happen." )
 
-        mindt = util.float_or_none_from_dict( kwargs, 'mindt_firstlastdetection' )
-        maxdt = util.float_or_none_from_dict( kwargs, 'maxdt_firstlastdetection' )
-        if ( mindt is not None ) or ( maxdt is not None ):
-            raise NotImplementedError( "Filtering by time between first and last detection not yet implemented" )
+        util.logger.debug( f"object_search returning {nobjs} objects in format {return_format}" )
 
-        min_bands = util.int_or_none_from_dict( kwargs, 'min_bandsdetected' )
-        if min_bands is not None:
-            raise NotImplementedError( "Filtering by number of bands detected is not yet implemented" )
+    return retval
 
-        min_lastmag = util.float_or_none_from_dict( kwargs, 'min_lastmag' )
-        max_lastmag = util.float_or_none_from_dict( kwargs, 'max_lastmag' )
-        if ( min_lastmag is not None ) or ( max_lastmag is not None ):
-            raise NotImplementedError( "Filtering by last magnitude not yet implemented" )
 
+def crossmatch( processing_version, ra, dec, radius=1., nearest=False, return_format='json', dbcon=None ):
+    """Find the objects near each of a list of positions.
 
-        if nexttable == 'diaobject':
-            raise RuntimeError( "Error, no search criterion given" )
+    Does it all with one query (a q3c_join against diaobject), so it's
+    much faster than calling object_search once per position.
 
-        q = ( f"SELECT o.diaobjectid, o.ra, o.dec, s.psfflux AS srcflux, s.psffluxerr AS srcdflux, "
-              f"       s.midpointmjdtai AS srct, s.band AS srcband "
-              f"INTO TEMP TABLE objsearch_sources "
-              f"FROM {nexttable} o "
-              f"INNER JOIN diasource s ON o.diaobjectid=s.diaobjectid AND s.processing_version=%(pv)s " )
-        if statbands is not None:
-            q += "WHERE s.band=ANY(%(bands)s) "
-        q += "ORDER BY diaobjectid, srct"
-        subdict = { 'pv': procver, 'bands': statbands }
-        util.logger.debug( f"Sending query: {q} with subdict {subdict}" )
-        cursor.execute( q, subdict )
-        q = ( "SELECT diaobjectid, ra, dec, COUNT(srcflux) AS ndet, "
-              "        NULL::real AS maxflux, NULL::real AS maxdflux, "
-              "        NULL::double precision AS maxfluxt, NULL::character(1) AS maxfluxband, "
-              "        NULL::real as lastflux, NULL::real AS lastdflux, NULL::character(1) as lastfluxband, "
-              "        NULL::double precision as lastfluxt "
-              "INTO TEMP TABLE objsearch_srcstats "
-              "FROM objsearch_sources "
-              "GROUP BY diaobjectid, ra, dec" )
-        util.logger.debug( f"Sending query {q}" )
-        cursor.execute( q )
-        q = ( "UPDATE objsearch_srcstats oss "
-              "SET maxflux=subq.srcflux, maxdflux=subq.srcdflux, maxfluxt=subq.srct, "
-              "    maxfluxband=subq.srcband "
-              "FROM ( SELECT DISTINCT ON (diaobjectid) diaobjectid, srcflux, srcdflux, srct, srcband "
-              "       FROM objsearch_sources "
-              "       ORDER BY diaobjectid, srcflux DESC ) subq "
-              "WHERE oss.diaobjectid=subq.diaobjectid" )
-        util.logger.debug( f"Sending query {q}" )
-        cursor.execute( q )
-        q = ( "UPDATE objsearch_srcstats oss "
-              "SET lastflux=subq.srcflux, lastdflux=subq.srcdflux, lastfluxt=subq.srct, "
-              "    lastfluxband=subq.srcband "
-              "FROM ( SELECT DISTINCT ON (diaobjectid) diaobjectid, srcflux, srcdflux, srct, srcband "
-              "       FROM objsearch_sources "
-              "       ORDER BY diaobjectid, srct DESC ) subq "
-              "WHERE oss.diaobjectid=subq.diaobjectid" )
-        util.logger.debug( f"Sending query {q}" )
-        cursor.execute( q )
-
-        # For some reason, Postgres was deciding not to use the index on this next query, which
-        #   raised the runtime by two orders of magnitude.  Hint fixed it.
-        q = ( "/*+ IndexScan(f idx_diaforcedsource_diaobjectidpv ) */ "
-              "SELECT DISTINCT ON (t.diaobjectid) t.diaobjectid, t.ra, t.dec, t.ndet, "
-              "    t.maxflux AS maxdetflux, t.maxdflux AS maxdetfluxerr, t.maxfluxt AS maxdetfluxmjd, "
-              "    t.maxfluxband as maxdetfluxband, "
-              "    t.lastflux AS lastdetflux, t.lastdflux AS lastdetfluxerr, t.lastfluxt AS lastdetfluxmjd, "
-              "    t.lastfluxband AS lastdetfluxband, "
-              "    f.psfflux AS lastforcedflux, f.psffluxerr AS lastforcedfluxerr, "
-              "    f.midpointmjdtai AS lastforcedfluxmjd, f.band AS lastforcedfluxband "
-              "FROM objsearch_srcstats t "
-              "INNER JOIN diaforcedsource f ON t.diaobjectid=f.diaobjectid AND f.processing_version=%(pv)s " )
-        if statbands is not None:
-            q += "WHERE f.band=ANY(%(bands)s) "
-        q += "ORDER BY t.diaobjectid, f.midpointmjdtai DESC"
-        subdict = { 'pv': procver, 'bands': statbands }
-        util.logger.debug( f"Sending query: {q} with subdict {subdict}" )
-        cursor.execute( q, subdict )
-        columns = [ d[0] for d in cursor.description ]
-        colummap = { cursor.description[i][0]: i for i in range( len(cursor.description) ) }
-        rows = cursor.fetchall()
+    Parameters
+    ----------
+      processing_version : int or str
+        The processing version (or alias) of the objects to match.
 
-        util.logger.debug( f"object_search returning {len(rows)} objects in format {return_format}" )
+      ra, dec : list or array of float
+        Positions in degrees; must be the same length.
 
-    if return_format == 'json':
-        return { c: [ r[colummap[c]] for r in rows ] for c in columns }
+      radius : float, default 1.
+        Match radius in arcseconds.
 
-    elif return_format == 'pandas':
-        return pandas.DataFrame( rows, columns=columns )
+      nearest : bool, default False
+        If True, only return the closest object for each position.
+        Otherwise, return all objects within radius.
 
-    else:
-        raise RuntimeError( "This should never happen." )
+      return_format : str, default 'json'
+        'json' or 'pandas'
+
+      dbcon : psycopg.Connection or None
+        This makes a temp table, so it can't be a read-only connection.
+
+    Returns
+    -------
+      A dict of lists (json) or a DataFrame (pandas) with one row per
+      match, sorted by posindex and then separation.  Columns are
+      posindex (index into ra and dec), diaobjectid, ra, dec, and sep
+      (separation in arcsec).  Positions with no matches don't show up.
+
+    """
+    if return_format not in ( 'json', 'pandas' ):
+        raise ValueError( f"Unknown return format {return_format}" )
+
+    ra = numpy.asarray( ra, dtype=numpy.float64 )
+    dec = numpy.asarray( dec, dtype=numpy.float64 )
+    if ( ra.ndim != 1 ) or ( ra.shape != dec.shape ):
+        raise ValueError( f"ra and dec must be 1d and the same length; got shapes {ra.shape} and {dec.shape}" )
+    if not ( numpy.all( numpy.isfinite( ra ) ) and numpy.all( numpy.isfinite( dec ) ) ):
+        raise ValueError( "ra and dec must all be finite" )
+    if numpy.any( numpy.abs( dec ) > 90. ):
+        raise ValueError( "dec must be between -90 and 90" )
+    radius = float( radius )
+    if radius <= 0.:
+        raise ValueError( f"radius must be positive, not {radius}" )
+
+    with db.DB( dbcon ) as con:
+        procver = db.procver_id( processing_version, dbcon=con )
+        cursor = con.cursor()
+        cursor.execute( "CREATE TEMP TABLE crossmatch_positions( posindex integer, ra double precision, "
+                        "                                        dec double precision ) ON COMMIT DROP" )
+        with cursor.copy( "COPY crossmatch_positions(posindex,ra,dec) FROM STDIN (FORMAT BINARY)" ) as copier:
+            copier.set_types( [ 'int4', 'float8', 'float8' ] )
+            for row in zip( range( len(ra) ), ra.tolist(), dec.tolist() ):
+                copier.write_row( row )
+        cursor.execute( "ANALYZE crossmatch_positions" )
+
+        distinct = "DISTINCT ON (p.posindex) " if nearest else ""
+        q = ( f"SELECT {distinct}p.posindex, o.diaobjectid, o.ra, o.dec, "
+              f"       q3c_dist( p.ra, p.dec, o.ra, o.dec ) * 3600. AS sep "
+              f"FROM crossmatch_positions p "
+              f"INNER JOIN diaobject o "
+              f"  ON q3c_join( p.ra, p.dec, o.ra, o.dec, %(rad)s ) AND o.processing_version=%(pv)s "
+              f"ORDER BY p.posindex, sep" )
+        subdict = { 'pv': procver, 'rad': radius / 3600. }
+        util.logger.debug( f"crossmatch: {len(ra)} positions, sending query {q} with subdict {subdict}" )
+        if return_format == 'pandas':
+            retval = _read_dataframe( con, q, subdict )
+            nmatch = len( retval )
+        else:
+            cursor.execute( q, subdict )
+            columns = [ d[0] for d in cursor.description ]
+            rows = cursor.fetchall()
+            retval = { c: [ r[i] for r in rows ] for i, c in enumerate( columns ) }
+            nmatch = len( rows )
+        cursor.execute( "DROP TABLE crossmatch_positions" )
+
+    util.logger.debug( f"crossmatch returning {nmatch} matches" )
+    return retval
 
 
 def get_hot_ltcvs( processing_version, detected_since_mjd=None, detected_in_last_days=None,
-                   mjd_now=None, source_patch=False, include_hostinfo=False ):
+                   mjd_now=None, source_patch=False, include_hostinfo=False, changed_since=None, dbcon=None ):
     """Get lightcurves of objects with a recent detection.
 
     Parameters
@@ -383,6 +597,18 @@ def get_hot_ltcvs( processing_version, detected_since_mjd=None, detected_in_last
       include_hostinfo : bool, default False
         If true, return a second data frame with information about the hosts.
 
+      changed_since : int, default None
+        An ingest batch id (see db.IngestBatch).  If given, only return
+        the hot objects that got new sources or forced sources in an
+        ingest batch after this one.  To poll for changes, call
+        db.IngestBatch.latest() *before* calling this function, and pass
+        what it returned as changed_since the next time.  (Get it before
+        so that you don't miss anything imported while this function
+        runs; the price is that you may get some objects twice.)
+
+      dbcon : psycopg.Connection or None
+        Database connection to use.  If None, will get one from db.DB().
+
       Returns
       -------
         ( pandas.DataFrame, pandas.DataFrame or None )
@@ -447,6 +673,126 @@ def get_hot_ltcvs( processing_version, detected_since_mjd=None, detected_in_last
 
     """
 
+    mjd0, mjd_now = _hot_ltcv_mjd_range( detected_since_mjd, detected_in_last_days, mjd_now )
+
+    with db.DB( dbcon ) as con:
+        with con.cursor() as cursor:
+            subdict, hostq, forcedq, sourceq = _hot_ltcv_queries( cursor, processing_version, mjd0, mjd_now,
+                                                                  source_patch, include_hostinfo, changed_since )
+
+        hostdf = None if hostq is None else _read_dataframe( con, hostq, subdict )
+
+        forceddf = _read_dataframe( con, forcedq, subdict )
+        sourcedf = None if sourceq is None else _read_dataframe( con, sourceq, subdict )
+
+    return _hot_ltcv_merge( forceddf, sourcedf ), hostdf
+
+
+def iter_hot_ltcvs( processing_version, detected_since_mjd=None, detected_in_last_days=None,
+                    mjd_now=None, source_patch=False, include_hostinfo=False, changed_since=None,
+                    objects_per_chunk=1000, fetch_size=None, dbcon=None ):
+    """Like get_hot_ltcvs, but a generator that yields the lightcurves a chunk of objects at a time.
+
+    Use this instead of get_hot_ltcvs when there might be a lot of hot
+    objects.  The lightcurve (and host) rows are read from server-side
+    cursors, and a chunk is yielded as soon as it has objects_per_chunk
+    complete objects, so memory use depends on objects_per_chunk, not
+    on how many objects there are.  The database connection is held
+    until the generator is exhausted or closed.
+
+    Parameters
+    ----------
+      processing_version, detected_since_mjd, detected_in_last_days, mjd_now, source_patch, include_hostinfo,
+      changed_since
+        See get_hot_ltcvs.
+
+      objects_per_chunk : int, default 1000
+        Number of objects in each chunk yielded (except for the last
+        one, which may have fewer).
+
+      fetch_size : int or None
+        Number of rows at a time to pull from the database.  Defaults
+        to config.db_fetch_size.
+
+      dbcon : psycopg.Connection or None
+        Database connection to use.  If None, will get one from db.DB().
+        If you pass one, don't commit or roll it back until you're done
+        iterating.
+
+    Yields
+    ------
+      ( pandas.DataFrame, pandas.DataFrame or None )
+
+      Just like what get_hot_ltcvs returns, only each has just the rows
+      for one chunk of objects.  All of the rows for a given rootid are
+      in the same chunk.  Chunks come in order of rootid.
+
+    """
+
+    mjd0, mjd_now = _hot_ltcv_mjd_range( detected_since_mjd, detected_in_last_days, mjd_now )
+    objects_per_chunk = max( int( objects_per_chunk ), 1 )
+
+    with db.DB( dbcon ) as con:
+        with con.cursor() as cursor:
+            subdict, hostq, forcedq, sourceq = _hot_ltcv_queries( cursor, processing_version, mjd0, mjd_now,
+                                                                  source_patch, include_hostinfo, changed_since )
+
+        # All three queries are sorted by rootid, so read them all at
+        #   the same time and merge them object by object.
+        with contextlib.ExitStack() as stack:
+            columns = {}
+            streams = []
+            for what, q in [ ( 'forced', forcedq ), ( 'source', sourceq ), ( 'host', hostq ) ]:
+                if q is None:
+                    continue
+                cursor = stack.enter_context( db.server_cursor( con, fetch_size ) )
+                cursor.execute( q, subdict )
+                columns[what] = [ d[0] for d in cursor.description ]
+                streams.append( _rootid_groups( cursor, what ) )
+
+            rows = { what: [] for what in columns }
+            nobjs = 0
+            lastrootid = None
+            for rootid, what, grouprows in heapq.merge( *streams, key=operator.itemgetter(0) ):
+                if rootid != lastrootid:
+                    if nobjs == objects_per_chunk:
+                        yield _hot_ltcv_chunk( columns, rows )
+                        rows = { what: [] for what in columns }
+                        nobjs = 0
+                    nobjs += 1
+                    lastrootid = rootid
+                rows[what].extend( grouprows )
+
+            if nobjs > 0:
+                yield _hot_ltcv_chunk( columns, rows )
+
+
+def _rootid_groups( cursor, what ):
+    for rootid, grouprows in itertools.groupby( cursor, key=operator.itemgetter(0) ):
+        yield rootid, what, list( grouprows )
+
+
+def _hot_ltcv_chunk( columns, rows ):
+    df = pandas.DataFrame( rows['forced'], columns=columns['forced'] )
+    sourcedf = pandas.DataFrame( rows['source'], columns=columns['source'] ) if 'source' in columns else None
+    hostdf = pandas.DataFrame( rows['host'], columns=columns['host'] ) if 'host' in columns else None
+    return _hot_ltcv_merge( df, sourcedf ), hostdf
+
+
+def _hot_ltcv_merge( forceddf, sourcedf ):
+    # Patch the detections that don't have forced photometry into the forced photometry
+    if sourcedf is None:
+        forceddf['is_source'] = False
+        return forceddf
+    merged = merge_photometry( forceddf, sourcedf, objcol='rootid' )
+    df = pandas.DataFrame( { c: merged[c] for c in forceddf.columns } )
+    df['is_source'] = merged['ispatch']
+    return df
+
+
+def _hot_ltcv_mjd_range( detected_since_mjd, detected_in_last_days, mjd_now ):
+    """Returns ( mjd0, mjd_now ) for get_hot_ltcvs and iter_hot_ltcvs."""
+
     mjd0 = None
 
     if detected_since_mjd is not None:
@@ -466,119 +812,127 @@ def get_hot_ltcvs( processing_version, detected_since_mjd=None, detected_in_last
         mjd0 = astropy.time.Time( datetime.datetime.now( tz=datetime.UTC )
                                   - datetime.timedelta( days=lastdays ) ).mjd
 
+    return mjd0, mjd_now
+
+
+def _hot_ltcv_queries( cursor, processing_version, mjd0, mjd_now, source_patch, include_hostinfo,
+                       changed_since=None ):
+    """Find the hot objects, and make the queries that get_hot_ltcvs and iter_hot_ltcvs need.
+
+    Returns ( subdict, hostq, forcedq, sourceq ).  hostq is None unless
+    include_hostinfo is True, sourceq is None unless source_patch is
+    True.  All of the queries return rows sorted by rootid.
+
+    The root ids of the hot objects are passed to the queries as an
+    array in subdict (rather than being put in a temp table), so this
+    all works on a read-only connection (e.g. db.DB( readonly=True )).
+
+    """
+
     bands = [ 'u', 'g', 'r', 'i', 'z', 'y' ]
 
-    with db.DB() as con:
-        with con.cursor() as cursor:
-            # Figure out the processing version
-            cursor.execute( "SELECT id FROM processing_version WHERE description=%(procver)s",
-                            { 'procver': processing_version } )
-            rows = cursor.fetchall()
-            if len(rows) == 0:
-                cursor.execute( "SELECT id FROM processing_version_alias WHERE description=%(procver)s",
-                                { 'procver': processing_version } )
-                rows = cursor.fetchall()
-            if len(rows) == 0:
-                raise ValueError( f"Could not find processing version '{processing_version}'" )
-            procver = rows[0][0]
-
-            # First : get a table of all the object ids (root object ids)
-            #   that have a detection (i.e. a diasource) in the
-            #   desired time period.
-
-            q = ( "/*+ NoBitmapScan(elasticc2_diasource)\n"
-                  "*/\n"
-                  "SELECT DISTINCT ON(dorm.rootid) rootid "
-                  "INTO TEMP TABLE tmp_objids "
-                  "FROM diaobject_root_map dorm "
-                  "INNER JOIN diasource s ON (s.diaobjectid=dorm.diaobjectid AND "
-                  "                           s.processing_version=dorm.processing_version )"
-                  "WHERE s.processing_version=%(procver)s AND s.midpointmjdtai>=%(t0)s" )
-            if mjd_now is not None:
-                q += "  AND midpointmjdtai<=%(t1)s"
-            cursor.execute( q, { 'procver': procver, 't0': mjd0, 't1': mjd_now } )
-
-            # Second : pull out host info for those objects if requested
-            # TODO : right now it just pulls out nearby extended object 1.
-            # make it configurable to get up to all three.
-            hostdf = None
-            if include_hostinfo:
-                q = "SELECT DISTINCT ON (r.rootid) r.rootid,"
-                for bandi in range( len(bands)-1 ):
-                    q += ( f"h.stdcolor_{bands[bandi]}_{bands[bandi+1]},"
-                           f"h.stdcolor_{bands[bandi]}_{bands[bandi+1]}_err," )
-                q += ( "h.petroflux_r,h.petroflux_r_err,o.nearbyextobj1sep,h.pzmean,h.pzstd "
-                       "FROM diaobject_root_map r "
-                       "INNER JOIN diaobject o ON ( r.diaobjectid=o.diaobjectid AND "
-                       "                            r.processing_version=o.processing_version ) "
-                       "INNER JOIN host_galaxy h ON o.nearbyextobj1id=h.id "
-                       "WHERE r.rootid IN (SELECT rootid FROM tmp_objids) "
-                       "  AND o.processing_version=%(procver)s "
-                       "ORDER BY r.rootid" )
-                cursor.execute( q, { 'procver': procver} )
-                columns = [ cursor.description[i][0] for i in range( len(cursor.description) ) ]
-                hostdf = pandas.DataFrame( cursor.fetchall(), columns=columns )
-
-
-            # Third : pull out all the forced photometry
-            # THOUGHT REQUIRED : do we want midmpointmjdtai to stop at mjd_now-1 rather
-            #   than mjd_now?  It depends what you mean.  If you want mjd_now to mean
-            #   "data through this date" then don't stop a day early.  If you mean
-            #   "simulate what we knew on this date"), then do stop a day early, because
-            #   forced photometry will be coming out with a delay of a ~day.
-            q = ( "/*+ IndexScan(f idx_diaforcedsource_diaobjectidpv)\n"
-                  "    IndexScan(o)\n"
-                  "*/\n"
-                  "SELECT r.rootid AS rootid, o.ra AS ra, o.dec AS dec,"
-                   "     f.diaforcedsourceid AS sourceid,f.visit,f.detector,f.midpointmjdtai,f.band,"
-                   "     f.psfflux,f.psffluxerr "
-                   "FROM diaforcedsource f "
-                   "INNER JOIN diaobject o ON (f.diaobjectid=o.diaobjectid AND "
-                   "                           f.diaobject_procver=o.processing_version) "
-                   "INNER JOIN diaobject_root_map r ON (o.diaobjectid=r.diaobjectid AND "
-                   "                                    o.processing_version=r.processing_version) "
-                   "WHERE r.rootid IN (SELECT rootid FROM tmp_objids) "
-                   "  AND f.processing_version=%(procver)s" )
-            if mjd_now is not None:
-                q += "  AND f.midpointmjdtai<=%(t1)s "
-            q += "ORDER BY r.rootid,f.midpointmjdtai"
-            cursor.execute( q, { "procver": procver, "t1": mjd_now } )
-            columns = [ cursor.description[i][0] for i in range( len(cursor.description) ) ]
-            forceddf = pandas.DataFrame( cursor.fetchall(), columns=columns )
-            forceddf['is_source'] = False
-
-            # Fourth: if we've been asked to patch in sources where forced sources are
-            #   missing, pull those down and concatenate them into the dataframe.
-            # TODO : figure out the right hints to give when these tables
-            #   are big!
-            sourcedf = None
-            if source_patch:
-                q = ( "/*+ IndexScan(s idx_diasource_diaobjectidpv)\n"
-                      "    IndexScan(f idx_diaforcedsource_diaobjectidpv)\n"
-                      "    IndexScan(o)\n"
-                      "*/\n"
-                      "SELECT r.rootid,o.ra,o.dec,s.diasourceid AS sourceid,s.visit,s.detector,"
-                      "       s.midpointmjdtai,s.band,s.psfflux,s.psffluxerr "
-                      "FROM diasource s "
-                      "INNER JOIN diaobject o ON (s.diaobjectid=o.diaobjectid AND "
-                      "                           s.diaobject_procver=o.processing_version) "
-                      "INNER JOIN diaobject_root_map r ON (o.diaobjectid=r.diaobjectid AND "
-                      "                                    o.processing_version=r.processing_version) "
-                      "LEFT JOIN diaforcedsource f ON (f.diaobjectid=s.diaobjectid AND "
-                      "                                f.diaobject_procver=s.diaobject_procver AND "
-                      "                                f.visit=s.visit AND "
-                      "                                f.detector=s.detector) "
-                      "WHERE r.rootid IN (SELECT rootid FROM tmp_objids) "
-                      "  AND s.processing_version=%(procver)s "
-                      "  AND f.diaobjectid IS NULL " )
-                if mjd_now is not None:
-                    q += "  AND s.midpointmjdtai<=%(t1)s "
-                q += "ORDER BY r.rootid,s.midpointmjdtai"
-                cursor.execute( q, { "procver": procver, "t1": mjd_now } )
-                columns = [ cursor.description[i][0] for i in range( len(cursor.description) ) ]
-                sourcedf = pandas.DataFrame( cursor.fetchall(), columns=columns )
-                sourcedf['is_source'] = True
-                forceddf = pandas.concat( [ forceddf, sourcedf ], axis='index' )
-                forceddf.sort_values( [ 'rootid', 'midpointmjdtai' ], inplace=True )
-
-    return forceddf, hostdf
+    procver = db.procver_id( processing_version, must_exist=True, dbcon=cursor.connection )
+    subdict = { 'procver': procver, 't0': mjd0, 't1': mjd_now }
+
+    # First : get all the object ids (root object ids)
+    #   that have a detection (i.e. a diasource) in the
+    #   desired time period.
+
+    if changed_since is None:
+        q = ( "/*+ NoBitmapScan(elasticc2_diasource)\n"
+              "*/\n"
+              "SELECT DISTINCT ON(dorm.rootid) rootid "
+              "FROM diaobject_root_map dorm "
+              "INNER JOIN diasource s ON (s.diaobjectid=dorm.diaobjectid AND "
+              "                           s.processing_version=dorm.processing_version )"
+              "WHERE s.processing_version=%(procver)s AND s.midpointmjdtai>=%(t0)s" )
+        if mjd_now is not None:
+            q += "  AND midpointmjdtai<=%(t1)s"
+    else:
+        # Start from the (hopefully few) objects that changed since the
+        #   given ingest batch, and then check each one for a detection
+        #   in the time period, rather than scanning all of the sources in
+        #   the time period.
+        try:
+            subdict['since'] = int( changed_since )
+        except ( TypeError, ValueError ):
+            raise ValueError( f"changed_since must be an integer ingest batch id, not {changed_since!r}" )
+        q = ( "SELECT DISTINCT ON(dorm.rootid) rootid "
+              "FROM diaobject_detstats d "
+              "INNER JOIN diaobject_root_map dorm ON (d.diaobjectid=dorm.diaobjectid AND "
+              "                                       d.processing_version=dorm.processing_version) "
+              "WHERE d.processing_version=%(procver)s AND d.last_ingest_batch>%(since)s "
+              "  AND EXISTS ( SELECT 1 FROM diasource s "
+              "               WHERE s.diaobjectid=d.diaobjectid AND s.processing_version=d.processing_version "
+              "                 AND s.midpointmjdtai>=%(t0)s" )
+        if mjd_now is not None:
+            q += " AND s.midpointmjdtai<=%(t1)s"
+        q += " )"
+    cursor.execute( q, subdict )
+    subdict['rootids'] = [ row[0] for row in cursor.fetchall() ]
+
+    # Second : host info for those objects if requested
+    # TODO : right now it just pulls out nearby extended object 1.
+    # make it configurable to get up to all three.
+    hostq = None
+    if include_hostinfo:
+        hostq = "SELECT DISTINCT ON (r.rootid) r.rootid,"
+        for bandi in range( len(bands)-1 ):
+            hostq += ( f"h.stdcolor_{bands[bandi]}_{bands[bandi+1]},"
+                       f"h.stdcolor_{bands[bandi]}_{bands[bandi+1]}_err," )
+        hostq += ( "h.petroflux_r,h.petroflux_r_err,o.nearbyextobj1sep,h.pzmean,h.pzstd "
+                   "FROM diaobject_root_map r "
+                   "INNER JOIN diaobject o ON ( r.diaobjectid=o.diaobjectid AND "
+                   "                            r.processing_version=o.processing_version ) "
+                   "INNER JOIN host_galaxy h ON o.nearbyextobj1id=h.id "
+                   "WHERE r.rootid=ANY(%(rootids)s::uuid[]) "
+                   "  AND o.processing_version=%(procver)s "
+                   "ORDER BY r.rootid" )
+
+    # Third : all the forced photometry
+    # THOUGHT REQUIRED : do we want midmpointmjdtai to stop at mjd_now-1 rather
+    #   than mjd_now?  It depends what you mean.  If you want mjd_now to mean
+    #   "data through this date" then don't stop a day early.  If you mean
+    #   "simulate what we knew on this date"), then do stop a day early, because
+    #   forced photometry will be coming out with a delay of a ~day.
+    forcedq = ( "/*+ IndexScan(f idx_diaforcedsource_diaobjectidpv)\n"
+                "    IndexScan(o)\n"
+                "*/\n"
+                "SELECT r.rootid AS rootid, o.ra AS ra, o.dec AS dec,"
+                "     f.diaforcedsourceid AS sourceid,f.visit,f.detector,f.midpointmjdtai,f.band,"
+                "     f.psfflux,f.psffluxerr "
+                "FROM diaforcedsource f "
+                "INNER JOIN diaobject o ON (f.diaobjectid=o.diaobjectid AND "
+                "                           f.diaobject_procver=o.processing_version) "
+                "INNER JOIN diaobject_root_map r ON (o.diaobjectid=r.diaobjectid AND "
+                "                                    o.processing_version=r.processing_version) "
+                "WHERE r.rootid=ANY(%(rootids)s::uuid[]) "
+                "  AND f.processing_version=%(procver)s" )
+    if mjd_now is not None:
+        forcedq += "  AND f.midpointmjdtai<=%(t1)s "
+    forcedq += "ORDER BY r.rootid,f.midpointmjdtai"
+
+    # Fourth: if we've been asked to patch in sources where forced sources are
+    #   missing, the sources.  (_hot_ltcv_merge figures out which ones
+    #   don't have a matching forced source.)
+    # TODO : figure out the right hints to give when these tables
+    #   are big!
+    sourceq = None
+    if source_patch:
+        sourceq = ( "/*+ IndexScan(s idx_diasource_diaobjectidpv)\n"
+                    "    IndexScan(o)\n"
+                    "*/\n"
+                    "SELECT r.rootid,o.ra,o.dec,s.diasourceid AS sourceid,s.visit,s.detector,"
+                    "       s.midpointmjdtai,s.band,s.psfflux,s.psffluxerr "
+                    "FROM diasource s "
+                    "INNER JOIN diaobject o ON (s.diaobjectid=o.diaobjectid AND "
+                    "                           s.diaobject_procver=o.processing_version) "
+                    "INNER JOIN diaobject_root_map r ON (o.diaobjectid=r.diaobjectid AND "
+                    "                                    o.processing_version=r.processing_version) "
+                    "WHERE r.rootid=ANY(%(rootids)s::uuid[]) "
+                    "  AND s.processing_version=%(procver)s " )
+        if mjd_now is not None:
+            sourceq += "  AND s.midpointmjdtai<=%(t1)s "
+        sourceq += "ORDER BY r.rootid,s.midpointmjdtai"
+
+    return subdict, hostq, forcedq, sourceq
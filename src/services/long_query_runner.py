@@ -14,6 +14,7 @@ import psycopg
 import psycopg.rows
 
 import config
+import db
 
 _loglevel = logging.DEBUG
 
@@ -57,9 +58,11 @@ class QueryRunner:
 
     @contextmanager
     def conn( self ):
+        # User queries go to a read-only replica if there is one, so they don't compete with ingestion
         try:
-            conn = psycopg.connect( host=self.dbhost, port=self.dbport, dbname=self.dbname,
-                                    user=self.rodbuser, password=self.rodbpasswd )
+            conn = db.connect_readonly( lambda host, port: psycopg.connect( host=host, port=port, dbname=self.dbname,
+                                                                            user=self.rodbuser,
+                                                                            password=self.rodbpasswd ) )
             yield conn
         finally:
             conn.rollback()
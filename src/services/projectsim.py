@@ -151,16 +151,29 @@ class AlertReconstructor:
         return dicts
 
 
+    def _previous_sources_query( self, diasource ):
+        q = ( "SELECT * FROM ppdb_diasource WHERE diaobjectid=%(objid)s "
+              "AND midpointmjdtai>=%(minmjd)s AND midpointmjdtai<%(maxmjd)s "
+              "AND diasourceid!=%(srcid)s ORDER BY midpointmjdtai" )
+        return q, { 'objid': diasource['diaObjectId'],
+                    'srcid': diasource['diaSourceId'],
+                    'minmjd': diasource['midpointMjdTai'] - self.prevsrc,
+                    'maxmjd': diasource['midpointMjdTai'] }
+
+
+    def _previous_forced_sources_query( self, diasource ):
+        q = ( "SELECT * FROM ppdb_diaforcedsource WHERE diaobjectid=%(objid)s "
+              "AND midpointmjdtai>%(minmjd)s AND midpointmjdtai<%(maxmjd)s "
+              "ORDER BY midpointmjdtai" )
+        return q, { 'objid': diasource['diaObjectId'],
+                    'minmjd': diasource['midpointMjdTai'] - self.prevfrced,
+                    'maxmjd': diasource['midpointMjdTai'] - self.prevfrced_gap }
+
+
     def previous_sources( self, diasource, con=None ):
         with db.DB( con ) as con:
             cursor = con.cursor()
-            q = ( "SELECT * FROM ppdb_diasource WHERE diaobjectid=%(objid)s "
-                  "AND midpointmjdtai>=%(minmjd)s AND midpointmjdtai<%(maxmjd)s "
-                  "AND diasourceid!=%(srcid)s ORDER BY midpointmjdtai" )
-            cursor.execute( q, { 'objid': diasource['diaObjectId'],
-                                 'srcid': diasource['diaSourceId'],
-                                 'minmjd': diasource['midpointMjdTai'] - self.prevsrc,
-                                 'maxmjd': diasource['midpointMjdTai'] } )
+            cursor.execute( *self._previous_sources_query( diasource ) )
             columns = { col_desc[0]: i for i, col_desc in enumerate(cursor.description) }
             rows = cursor.fetchall()
 
@@ -171,12 +184,7 @@ class AlertReconstructor:
         t0 = time.perf_counter()
         with db.DB( con ) as con:
             cursor = con.cursor()
-            q = ( "SELECT * FROM ppdb_diaforcedsource WHERE diaobjectid=%(objid)s "
-                  "AND midpointmjdtai>%(minmjd)s AND midpointmjdtai<%(maxmjd)s "
-                  "ORDER BY midpointmjdtai" )
-            cursor.execute( q, { 'objid': diasource['diaObjectId'],
-                                 'minmjd': diasource['midpointMjdTai'] - self.prevfrced,
-                                 'maxmjd': diasource['midpointMjdTai'] - self.prevfrced_gap } )
+            cursor.execute( *self._previous_forced_sources_query( diasource ) )
             columns = { col_desc[0]: i for i, col_desc in enumerate(cursor.description) }
             rows = cursor.fetchall()
 
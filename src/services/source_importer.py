@@ -2,8 +2,9 @@ import re
 import datetime
 import argparse
 
+import numpy as np
+
 import db
-import psycopg.rows
 
 
 class SourceImporter:
@@ -58,14 +59,12 @@ class SourceImporter:
         self.object_match_radius = float( object_match_radius )
 
 
-    def _read_mongo_fields( self, pqconn, collection, pipeline, fields, temptable, liketable,
+    def _read_mongo_fields( self, pqconn, collection, pipeline, fields, temptable, likecls,
                             t0=None, t1=None, batchsize=10000, procver_fields=['processing_version'] ):
         if not re.search( "^[a-zA-Z0-9_]+$", temptable ):
             raise ValueError( f"Invalid temp table name {temptable}" )
-        if not re.search( "^[a-zA-Z0-9_]+$", liketable ):
-            raise ValueError( f"Invalid temp table name {liketable}" )
         pqcursor = pqconn.cursor()
-        pqcursor.execute( f"CREATE TEMP TABLE {temptable} (LIKE {liketable})" )
+        pqcursor.execute( f"CREATE TEMP TABLE {temptable} (LIKE {likecls.__tablename__})" )
 
         if ( t0 is not None ) or ( t1 is not None ):
             if ( t0 is not None ) and ( t1 is not None ):
@@ -76,17 +75,25 @@ class SourceImporter:
             else:
                 pipeline.insert( 0, { "$match": { "savetime": { "$lte": t1 } } } )
 
-        mongocursor = collection.aggregate( pipeline )
-        writefields = list( fields )
-        writefields.extend( procver_fields )
-        procverextend = [ self.processing_version for i in procver_fields ]
-        with pqcursor.copy( f"COPY {temptable}({','.join(writefields)}) FROM STDIN" ) as pgcopy:
-            for row in mongocursor:
-                # This is probably inefficient.  Generator to list to tuple.  python makes
-                #   writing this easy, but it's probably doing multiple gratuitous memory copies
-                data = [ None if row[f] is None else str(row[f]) for f in fields ]
-                data.extend( procverextend )
-                pgcopy.write_row( tuple( data ) )
+        mongocursor = collection.aggregate( pipeline, batchSize=batchsize )
+        batch = []
+        for row in mongocursor:
+            batch.append( row )
+            if len( batch ) >= batchsize:
+                self._copy_mongo_batch( pqcursor, temptable, likecls, fields, procver_fields, batch )
+                batch = []
+        if len( batch ) > 0:
+            self._copy_mongo_batch( pqcursor, temptable, likecls, fields, procver_fields, batch )
+
+
+    def _copy_mongo_batch( self, pqcursor, temptable, likecls, fields, procver_fields, batch ):
+        # Turn the batch of mongo documents into columns, and let
+        #   copy_columnar_data send them to postgres with a binary COPY.
+        n = len( batch )
+        data = { f: np.fromiter( ( row[f] for row in batch ), dtype=object, count=n ) for f in fields }
+        for f in procver_fields:
+            data[f] = np.full( n, self.processing_version, dtype=np.int64 )
+        likecls.copy_columnar_data( pqcursor, temptable, data )
 
 
     def read_mongo_objects( self, pqconn, collection, t0=None, t1=None, batchsize=10000 ):
@@ -118,7 +125,7 @@ class SourceImporter:
         group.update( { k: { "$first": f"$msg.diaObject.{k}" } for k in fields } )
         pipeline = [ { "$group": group } ]
 
-        self._read_mongo_fields( pqconn, collection, pipeline, fields, "temp_diaobject_import", "diaobject",
+        self._read_mongo_fields( pqconn, collection, pipeline, fields, "temp_diaobject_import", db.DiaObject,
                                  t0=t0, t1=t1, batchsize=batchsize )
 
 
@@ -137,7 +144,7 @@ class SourceImporter:
         group.update( { k: { "$first": f"$msg.diaSource.{k}" } for k in fields } )
         pipeline = [ { "$group": group } ]
 
-        self._read_mongo_fields( pqconn, collection, pipeline, fields, "temp_diasource_import", "diasource",
+        self._read_mongo_fields( pqconn, collection, pipeline, fields, "temp_diasource_import", db.DiaSource,
                                  t0=t0, t1=t1, batchsize=batchsize,
                                  procver_fields=[ 'processing_version', 'diaobject_procver' ] )
 
@@ -159,7 +166,7 @@ class SourceImporter:
         pipeline = [ { "$unwind": "$msg.prvDiaSources" },
                      { "$group": group } ]
 
-        self._read_mongo_fields( pqconn, collection, pipeline, fields, "temp_prvdiasource_import", "diasource",
+        self._read_mongo_fields( pqconn, collection, pipeline, fields, "temp_prvdiasource_import", db.DiaSource,
                                  t0=t0, t1=t1, batchsize=batchsize,
                                  procver_fields=[ 'processing_version', 'diaobject_procver' ] )
 
@@ -182,7 +189,7 @@ class SourceImporter:
                      { "$group": group } ]
 
         self._read_mongo_fields( pqconn, collection, pipeline, fields, "temp_prvdiaforcedsource_import",
-                                 "diaforcedsource", t0=t0, t1=t1, batchsize=batchsize,
+                                 db.DiaForcedSource, t0=t0, t1=t1, batchsize=batchsize,
                                  procver_fields=[ 'processing_version', 'diaobject_procver' ] )
 
 
@@ -314,7 +321,9 @@ class SourceImporter:
         alerts saved to the collection between when the last time this
         function ran and the current time.  Will impport all diaobject,
         diasource, and diaforcedsource rows that are in the mongodb
-        collection but not yet in PostgreSQL.
+        collection but not yet in PostgreSQL.  Also updates
+        diaobject_detstats for all objects that got new sources or
+        forced sources, marking them with a new ingest_batch.
 
         Parameters
         ----------
@@ -362,6 +371,15 @@ class SourceImporter:
             nprvsrc = self.import_prvsources_from_collection( collection, t0, t1, conn=pqconn, commit=False )
             nprvfrc = self.import_prvforcedsources_from_collection( collection, t0, t1, conn=pqconn, commit=False )
 
+            # Bring the detection statistics up to date for every object that
+            #   got new sources or forced sources, and mark them as part of this
+            #   ingest batch.  (IngestBatch.new locks a table until we commit,
+            #   so do this last.)
+            batch = db.IngestBatch.new( pqconn, description=collection.name )
+            db.DiaObjectDetStats.recompute( fromtable=[ 'temp_diasource_import', 'temp_prvdiasource_import',
+                                                        'temp_prvdiaforcedsource_import' ],
+                                            ingest_batch=batch, dbcon=pqconn, commit=False )
+
             if timestampexists:
                 cursor.execute( "UPDATE diasource_import_time SET t=%(t)s WHERE collection=%(col)s",
                                 { 't': t1, 'col': collection.name } )
@@ -390,28 +408,8 @@ def main():
                          help="MongoDB collection to import from" )
     args = parser.parse_args()
 
-    with db.DB() as con:
-        cursor = con.cursor( row_factory=psycopg.rows.dict_row )
-        subdict = {}
-        q = "SELECT * FROM processing_version WHERE "
-        pv = args.processing_version
-        q += "description=%(pv)s"
-        subdict['pv'] = pv
-        try:
-            ipv = int( pv )
-            q += " OR id=%(ipv)s"
-            subdict['ipv'] = ipv
-        except ValueError:
-            pass
-        # TODO : validity dates?
-        cursor.execute( q, subdict )
-        rows = cursor.fetchall()
-        if len(rows) == 0:
-            raise ValueError( f"Could not find processing version {pv}" )
-        if len(rows) > 1:
-            raise ValueError( f"More than one processing version matches {pv}, you're probably screwed." )
-
-        ipv = rows[0]['id']
+    # TODO : validity dates?
+    ipv = db.procver_id( args.processing_version, must_exist=True )
 
     si = SourceImporter( ipv )
     with db.MG() as mg:
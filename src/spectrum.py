@@ -18,7 +18,7 @@ _show_way_too_much_debug_info = False
 
 def what_spectra_are_wanted( procver=None, wantsince=None, requester=None, notclaimsince=None,
                              nospecsince=None, detsince=None, lim_mag=None, lim_mag_band=None,
-                             mjdnow=None, logger=None ):
+                             mjdnow=None, logger=None, dbcon=None ):
     """Find out what spectra have been requested
 
     Parmeters
@@ -66,6 +66,9 @@ def what_spectra_are_wanted( procver=None, wantsince=None, requester=None, notcl
       logger : logging.Logger object or None
         Will make a default if one is not given
 
+      dbcon : psycopg.Connection or None
+        Database connection to use.  If None, will get one from db.DB().
+
     Returns
     -------
       pandas dataframe TODO DOCUMENT
@@ -89,22 +92,16 @@ def what_spectra_are_wanted( procver=None, wantsince=None, requester=None, notcl
         now = datetime.datetime.utcfromtimestamp( astropy.time.Time( mjdnow, format='mjd', scale='tai' ).unix_tai )
         now = pytz.utc.localize( now )
 
-    with db.DB() as con:
+    with db.DB( dbcon ) as con:
         cursor = con.cursor()
 
         # If a processing version was given, turn it into a number
         if procver is not None:
             # TODO : validity date range?
-            cursor.execute( "SELECT id FROM processing_version WHERE description=%(procver)s",
-                            { 'procver': procver } )
-            rows = cursor.fetchall()
-            if len(rows) == 0:
-                cursor.execute( "SELECT id FROM processing_version_alias WHERE description=%(procver)s",
-                                { 'procver': procver } )
-                rows = cursor.fetchall()
-            if len(rows) == 0:
+            try:
+                procver = db.procver_id( procver, must_exist=True, dbcon=con )
+            except ValueError:
                 return f"Error, unknown processing version {procver}", 500
-            procver = rows[0][0]
 
         # Create a temporary table things that are wanted but that have not been claimed.
         #
@@ -388,7 +385,7 @@ def what_spectra_are_wanted( procver=None, wantsince=None, requester=None, notcl
 
 
 def get_spectrum_info( rootids=None, facility=None, mjd_min=None, mjd_max=None, classid=None,
-                       z_min=None, z_max=None, since=None, logger=None ):
+                       z_min=None, z_max=None, since=None, logger=None, dbcon=None ):
     if logger is None:
         logger = logging.getLogger( __name__ )
         logger.propagate = False
@@ -400,7 +397,7 @@ def get_spectrum_info( rootids=None, facility=None, mjd_min=None, mjd_max=None,
             logout.setFormatter( formatter )
             logger.setLevel( logging.INFO )
 
-    with db.DB() as con:
+    with db.DB( dbcon ) as con:
         cursor = con.cursor()
         where = "WHERE"
         q = "SELECT * FROM spectruminfo "
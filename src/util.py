@@ -71,7 +71,13 @@ def datetime_or_none_from_dict_mjd_or_timestring( d, kw ):
 
 
 def mjd_or_none_from_dict_mjd_or_timestring( d, kw ):
-    if ( kw not in d ) or ( d[kw] is None ) or ( len( d[kw].strip() ) == 0 ):
+    if ( kw not in d ) or ( d[kw] is None ):
+        return None
+
+    if isinstance( d[kw], numbers.Real ):
+        return float( d[kw] )
+
+    if len( d[kw].strip() ) == 0:
         return None
 
     try:
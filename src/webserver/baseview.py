@@ -1,24 +1,412 @@
+import io
+import time
+import types
 import uuid
+import decimal
+import datetime
+import threading
+import collections
 from types import SimpleNamespace
 import simplejson
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import numpy
+import pandas
+import pyarrow
+import pyarrow.ipc
 import flask
 import flask.views
 
-from db import DB
+import db
+import config
 
 
 # ======================================================================
-# UUID encoder for simplejson
+# JSON encoding
+#
+# Everything the webserver sends as JSON goes through json_dumps.  It
+#   uses orjson if that's installed (it's a lot faster than simplejson,
+#   especially for long lists of numbers), and simplejson otherwise;
+#   call set_json_encoder to pick one.  Either way, on top of what JSON
+#   normally does, it knows about UUIDs, datetimes, numpy arrays and
+#   scalars, and pandas Series, and NaN and infinity become null.  So,
+#   handlers can return numpy arrays directly rather than calling
+#   tolist() on them first.
+
+def _json_default( obj ):
+    # Turn the things JSON can't do into things it can.  Used by both encoders.
+    if isinstance( obj, uuid.UUID ):
+        return str(obj)
+    if ( obj is pandas.NaT ) or ( obj is pandas.NA ):
+        return None
+    if isinstance( obj, ( pandas.Series, pandas.Index ) ):
+        obj = obj.to_numpy()
+    if isinstance( obj, numpy.ndarray ):
+        if obj.dtype.kind == 'M':
+            return numpy.where( numpy.isnat( obj ), None, numpy.datetime_as_string( obj ) ).tolist()
+        return obj.tolist()
+    if isinstance( obj, numpy.datetime64 ):
+        return None if numpy.isnat( obj ) else str( numpy.datetime_as_string( obj ) )
+    if isinstance( obj, numpy.generic ):
+        return obj.item()
+    if isinstance( obj, ( datetime.datetime, datetime.date, datetime.time ) ):
+        return obj.isoformat()
+    if isinstance( obj, decimal.Decimal ):
+        # (simplejson writes these itself, but orjson doesn't know them)
+        return float( obj )
+    raise TypeError( f"Object of type {type(obj).__name__} is not JSON serializable" )
+
 
 class UUIDJSONEncoder( simplejson.JSONEncoder ):
     def default( self, obj ):
-        if isinstance( obj, uuid.UUID ):
-            return str(obj)
-        else:
+        try:
+            return _json_default( obj )
+        except TypeError:
             return super().default( obj )
 
 
+def _simplejson_dumps( obj ):
+    return simplejson.dumps( obj, ignore_nan=True, cls=UUIDJSONEncoder ).encode()
+
+
+def _orjson_dumps( obj ):
+    # Not using orjson.OPT_SERIALIZE_NUMPY; at least some versions of
+    #   orjson write garbage for arrays that aren't native byte order
+    #   (e.g. straight out of a FITS file).  tolist() in _json_default
+    #   is nearly as fast.
+    try:
+        return orjson.dumps( obj, default=_json_default, option=orjson.OPT_NON_STR_KEYS )
+    except TypeError:
+        # orjson can't do some things simplejson can (e.g. integers that
+        #   don't fit in 64 bits), so give simplejson a chance.
+        return _simplejson_dumps( obj )
+
+
+json_encoders = { 'simplejson': _simplejson_dumps }
+if orjson is not None:
+    json_encoders['orjson'] = _orjson_dumps
+
+_json_encoder = 'orjson' if 'orjson' in json_encoders else 'simplejson'
+
+
+def set_json_encoder( name ):
+    """Choose which encoder json_dumps uses; must be one of the keys of json_encoders.
+
+    Returns the name of the encoder that was being used before.
+
+    """
+    global _json_encoder
+    if name not in json_encoders:
+        raise ValueError( f"Unknown JSON encoder {name}; known are {list(json_encoders.keys())}" )
+    prev = _json_encoder
+    _json_encoder = name
+    return prev
+
+
+def json_dumps( obj ):
+    """Encode obj as JSON, returning utf-8 bytes.  See the comments above for what it can handle."""
+    return json_encoders[ _json_encoder ]( obj )
+
+
+# ======================================================================
+# One database connection per request
+
+def request_dbcon( readonly=False ):
+    """Get the database connection for the current flask request.
+
+    The first time this is called during a request, it pulls a
+    connection out of the db connection pool and stashes it in flask.g.
+    Later calls during the same request get the same connection back.
+    At the end of the request, release_request_dbcon (which server.py
+    registers as a teardown function) rolls it back and returns it to
+    the pool.
+
+    Web handlers should use this (or BaseView.dbcon) and pass it to
+    anything that takes a dbcon= parameter, rather than calling db.DB()
+    themselves.  Don't close it, and remember to commit anything you
+    want to keep.
+
+    If readonly is True, you get a different connection, to a read-only
+    replica if there are any (see db.DB()).  If no replicas are
+    configured, it's a second connection to the primary.  Either way,
+    it's set read only, so something that tries to write (or make a
+    temp table) fails the same way with or without replicas.
+
+    """
+    if readonly:
+        if 'rodbcon' not in flask.g:
+            flask.g.rodbcon = db.checkout_dbcon( readonly=True )
+        return flask.g.rodbcon[0]
+
+    if 'dbcon' not in flask.g:
+        flask.g.dbcon = db.checkout_dbcon()
+    return flask.g.dbcon[0]
+
+
+def release_request_dbcon( exc=None ):
+    """Return the request's database connection(s) (if any) to the pool.  Register with app.teardown_request."""
+    for key in [ 'dbcon', 'rodbcon' ]:
+        conn_pool = flask.g.pop( key, None )
+        if conn_pool is not None:
+            conn, pool = conn_pool
+            pool.putconn( conn )
+
+
+# ======================================================================
+# Cache of authuser rows, so check_auth doesn't have to hit the
+#   database on every request.
+
+class AuthUserCache:
+    """A bounded, thread-safe, in-process cache of authuser rows keyed by username.
+
+    Entries expire after ttl seconds.  If there are more than max_size
+    entries, the least recently used ones are thrown out.  Anything that
+    changes a user (logout, password reset, ...) should call
+    invalidate() so the next request goes back to the database.
+
+    """
+
+    def __init__( self, ttl=60., max_size=1000 ):
+        self.ttl = float( ttl )
+        self.max_size = int( max_size )
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()
+
+    def get( self, username ):
+        """Return the cached row tuple for username, or None if it's not cached (or expired)."""
+        with self._lock:
+            if username not in self._cache:
+                return None
+            row, expires = self._cache[ username ]
+            if time.monotonic() > expires:
+                del self._cache[ username ]
+                return None
+            self._cache.move_to_end( username )
+            return row
+
+    def set( self, username, row ):
+        if ( self.max_size <= 0 ) or ( self.ttl <= 0 ):
+            return
+        with self._lock:
+            self._cache[ username ] = ( row, time.monotonic() + self.ttl )
+            self._cache.move_to_end( username )
+            while len( self._cache ) > self.max_size:
+                self._cache.popitem( last=False )
+
+    def invalidate( self, username=None ):
+        """Forget username, or everybody if username is None."""
+        with self._lock:
+            if username is None:
+                self._cache.clear()
+            else:
+                self._cache.pop( username, None )
+
+
+authuser_cache = AuthUserCache( ttl=config.authuser_cache_ttl, max_size=config.authuser_cache_max_size )
+
+
+# ======================================================================
+# Binary columnar responses
+#
+# Views that return a table can send it as an Apache Arrow IPC stream
+#   or as a numpy .npz file instead of as JSON, if the client asks for
+#   it (see BaseView.columnar_format).  Both are built straight from
+#   the columns, so there's no per-value work in python (except for
+#   columns of uuids, which get turned into strings), and they're a lot
+#   smaller and faster to parse than JSON lists of floats.
+
+ARROW_MIMETYPE = 'application/vnd.apache.arrow.stream'
+NPZ_MIMETYPE = 'application/x-npz'
+columnar_mimetypes = { 'arrow': ARROW_MIMETYPE, 'npz': NPZ_MIMETYPE }
+
+
+def _arrow_column( values ):
+    # from_pandas makes NaN a null too, which is how pandas marks missing values
+    first = next( ( v for v in values if v is not None ), None )
+    if isinstance( first, uuid.UUID ):
+        values = [ None if v is None else str(v) for v in values ]
+    return pyarrow.array( values, from_pandas=True )
+
+
+def _npz_column( name, arr ):
+    # .npz files can only hold nulls (as NaN) in float columns; numpy.load( allow_pickle=False )
+    #   can't read object arrays, so strings have to be fixed-width.
+    t = arr.type
+    if pyarrow.types.is_null( t ):
+        return numpy.full( len(arr), numpy.nan )
+    if pyarrow.types.is_string( t ) or pyarrow.types.is_large_string( t ):
+        return arr.fill_null( '' ).to_numpy( zero_copy_only=False ).astype( str )
+    if pyarrow.types.is_boolean( t ):
+        return arr.fill_null( False ).to_numpy( zero_copy_only=False )
+    if pyarrow.types.is_decimal( t ):
+        arr = arr.cast( pyarrow.float64() )
+    if ( pyarrow.types.is_integer( t ) or pyarrow.types.is_floating( t ) or pyarrow.types.is_decimal( t )
+         or pyarrow.types.is_timestamp( t ) or pyarrow.types.is_date( t ) ):
+        return arr.to_numpy( zero_copy_only=False )
+    raise TypeError( f"Column {name} has type {t}, which can't be sent in a .npz file; ask for arrow instead" )
+
+
+def columnar_response( columns, fmt, headers=None ):
+    """Make a response that sends a table as Arrow or .npz.
+
+    Return what this returns from a view's do_the_things.
+
+    Parameters
+    ----------
+      columns : dict or pandas.DataFrame
+        The table.  If a dict, keys are column names, values are lists
+        or numpy arrays, all the same length.
+
+      fmt : str
+        'arrow' or 'npz' (e.g. what BaseView.columnar_format returned)
+
+      headers : dict or None
+        Additional HTTP headers to send
+
+    Returns
+    -------
+      ( bytes, 200, dict of headers )
+
+      For 'arrow', the bytes are an Arrow IPC stream with a single
+      record batch; None and NaN are both sent as null.  For 'npz',
+      it's what numpy.savez writes, one array per column.  In the npz,
+      nulls become NaN in numeric columns (so integer columns with
+      nulls become floats), '' in string columns, and False in bool
+      columns.
+
+    """
+    if fmt not in columnar_mimetypes:
+        raise ValueError( f"Unknown columnar format {fmt}" )
+    if isinstance( columns, pandas.DataFrame ):
+        columns = { c: columns[c] for c in columns.columns }
+    arrays = { str(c): _arrow_column( v ) for c, v in columns.items() }
+
+    if fmt == 'arrow':
+        table = pyarrow.table( arrays )
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream( sink, table.schema ) as writer:
+            writer.write_table( table )
+        body = sink.getvalue().to_pybytes()
+    else:
+        bio = io.BytesIO()
+        numpy.savez( bio, **{ c: _npz_column( c, a ) for c, a in arrays.items() } )
+        body = bio.getvalue()
+
+    allheaders = { 'Content-Type': columnar_mimetypes[fmt] }
+    if headers is not None:
+        allheaders.update( headers )
+    return body, 200, allheaders
+
+
+# ======================================================================
+# Streaming responses
+#
+# For results too big to build in memory, a view can return
+#   streaming_response( chunks, fmt ), where chunks is an iterable
+#   (usually a generator reading from a db.server_cursor).  Each chunk
+#   is sent as soon as it's ready, so neither the time to the first
+#   byte nor the webserver's memory depends on the size of the whole
+#   result.  The request context (and so the request's database
+#   connections; see request_dbcon) stays alive until the stream is
+#   done.
+
+JSONLINES_MIMETYPE = 'application/x-ndjson'
+
+
+def _jsonlines_chunks( chunks ):
+    try:
+        for chunk in chunks:
+            yield b"".join( json_dumps( row ) + b"\n" for row in chunk )
+    except Exception as ex:
+        # It's too late to send back an error status, so the error is the last line
+        flask.current_app.logger.exception( str(ex) )
+        yield json_dumps( { 'status': 'error', 'error': str(ex) } ) + b"\n"
+
+
+def _arrow_chunks( chunks ):
+    sink = io.BytesIO()
+    writer = None
+    schema = None
+    try:
+        for chunk in chunks:
+            if isinstance( chunk, pandas.DataFrame ):
+                chunk = { c: chunk[c] for c in chunk.columns }
+            table = pyarrow.table( { str(c): _arrow_column( v ) for c, v in chunk.items() } )
+            if writer is None:
+                schema = table.schema
+                writer = pyarrow.ipc.new_stream( sink, schema )
+            else:
+                # Type inference can come out differently on different chunks
+                #   (e.g. a column that's all null in one chunk)
+                table = table.cast( schema )
+            writer.write_table( table )
+            yield sink.getvalue()
+            sink.seek( 0 )
+            sink.truncate( 0 )
+        if writer is None:
+            writer = pyarrow.ipc.new_stream( sink, pyarrow.schema( [] ) )
+        writer.close()
+        yield sink.getvalue()
+    except Exception as ex:
+        # It's too late to send back an error status.  Send something
+        #   that isn't an Arrow message and no end-of-stream marker, so
+        #   that the client's reader fails rather than thinking it got
+        #   everything.
+        flask.current_app.logger.exception( str(ex) )
+        yield f"\nFASTDB ERROR: {ex}\n".encode()
+
+
+def streaming_response( chunks, fmt='jsonl', headers=None ):
+    """Make a response that sends a result a chunk at a time.
+
+    Return what this returns from a view's do_the_things.
+
+    Parameters
+    ----------
+      chunks : iterable
+        For fmt 'jsonl', each chunk is a list of rows, and each row is
+        something that can be turned into JSON.  Each row is sent as
+        one line.  For fmt 'arrow', each chunk is a dict of { name:
+        list or array } or a pandas DataFrame, and is sent as one
+        record batch; all chunks must have the same columns.
+
+      fmt : str, default 'jsonl'
+        'jsonl' for JSON lines (application/x-ndjson), or 'arrow' for an
+        Apache Arrow IPC stream.  (npz can't be streamed.)
+
+      headers : dict or None
+        Additional HTTP headers to send
+
+    Returns
+    -------
+      flask.Response
+
+      If something goes wrong after the response has started, the
+      status has already been sent as 200.  For 'jsonl', the last line
+      is then { "status": "error", "error": <message> }.  For 'arrow',
+      the stream ends with something that isn't valid Arrow, so
+      whatever's reading it will fail.
+
+    """
+    if fmt == 'jsonl':
+        body = _jsonlines_chunks( chunks )
+        mimetype = JSONLINES_MIMETYPE
+    elif fmt == 'arrow':
+        body = _arrow_chunks( chunks )
+        mimetype = ARROW_MIMETYPE
+    else:
+        raise ValueError( f"Can't stream format {fmt}; must be jsonl or arrow" )
+
+    allheaders = { 'Content-Type': mimetype }
+    if headers is not None:
+        allheaders.update( headers )
+    return flask.Response( flask.stream_with_context( body ), status=200, headers=allheaders )
+
+
 # ======================================================================
 
 class BaseView( flask.views.View ):
@@ -29,7 +417,14 @@ class BaseView( flask.views.View ):
     tuple, or ...something else.
 
     If it returns a dict or a list, the web server will send to the
-    client application/json with status 200. If the result is a string,
+    client application/json with status 200.  (That's encoded with
+    json_dumps, so the dict or list can have numpy arrays, UUIDs, and
+    datetimes in it.)  (Views that return tables
+    can instead send them as Arrow or .npz; see columnar_format and
+    columnar_response.)  If it returns a generator, each thing the
+    generator yields should be a list of rows, and the rows will be
+    streamed to the client as JSON lines (see streaming_response).  A
+    flask.Response is sent as is. If the result is a string,
     it the web server will send to the client text/plain with status
     200.  If it's a tuple, just let Flask deal with that tuple to figure
     out what the web server should send to the client.  Otherwise, the
@@ -40,6 +435,10 @@ class BaseView( flask.views.View ):
     check_auth.  However, if they do override it, they should call that
     if the results shouldn't be sent back to an unauthenticated user.
 
+    Use self.dbcon for database access; it's one connection shared by
+    everything done during the request (see request_dbcon).  Views that
+    only run heavy read-only queries should use self.rodbcon instead.
+
     """
 
     _admin_required = False
@@ -47,14 +446,52 @@ class BaseView( flask.views.View ):
     def __init__( self, *args, **kwargs ):
         super().__init__( *args, **kwargs )
 
+    @property
+    def dbcon( self ):
+        return request_dbcon()
+
+    @property
+    def rodbcon( self ):
+        """A read-only database connection for the request; see request_dbcon."""
+        return request_dbcon( readonly=True )
+
+    def columnar_format( self, return_format=None ):
+        """Figure out if the client wants a table back as Arrow or .npz instead of JSON.
+
+        The client can ask either with an Accept header that prefers
+        application/vnd.apache.arrow.stream or application/x-npz to
+        application/json, or (for views that take one) by passing
+        'arrow' or 'npz' as the return_format.
+
+        Parameters
+        ----------
+          return_format : anything
+            The view's return_format parameter, if it has one.  If it's
+            'arrow' or 'npz', that wins over the Accept header.
+
+        Returns
+        -------
+          'arrow', 'npz', or None (meaning send JSON)
+
+        """
+        if isinstance( return_format, str ) and ( return_format in columnar_mimetypes ):
+            return return_format
+        best = flask.request.accept_mimetypes.best_match( [ 'application/json', ARROW_MIMETYPE, NPZ_MIMETYPE ],
+                                                          default='application/json' )
+        for fmt, mimetype in columnar_mimetypes.items():
+            if best == mimetype:
+                return fmt
+        return None
+
     def check_auth( self ):
         self.username = flask.session['username'] if 'username' in flask.session else '(None)'
         self.displayname = flask.session['userdisplayname'] if 'userdisplayname' in flask.session else '(None)'
         self.authenticated = ( 'authenticated' in flask.session ) and flask.session['authenticated']
         self.user = None
         if self.authenticated:
-            with DB() as conn:
-                cursor = conn.cursor()
+            row = authuser_cache.get( self.username )
+            if row is None:
+                cursor = self.dbcon.cursor()
                 cursor.execute( "SELECT id,username,displayname,email FROM authuser WHERE username=%(username)s",
                                 {'username': self.username } )
                 rows = cursor.fetchall()
@@ -65,9 +502,10 @@ class BaseView( flask.views.View ):
                 if len(rows) == 0:
                     self.authenticated = False
                     raise ValueError( f"Error, failed to find user {self.username} in database" )
-                row = rows[0]
-                self.user = SimpleNamespace( id=row[0], username=row[1], displayname=row[2], email=row[3] )
-                # Verify that session displayname and database displayname match?  Eh.  Whatevs.
+                row = tuple( rows[0] )
+                authuser_cache.set( self.username, row )
+            self.user = SimpleNamespace( id=row[0], username=row[1], displayname=row[2], email=row[3] )
+            # Verify that session displayname and database displayname match?  Eh.  Whatevs.
         return self.authenticated
 
     def dispatch_request( self, *args, **kwargs ):
@@ -81,8 +519,11 @@ class BaseView( flask.views.View ):
             #   writes out NaN which is not standard JSON and which
             #   the javascript JSON parser chokes on.  Sigh.
             if isinstance( retval, dict ) or isinstance( retval, list ):
-                return ( simplejson.dumps( retval, ignore_nan=True, cls=UUIDJSONEncoder ),
-                         200, { 'Content-Type': 'application/json' } )
+                return json_dumps( retval ), 200, { 'Content-Type': 'application/json' }
+            elif isinstance( retval, types.GeneratorType ):
+                return streaming_response( retval, 'jsonl' )
+            elif isinstance( retval, flask.Response ):
+                return retval
             elif isinstance( retval, str ):
                 return retval, 200, { 'Content-Type': 'text/plain; charset=utf-8' }
             elif isinstance( retval, tuple ):
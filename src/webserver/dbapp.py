@@ -7,7 +7,7 @@ import psycopg
 
 import db
 from util import asUUID
-from webserver.baseview import BaseView
+from webserver.baseview import BaseView, columnar_response, streaming_response
 
 
 # ======================================================================]
@@ -61,7 +61,9 @@ def _dbcon():
     with open( pwfile ) as ifp:
         password = ifp.readline().strip()
 
-    conn = psycopg.connect( dbname=db.dbname, host=db.dbhost, port=db.dbport, user=dbuser, password=password )
+    # Send user queries to a read-only replica if there is one
+    conn = db.connect_readonly( lambda host, port: psycopg.connect( dbname=db.dbname, host=host, port=port,
+                                                                    user=dbuser, password=password ) )
 
     return conn
 
@@ -69,7 +71,63 @@ def _dbcon():
 # ======================================================================
 # Interface for short SQL queries that return results directly.
 
+def _stream_query_rows( conn, cursor, columns, fmt ):
+    # Generator for RunSQLQuery.stream_query.  Owns conn, and closes it when done.
+    try:
+        for rows in db.iter_batches( cursor ):
+            if fmt == 'arrow':
+                yield { c: [ r[i] for r in rows ] for i, c in enumerate(columns) }
+            else:
+                yield [ { c: r[i] for i, c in enumerate(columns) } for r in rows ]
+    finally:
+        cursor.close()
+        conn.rollback()
+        conn.close()
+
+
 class RunSQLQuery( BaseView ):
+    """Run a short read-only SQL query.  URL endpoint /db/runsqlquery
+
+    POST a JSON dictionary with query (str or list of str), optionally
+    subdict (dict or list of dict), return_format (0, 1, 'arrow', or
+    'npz'), and stream (bool).
+
+    If stream is true, the rows of the last query are read from a
+    server-side cursor and sent as they're read, as JSON lines (one
+    JSON dictionary per row), or as an Arrow stream if you ask for
+    arrow (see BaseView.columnar_format).  Use this for results with
+    lots of rows.  The last query must be a SELECT.
+
+    """
+
+    def stream_query( self, queries, subdicts, return_format ):
+        logger = flask.current_app.logger
+        fmt = self.columnar_format( return_format )
+        if fmt == 'npz':
+            raise ValueError( "Can't stream npz; ask for arrow, or leave out return_format to get JSON lines" )
+
+        # Run everything except reading the rows now, so that errors
+        #   come back before the response starts.
+        conn = _dbcon()
+        try:
+            cursor = conn.cursor()
+            for query, subdict in zip( queries[:-1], subdicts[:-1] ):
+                logger.debug( f"Query is {query}, subdict is {subdict}, "
+                              f"user is {flask.session['useruuid']} ({flask.session['username']})" )
+                cursor.execute( query, subdict )
+            logger.debug( f"Streaming query is {queries[-1]}, subdict is {subdicts[-1]}, "
+                          f"user is {flask.session['useruuid']} ({flask.session['username']})" )
+            srvcursor = db.server_cursor( conn )
+            srvcursor.execute( queries[-1], subdicts[-1] )
+            columns = [ c.name for c in srvcursor.description ]
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+
+        return streaming_response( _stream_query_rows( conn, srvcursor, columns, fmt ),
+                                   'jsonl' if fmt is None else fmt )
+
     def do_the_things( self ):
         logger = flask.current_app.logger
 
@@ -80,6 +138,9 @@ class RunSQLQuery( BaseView ):
         try:
             queries, subdicts, return_format = _extract_queries( data )
 
+            if data.get( 'stream', False ):
+                return self.stream_query( queries, subdicts, return_format )
+
             try:
                 conn = _dbcon()
                 cursor = conn.cursor()
@@ -102,7 +163,11 @@ class RunSQLQuery( BaseView ):
                 conn.rollback()
                 conn.close()
 
-            if return_format == 0:
+            fmt = self.columnar_format( return_format )
+            if fmt is not None:
+                logger.debug( f"Returning {len(rows)} rows from query sequence as {fmt}." )
+                return columnar_response( { c: [ r[i] for r in rows ] for i, c in enumerate(columns) }, fmt )
+            elif return_format == 0:
                 retval = { 'status': 'ok',
                            'rows': [ { c: r[i] for i, c in enumerate(columns) } for r in rows ]
                           }
@@ -155,7 +220,7 @@ class SubmitLongSQLQuery( BaseView ):
                                 queries = queries,
                                 subdicts = subdicts,
                                 format = return_format )
-            qq.insert()
+            qq.insert( dbcon=self.dbcon )
 
             return { 'status': 'ok', 'queryid': str(queryid) }
 
@@ -171,7 +236,7 @@ class CheckLongSQLQuery( BaseView ):
     def do_the_things( self, queryid ):
         logger = flask.current_app.logger
         try:
-            qq = db.QueryQueue.get( queryid )
+            qq = db.QueryQueue.get( queryid, dbcon=self.dbcon )
             if qq is None:
                 raise ValueError( f"Unknown query {queryid}" )
 
@@ -213,7 +278,7 @@ class GetLongSQLQueryResults( BaseView ):
     def do_the_things( self, queryid ):
         logger = flask.current_app.logger
         try:
-            qq = db.QueryQueue.get( queryid )
+            qq = db.QueryQueue.get( queryid, dbcon=self.dbcon )
             if qq is None:
                 raise ValueError( f"Unknown query {queryid}" )
             if qq.error:
@@ -1,20 +1,36 @@
+import numpy as np
+import pandas
 import flask
 
 import db
 import ltcv
-from webserver.baseview import BaseView
+from webserver.baseview import BaseView, columnar_response, streaming_response
 
 
 # ======================================================================
 # /ltcv/getltcv
 
 class GetLtcv( BaseView ):
+    """Get the lightcurve of one object.  URL endpoint /ltcv/getltcv/<procver>/<objid>
+
+    Optionally POST a JSON dictionary with bands (list of str), which
+    ('patch', 'forced', or 'detections'), and return_format ('json',
+    'arrow', or 'npz').
+
+    Returns { 'status': 'ok', 'objinfo': dict, 'ltcv': dict of lists }.
+    If you ask for arrow or npz (with return_format, or with an Accept
+    header; see BaseView.columnar_format), you just get the lightcurve
+    table (what ltcv.object_ltcv returns), not objinfo.
+
+    """
+
     def get_ltcv( self, procver, procverint, objid, dbcon=None ):
         bands = None
         which = 'patch'
+        return_format = None
         if flask.request.is_json:
             data = flask.request.json
-            unknown = set( data.keys() ) - { 'bands', 'which' }
+            unknown = set( data.keys() ) - { 'bands', 'which', 'return_format' }
             if len(unknown) > 0:
                 raise ValueError( f"Unknown data parameters: {unknown}" )
             if 'bands' in data:
@@ -23,6 +39,11 @@ class GetLtcv( BaseView ):
                 if data['which'] not in ( 'detections', 'forced', 'patch' ):
                     raise ValueError( f"Unknown value of which: {which}" )
                 which = data['which']
+            if 'return_format' in data:
+                if data['return_format'] not in ( 'json', 'arrow', 'npz' ):
+                    raise ValueError( f"Unknown return_format {data['return_format']}" )
+                return_format = data['return_format']
+        fmt = self.columnar_format( return_format ) if return_format != 'json' else None
 
         with db.DB( dbcon ) as dbcon:
             cursor = dbcon.cursor()
@@ -36,16 +57,19 @@ class GetLtcv( BaseView ):
             # Convert procesing version to something usable for user display
             objinfo['processing_version'] = f"{procver} ({objinfo['processing_version']})"
 
+            if fmt is not None:
+                return columnar_response( ltcv.object_ltcv( procverint, objid, return_format='pandas',
+                                                            bands=bands, which=which, dbcon=dbcon ), fmt )
+
             ltcvdata = ltcv.object_ltcv( procverint, objid, return_format='json',
                                          bands=bands, which=which, dbcon=dbcon )
             retval= { 'status': 'ok', 'objinfo': objinfo, 'ltcv': ltcvdata }
             return retval
 
     def do_the_things( self, procver, objid ):
-        with db.DB() as dbcon:
-            objid = int( objid )
-            pv = ltcv.procver_int( procver )
-            return self.get_ltcv( procver, pv, objid, dbcon=dbcon )
+        objid = int( objid )
+        pv = ltcv.procver_int( procver, dbcon=self.rodbcon )
+        return self.get_ltcv( procver, pv, objid, dbcon=self.rodbcon )
 
 
 # ======================================================================
@@ -53,8 +77,8 @@ class GetLtcv( BaseView ):
 
 class GetRandomLtcv( GetLtcv ):
     def do_the_things( self, procver ):
-        with db.DB() as dbcon:
-            pv = ltcv.procver_int( procver )
+        with db.DB( self.rodbcon ) as dbcon:
+            pv = ltcv.procver_int( procver, dbcon=dbcon )
             cursor = dbcon.cursor()
             # THINK ; this may be slow, as it may sort the entire object table!  Or at least the index.
             # TABLESAMPLE may be a solution, but it doesn't interact with WHERE
@@ -65,9 +89,205 @@ class GetRandomLtcv( GetLtcv ):
             return self.get_ltcv( procver, pv, objid, dbcon=dbcon )
 
 
+# ======================================================================
+# /ltcv/getltcvs
+
+class GetLtcvs( BaseView ):
+    """Get lightcurves of lots of objects.  URL endpoint /ltcv/getltcvs[/<procver>]
+
+    Hit this with a POST request whose payload is a JSON dictionary with keys:
+
+       diaobjectids : list of int
+         The objects to get lightcurves for.  Required.
+
+       processing_version : str
+         The processing version or alias.  Only allowed if it's not in
+         the URL.  If it's not given either place, assumes "default".
+
+       bands : list of str
+         Only get these bands.  Optional.
+
+       which : str
+         'patch' (default), 'forced', or 'detections'; see /ltcv/getltcv
+
+       return_format : str
+         'json' (default), 'arrow', or 'npz'
+
+    Returns a JSON dictionary { 'status': 'ok', 'ltcvs': ltcvs }, where
+    ltcvs is what ltcv.object_ltcvs returns: lists diaobjectid and
+    offset, and lists of the points of all lightcurves concatenated
+    together; the points of diaobjectid[i] are at offset[i]:offset[i+1].
+
+    If you ask for arrow or npz (with return_format, or with an Accept
+    header; see BaseView.columnar_format), you instead get one table
+    with a row for each point, with columns diaobjectid, mjd, band,
+    psfflux, psffluxerr, isdet, and (unless which is 'detections')
+    ispatch.
+
+    """
+
+    def do_the_things( self, procver=None ):
+        if not flask.request.is_json:
+            raise TypeError( "POST data was not JSON" )
+        data = flask.request.json
+        unknown = set( data.keys() ) - { 'diaobjectids', 'processing_version', 'bands', 'which', 'return_format' }
+        if len(unknown) > 0:
+            raise ValueError( f"Unknown data parameters: {unknown}" )
+        if 'diaobjectids' not in data:
+            raise ValueError( "Must give diaobjectids" )
+        if 'processing_version' in data:
+            if procver is not None:
+                raise ValueError( "Can't give processing_version both in the URL and in the POST data" )
+            procver = data['processing_version']
+        elif procver is None:
+            procver = 'default'
+        which = data.get( 'which', 'patch' )
+        if which not in ( 'detections', 'forced', 'patch' ):
+            raise ValueError( f"Unknown value of which: {which}" )
+
+        return_format = data.get( 'return_format', None )
+        if return_format not in ( None, 'json', 'arrow', 'npz' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+        fmt = self.columnar_format( return_format ) if return_format != 'json' else None
+
+        if fmt is not None:
+            return columnar_response( ltcv.object_ltcvs( procver, data['diaobjectids'], return_format='pandas',
+                                                         bands=data.get( 'bands' ), which=which,
+                                                         dbcon=self.rodbcon ), fmt )
+
+        ltcvdata = ltcv.object_ltcvs( procver, data['diaobjectids'], return_format='json',
+                                      bands=data.get( 'bands' ), which=which, dbcon=self.rodbcon )
+        return { 'status': 'ok', 'ltcvs': ltcvdata }
+
+
 # ======================================================================
 # /ltcv/gethottransients
 
+# ( key in what GetHotTransients returns, column of the hostdf from ltcv.get_hot_ltcvs )
+_hostgal_columns = ( [ ( 'hostgal_petroflux_r', 'petroflux_r' ),
+                       ( 'hostgal_petroflux_r_err', 'petroflux_r_err' ),
+                       ( 'hostgal_snsep', 'nearbyextobj1sep' ),
+                       ( 'hostgal_pzmean', 'pzmean' ),
+                       ( 'hostgal_pzstd', 'pzstd' ) ]
+                     + [ ( f'hostgal_stdcolor_{b0}_{b1}{err}', f'stdcolor_{b0}_{b1}{err}' )
+                         for b0, b1 in zip( 'ugriz', 'grizy' ) for err in ( '', '_err' ) ] )
+
+# ( key in what GetHotTransients returns, column of the df from ltcv.get_hot_ltcvs )
+_photometry_columns = [ ( 'mjd', 'midpointmjdtai' ),
+                        ( 'band', 'band' ),
+                        ( 'flux', 'psfflux' ),
+                        ( 'fluxerr', 'psffluxerr' ),
+                        ( 'is_source', 'is_source' ) ]
+
+
+def hot_transients_json( df, hostdf, return_format=0 ):
+    """Turn what ltcv.get_hot_ltcvs returns into what GetHotTransients returns.
+
+    Objects come out in the order they first show up in df, and the
+    points of each object are in the order they are in df.
+
+    This sorts df by object once (a stable sort, which is a no-op if
+    it's already grouped by object) and then splits every column at
+    the object boundaries, rather than pulling out each object's rows
+    one at a time, so it's linear in the number of rows.  (Pulling out
+    rows with df.xs was what made GetHotTransients slow when there
+    were lots of objects.)
+
+    Parameters
+    ----------
+      df : pandas.DataFrame
+        The lightcurves, the first thing returned by ltcv.get_hot_ltcvs
+
+      hostdf : pandas.DataFrame or None
+        The hosts, the second thing returned by ltcv.get_hot_ltcvs.
+        Objects missing from here get None for all the host values.
+
+      return_format : int, default 0
+        0, 1, or 2; see GetHotTransients
+
+    Returns
+    -------
+      list of dict (return_format 0 or 1) or dict of lists (return_format 2)
+
+    """
+
+    if return_format not in ( 0, 1, 2 ):
+        raise ValueError( f"Unknown return_format {return_format}" )
+
+    # Rows of an object are usually (always, from ltcv.get_hot_ltcvs)
+    #   contiguous, so find the runs of the same rootid and only factorize
+    #   the first rootid of each run; hashing uuids is slow.
+    rootid = df['rootid'].to_numpy()
+    newrun = np.ones( len(rootid), dtype=bool )
+    newrun[1:] = rootid[1:] != rootid[:-1]
+    runstarts = np.flatnonzero( newrun )
+    runcodes, objids = pandas.factorize( rootid[ runstarts ] )
+    nobj = len( objids )
+    codes = np.repeat( runcodes, np.diff( np.append( runstarts, len(df) ) ) )
+    order = np.argsort( codes, kind='stable' )
+    _, starts = np.unique( codes[order], return_index=True )
+    first = order[ starts ]
+    bounds = np.append( starts, len(df) ).tolist()
+
+    phot = {}
+    for key, col in _photometry_columns:
+        vals = df[col].to_numpy()[order].tolist()
+        phot[key] = [ vals[ bounds[i] : bounds[i+1] ] for i in range( nobj ) ]
+
+    host = None
+    if hostdf is not None:
+        h = hostdf.set_index( 'rootid' ).reindex( objids )
+        host = { key: h[col].astype( object ).where( h[col].notna(), None ).tolist()
+                 for key, col in _hostgal_columns }
+
+    objectid = [ str(o) for o in objids ]
+    ra = df['ra'].values[first].tolist()
+    dec = df['dec'].values[first].tolist()
+
+    # ZEROPOINT
+    #
+    # https://sdm-schemas.lsst.io/apdb.html claims that all fluxes are in nJy.
+    # Wikipedia tells me that mAB = -2.5log_10(f_ν) + 8.90
+    #   with f_ν in Jy, or, better stated, since arguments of logs should not have units:
+    #     mAB = -2.5 log_10( f_ν / 1 Jy ) + 8.90
+    # Converting units:
+    #    mAB = -2.5 log_10( f_ν / 1 Jy * ( 1 Jy / 10⁹ nJy ) ) + 8.90
+    #        = -2.5 log_10( f_ν / nJy * 10⁻⁹ ) +  8.90
+    #        = -2.5 ( log_10( f_ν / nJy ) - 9 ) + 8.90
+    #        = -2.5 log_10( f_ν / nJy ) + 31.4
+
+    if return_format == 2:
+        sne = { 'objectid': objectid, 'ra': ra, 'dec': dec }
+        sne.update( phot )
+        sne.update( { 'zp': [ 31.4 ] * nobj,
+                      'redshift': [ -99 ] * nobj,
+                      'sncode': [ -99 ] * nobj } )
+        if host is not None:
+            sne.update( host )
+        return sne
+
+    sne = []
+    for i in range( nobj ):
+        toadd = { 'objectid': objectid[i],
+                  'ra': ra[i],
+                  'dec': dec[i],
+                  'zp': 31.4,
+                  'redshift': -99.,
+                  'sncode': -99 }
+        if host is not None:
+            for key, vals in host.items():
+                toadd[key] = vals[i]
+        if return_format == 0:
+            toadd['photometry'] = { key: vals[i] for key, vals in phot.items() }
+        else:
+            for key, vals in phot.items():
+                toadd[key] = vals[i]
+        sne.append( toadd )
+
+    return sne
+
+
+
 class GetHotTransients( BaseView ):
     """Get lightcurves of recently-detected transients.  URL endpoint /ltcv/gethottransients
 
@@ -81,7 +301,7 @@ class GetHotTransients( BaseView ):
        processing_version : str
          The processing version or alias.  If not given, assumes "default"
 
-       return fromat : int
+       return fromat : int or str
          Specifies the format of the data returned; see below.  If not given,
          assumes 0.
 
@@ -108,6 +328,31 @@ class GetHotTransients( BaseView ):
          Defaults to False.  If True, additional information will be returned
          with the first-listed possible host of each transient.
 
+       since_cursor : str or None
+         Use this to poll for changes.  If this key is in the dictionary
+         (even with value None), the return is a dictionary
+         { 'cursor': str, 'transients': ... }, where transients is what
+         would have been returned without since_cursor (see below).
+         Pass the cursor you get back as since_cursor the next time you
+         call, and you'll only get the hot transients that have had new
+         sources or forced sources imported since the last call.  Pass
+         None the first time to get everything.  You may occasionally
+         get a transient twice (if it was imported while you were
+         calling); you won't miss any.
+
+       stream : bool
+         Defaults to False.  If True, the lightcurves are read from the
+         database and sent a chunk of objects at a time, so the response
+         starts right away and the server doesn't have to hold everything
+         in memory.  Use this if there are going to be a lot of
+         transients.  With return_format 0 or 1, you get JSON lines
+         (application/x-ndjson): each line is what would have been one
+         element of the list.  With return_format 'arrow', you get an
+         Arrow stream with one record batch per chunk.  Can't be used
+         with return_format 2 or 'npz'.  If you passed since_cursor, the
+         new cursor is in the FASTDB-Cursor header.  With stream, you
+         can also pass objects_per_chunk (default 1000).
+
     Returns
     -------
       application/json   (utf-8 encoded, which I believe is required for json)
@@ -166,6 +411,16 @@ class GetHotTransients( BaseView ):
             the top-level dictionary are the same as the keys of each row in
             return_format 1.
 
+         return_format = 'arrow' or 'npz':
+            Returns an Apache Arrow IPC stream, or a numpy .npz file, with a
+            table that has one row per lightcurve point: what
+            ltcv.get_hot_ltcvs returns, with the host columns (if
+            include_hostinfo) joined on to the lightcurve rows.  You can
+            also get these by sending an Accept header that asks for
+            application/vnd.apache.arrow.stream or application/x-npz.  If
+            you passed since_cursor, the new cursor is in the FASTDB-Cursor
+            header of the response.
+
          Both return formats 1 and 2 can be loaded directly into a pandas data
          frame, though polars might work better because it has better direct
          support for embedded lists.  (Return format 0 can probably also be
@@ -191,7 +446,6 @@ class GetHotTransients( BaseView ):
 
     def do_the_things( self ):
         logger = flask.current_app.logger
-        bands = [ 'u', 'g', 'r', 'i', 'z', 'y' ]
 
         if not flask.request.is_json:
             raise TypeError( "POST data was not JSON" )
@@ -201,128 +455,64 @@ class GetHotTransients( BaseView ):
         if 'procesing_version' not in data:
             kwargs['processing_version'] = 'default'
         kwargs.update( data )
+        kwargs['dbcon'] = self.rodbcon
         if 'return_format' in kwargs:
             return_format = kwargs['return_format']
             del kwargs['return_format']
         else:
             return_format = 0
+        fmt = self.columnar_format( return_format )
+        if ( fmt is None ) and ( return_format not in ( 0, 1, 2 ) ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+        stream = bool( kwargs.pop( 'stream', False ) )
+        if stream and ( ( fmt == 'npz' ) or ( ( fmt is None ) and ( return_format == 2 ) ) ):
+            raise ValueError( "Can't stream return_format 2 or npz" )
+
+        # Get the new cursor *before* finding the transients, so nothing
+        #   imported while we're working gets missed next time.
+        use_cursor = 'since_cursor' in kwargs
+        if use_cursor:
+            since_cursor = kwargs.pop( 'since_cursor' )
+            if since_cursor is not None:
+                try:
+                    kwargs['changed_since'] = int( since_cursor )
+                except ( TypeError, ValueError ):
+                    raise ValueError( f"Invalid since_cursor {since_cursor!r}" )
+            newcursor = db.IngestBatch.latest( dbcon=self.rodbcon )
+
+        if stream:
+            headers = { 'FASTDB-Cursor': str( newcursor ) } if use_cursor else None
+            chunks = _hot_transient_chunks( ltcv.iter_hot_ltcvs( **kwargs ), fmt, return_format )
+            return streaming_response( chunks, 'jsonl' if fmt is None else fmt, headers=headers )
 
         df, hostdf = ltcv.get_hot_ltcvs( **kwargs )
+        logger.debug( f"GetHotTransients: got a df of length {len(df)}" )
 
-        if ( return_format == 0 ) or ( return_format == 1 ):
-            sne = []
-        elif ( return_format == 2 ):
-            sne = { 'objectid': [],
-                    'ra': [],
-                    'dec': [],
-                    'mjd': [],
-                    'band': [],
-                    'flux': [],
-                    'fluxerr': [],
-                    'is_source': [],
-                    'zp': [],
-                    'redshift': [],
-                    'sncode': [] }
-            if hostdf is not None:
-                sne[ 'hostgal_petroflux_r' ] = []
-                sne[ 'hostgal_petroflux_r_err' ] = []
-                sne[ 'hostgal_snsep' ] = []
-                sne[ 'hostgal_pzmean' ] = []
-                sne[ 'hostgal_pzstd' ] = []
-                for bandi in range( len(bands)-1 ):
-                    sne[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}' ] = []
-                    sne[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}_err' ] = []
-        else:
-            raise RuntimeError( "This should never happen." )
-
-        # ZEROPOINT
-        #
-        # https://sdm-schemas.lsst.io/apdb.html claims that all fluxes are in nJy.
-        # Wikipedia tells me that mAB = -2.5log_10(f_ν) + 8.90
-        #   with f_ν in Jy, or, better stated, since arguments of logs should not have units:
-        #     mAB = -2.5 log_10( f_ν / 1 Jy ) + 8.90
-        # Converting units:
-        #    mAB = -2.5 log_10( f_ν / 1 Jy * ( 1 Jy / 10⁹ nJy ) ) + 8.90
-        #        = -2.5 log_10( f_ν / nJy * 10⁻⁹ ) +  8.90
-        #        = -2.5 ( log_10( f_ν / nJy ) - 9 ) + 8.90
-        #        = -2.5 log_10( f_ν / nJy ) + 31.4
-
-        if len(df) > 0:
-            objids = df['rootid'].unique()
-            logger.debug( f"GetHotSNEView: got {len(objids)} objects in a df of length {len(df)}" )
-            df.set_index( [ 'rootid', 'sourceid' ], inplace=True )
+        if fmt is not None:
             if hostdf is not None:
-                hostdf.set_index( 'rootid', inplace=True )
-
-            for objid in objids:
-                subdf = df.xs( objid, level='rootid' )
-                if hostdf is not None:
-                    subhostdf = hostdf.xs( objid )
-                if ( return_format == 0 ) or ( return_format == 1 ):
-                    toadd = { 'objectid': str(objid),
-                              'ra': subdf.ra.values[0],
-                              'dec': subdf.dec.values[0],
-                              'zp': 31.4,
-                              'redshift': -99.,
-                              'sncode': -99 }
-                    if hostdf is not None:
-                        toadd[ 'hostgal_petroflux_r' ] = subhostdf.petroflux_r
-                        toadd[ 'hostgal_petroflux_r_err' ] = subhostdf.petroflux_r_err
-                        toadd[ 'hostgal_snsep' ] = subhostdf.nearbyextobj1sep
-                        toadd[ 'hostgal_pzmean' ] = subhostdf.pzmean
-                        toadd[ 'hostgal_pzstd' ] = subhostdf.pzstd
-                        for bandi in range( len(bands)-1 ):
-                            toadd[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}' ] = (
-                                subhostdf[ f'stdcolor_{bands[bandi]}_{bands[bandi+1]}' ] )
-                            toadd[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}_err' ] = (
-                                subhostdf[ f'stdcolor_{bands[bandi]}_{bands[bandi+1]}_err' ] )
-
-                    if return_format == 0:
-                        toadd['photometry'] = { 'mjd': list( subdf['midpointmjdtai'] ),
-                                                'band': list( subdf['band'] ),
-                                                'flux': list( subdf['psfflux'] ),
-                                                'fluxerr': list( subdf['psffluxerr'] ),
-                                                'is_source': list( subdf['is_source'] ) }
-                    else:
-                        toadd['mjd'] = list( subdf['midpointmjdtai'] )
-                        toadd['band'] = list( subdf['band'] )
-                        toadd['flux'] = list( subdf['psfflux'] )
-                        toadd['fluxerr'] = list( subdf['psffluxerr'] )
-                        toadd['is_source'] = list( subdf['is_source'] )
-                    sne.append( toadd )
-                elif return_format == 2:
-                    sne['objectid'].append( str(objid) )
-                    sne['ra'].append( subdf.ra.values[0] )
-                    sne['dec'].append( subdf.dec.values[0] )
-                    sne['mjd'].append( list( subdf['midpointmjdtai'] ) )
-                    sne['band'].append( list( subdf['band'] ) )
-                    sne['flux'].append( list( subdf['psfflux'] ) )
-                    sne['fluxerr'].append( list( subdf['psffluxerr'] ) )
-                    sne['is_source'].append( list( subdf['is_source'] ) )
-                    sne['zp'].append( 31.4 )
-                    sne['redshift'].append( -99 )
-                    sne['sncode'].append( -99 )
-                    if hostdf is not None:
-                        sne[ 'hostgal_petroflux_r' ].append( subhostdf['petroflux_r'] )
-                        sne[ 'hostgal_petroflux_r_err'] .append( subhostdf['petroflux_r_err'] )
-                        sne[ 'hostgal_snsep' ].append( subhostdf['nearbyextobj1sep'] )
-                        sne[ 'hostgal_pzmean' ].append( subhostdf['pzmean'] )
-                        sne[ 'hostgal_pzstd' ].append( subhostdf['pzstd'] )
-                        for bandin in range( len(bands) ):
-                            sne[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}' ].append(
-                                subhostdf[f'stdcolor_{bands[bandi]}_{bands[bandi+1]}'] )
-                            sne[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}_err' ].append(
-                                subhostdf[f'stdcolor_{bands[bandi]}_{bands[bandi+1]}_err'] )
-                else:
-                    raise RuntimeError( "This should never happen." )
+                df = df.merge( hostdf, on='rootid', how='left' )
+            headers = { 'FASTDB-Cursor': str( newcursor ) } if use_cursor else None
+            return columnar_response( df, fmt, headers=headers )
 
+        sne = hot_transients_json( df, hostdf, return_format=return_format )
 
         # logger.info( "GetHotTransients; returning" )
+        if use_cursor:
+            return { 'cursor': str( newcursor ), 'transients': sne }
         return sne
 
 
 
 
+def _hot_transient_chunks( chunks, fmt, return_format ):
+    # Turn what ltcv.iter_hot_ltcvs yields into chunks for streaming_response
+    for df, hostdf in chunks:
+        if fmt == 'arrow':
+            yield df if hostdf is None else df.merge( hostdf, on='rootid', how='left' )
+        else:
+            yield hot_transients_json( df, hostdf, return_format=return_format )
+
+
 # **********************************************************************
 # **********************************************************************
 # **********************************************************************
@@ -332,6 +522,8 @@ bp = flask.Blueprint( 'ltcvapp', __name__, url_prefix='/ltcv' )
 urls = {
     "/getltcv/<procver>/<objid>": GetLtcv,
     "/getrandomltcv/<procver>": GetRandomLtcv,
+    "/getltcvs": GetLtcvs,
+    "/getltcvs/<procver>": GetLtcvs,
     "/gethottransients": GetHotTransients
 }
 
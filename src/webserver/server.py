@@ -1,15 +1,19 @@
+import io
 import logging
 
+import numpy
+import pandas
 import flask
 import flask_session
 
 import db
 import ltcv
+import util
 import webserver.rkauth_flask as rkauth_flask
 import webserver.dbapp as dbapp
 import webserver.ltcvapp as ltcvapp
 import webserver.spectrumapp as spectrumapp
-from webserver.baseview import BaseView
+from webserver.baseview import BaseView, release_request_dbcon, authuser_cache, columnar_response
 
 # ======================================================================
 # Global config
@@ -36,14 +40,8 @@ class GetProcVers( BaseView ):
     def do_the_things( self ):
         # global app
 
-        with db.DB() as con:
-            cursor = con.cursor()
-            cursor.execute( "SELECT description FROM processing_version" )
-            pvrows = cursor.fetchall()
-            cursor.execute( "SELECT description FROM processing_version_alias" )
-            alrows = cursor.fetchall()
-
-        rows = [ r[0] for r in ( pvrows + alrows ) ]
+        rows = ( list( db.procver_cache.descriptions( dbcon=self.dbcon ).values() )
+                 + list( db.procver_cache.all_aliases( dbcon=self.dbcon ).keys() ) )
         rows.sort()
 
         # app.logger.debug( f"GetProcVers: rows is {rows}" )
@@ -60,42 +58,15 @@ class ProcVer( BaseView ):
         # global app
         # app.logger.debug( f"In ProcVer with procver={procver}" )
 
-        pvid = None
-        with db.DB() as con:
-            cursor = con.cursor()
-            try:
-                intpv = int(procver)
-                cursor.execute( "SELECT id FROM processing_version WHERE id=%(pv)s", { 'pv': intpv } )
-                rows = cursor.fetchall()
-                if len(rows) > 0:
-                    pvid = rows[0][0]
-            except Exception:
-                pass
-            if pvid is None:
-                cursor.execute( "SELECT id FROM processing_version WHERE description=%(pv)s", { 'pv': procver } )
-                row = cursor.fetchone()
-                if row is not None:
-                    pvid = row[0]
-            if pvid is None:
-                cursor.execute( "SELECT id FROM processing_version_alias "
-                                "WHERE description=%(pv)s ORDER BY description ",
-                                { 'pv': procver } )
-                row = cursor.fetchone()
-                if row is not None:
-                    pvid = row[0]
-
-            if pvid is None:
-                return f"Unknonw processing version {procver}", 500
-
-            retval = { 'status': 'ok', 'id': None, 'description': None, 'aliases': [] }
-            cursor.execute( "SELECT id,description FROM processing_version WHERE id=%(pv)s", { 'pv': pvid } )
-            row = cursor.fetchone()
-            retval['id'] = row[0]
-            retval['description'] = row[1]
-            cursor.execute( "SELECT description FROM processing_version_alias WHERE id=%(pv)s", { 'pv': pvid } )
-            rows = cursor.fetchall()
-            retval['aliases'] = [ r[0] for r in rows ]
-            return retval
+        try:
+            pvid = db.procver_id( procver, must_exist=True, dbcon=self.dbcon )
+        except ValueError:
+            return f"Unknonw processing version {procver}", 500
+
+        return { 'status': 'ok',
+                 'id': pvid,
+                 'description': db.procver_cache.description( pvid, dbcon=self.dbcon ),
+                 'aliases': db.procver_cache.aliases( pvid, dbcon=self.dbcon ) }
 
 
 
@@ -113,19 +84,13 @@ class CountThings( BaseView ):
             return f"Unknown thing to count: {which}", 500
         table = tablemap[ which ]
 
-        with db.DB() as dbcon:
-            cursor = dbcon.cursor()
-            cursor.execute( "SELECT id FROM processing_version WHERE description=%(pv)s",
-                            { 'pv': procver } )
-            rows = cursor.fetchall()
-            if len(rows) == 0:
-                cursor.execute( "SELECT id FROM processing_version_alias WHERE description=%(pv)s",
-                                { 'pv': procver } )
-                rows = cursor.fetchall()
-                if len(rows) == 0:
-                    return f"Unknown processing version {procver}", 500
-            pvid = rows[0][0]
+        with db.DB( self.rodbcon ) as dbcon:
+            try:
+                pvid = db.procver_id( procver, must_exist=True, dbcon=dbcon )
+            except ValueError:
+                return f"Unknown processing version {procver}", 500
 
+            cursor = dbcon.cursor()
             cursor.execute( f"SELECT COUNT(*) FROM {table} WHERE processing_version=%(pv)s",
                             { 'pv': pvid } )
             rows = cursor.fetchall()
@@ -143,9 +108,83 @@ class ObjectSearch( BaseView ):
         global app
         if not flask.request.is_json:
             raise TypeError( "POST data was not JSON; send search criteria as a JSON dict" )
-        searchdata = flask.request.json
+        searchdata = dict( flask.request.json )
+
+        # return_format may be 'json' (the default), 'arrow', or 'npz'
+        #   (or ask for the latter two with an Accept header)
+        return_format = searchdata.pop( 'return_format', None )
+        if return_format not in ( None, 'json', 'arrow', 'npz' ):
+            raise ValueError( f"Unknown return_format {return_format}" )
+        fmt = self.columnar_format( return_format ) if return_format != 'json' else None
+
+        # Pass limit and after_diaobjectid in searchdata to page through the results
+        if fmt is not None:
+            return columnar_response( ltcv.object_search( processing_version, return_format='pandas',
+                                                          dbcon=self.rodbcon, **searchdata ), fmt )
+        return ltcv.object_search( processing_version, return_format='json', dbcon=self.rodbcon, **searchdata )
+
+
+# ======================================================================
 
-        return ltcv.object_search( processing_version, return_format='json', **searchdata )
+class CrossMatch( BaseView ):
+    """Match a list of positions to objects.  URL endpoint /crossmatch/<processing_version>
+
+    POST the positions one of three ways:
+
+      * A JSON dictionary with ra and dec (lists of float, degrees),
+        and optionally radius (arcsec, default 1) and nearest (bool,
+        default false; if true, only the closest object to each position).
+
+      * A CSV file (Content-Type text/csv) with a header line and (at
+        least) columns ra and dec.
+
+      * A numpy .npz file (Content-Type application/octet-stream)
+        with (at least) arrays ra and dec.
+
+    For the last two, pass radius and nearest as URL parameters
+    (e.g. /crossmatch/default?radius=2&nearest=1).
+
+    Returns { 'status': 'ok', 'matches': matches }, where matches is
+    what ltcv.crossmatch returns: lists posindex, diaobjectid, ra, dec,
+    and sep (arcsec).  posindex is the index into the list of positions
+    that was sent.
+
+    """
+
+    def do_the_things( self, processing_version ):
+        mimetype = flask.request.mimetype
+        if flask.request.is_json:
+            data = flask.request.json
+            unknown = set( data.keys() ) - { 'ra', 'dec', 'radius', 'nearest' }
+            if len(unknown) > 0:
+                raise ValueError( f"Unknown data parameters: {unknown}" )
+            params = data
+        else:
+            params = flask.request.args
+            unknown = set( params.keys() ) - { 'radius', 'nearest' }
+            if len(unknown) > 0:
+                raise ValueError( f"Unknown URL parameters: {unknown}" )
+            body = io.BytesIO( flask.request.get_data() )
+            if mimetype == 'text/csv':
+                data = pandas.read_csv( body, skipinitialspace=True )
+            elif mimetype == 'application/octet-stream':
+                data = numpy.load( body, allow_pickle=False )
+            else:
+                raise TypeError( f"Don't know how to read positions from {mimetype}; "
+                                 f"send JSON, text/csv, or application/octet-stream (.npz)" )
+        if ( 'ra' not in data ) or ( 'dec' not in data ):
+            raise ValueError( "Must give both ra and dec" )
+
+        radius = util.float_or_none_from_dict( params, 'radius' )
+        nearest = params.get( 'nearest', False )
+        if isinstance( nearest, str ):
+            nearest = nearest.strip().lower() in ( '1', 'true', 'yes' )
+
+        # crossmatch makes a temp table, so it can't use self.rodbcon
+        matches = ltcv.crossmatch( processing_version, data['ra'], data['dec'],
+                                   radius=radius if radius is not None else 1.,
+                                   nearest=bool( nearest ), dbcon=self.dbcon )
+        return { 'status': 'ok', 'matches': matches }
 
 
 # **********************************************************************
@@ -170,6 +209,8 @@ app.config.from_mapping(
 
 server_session = flask_session.Session( app )
 
+app.teardown_request( release_request_dbcon )
+
 rkauth_flask.RKAuthConfig.setdbparams(
     db_host=db.dbhost,
     db_port=db.dbport,
@@ -187,6 +228,28 @@ rkauth_flask.RKAuthConfig.setdbparams(
 )
 app.register_blueprint( rkauth_flask.bp )
 
+
+# Anything that goes through the auth blueprint (login, logout, password
+#   reset) might change who a user is, so drop them from the authuser cache
+#   that BaseView.check_auth uses.  If we can't tell who it is (e.g. a
+#   password reset link), just clear the whole cache; this doesn't happen often.
+@app.before_request
+def _invalidate_authuser_cache():
+    if flask.request.blueprint != rkauth_flask.bp.name:
+        return
+    usernames = set()
+    if 'username' in flask.session:
+        usernames.add( flask.session['username'] )
+    if flask.request.is_json:
+        data = flask.request.get_json( silent=True )
+        if isinstance( data, dict ) and isinstance( data.get( 'username' ), str ):
+            usernames.add( data['username'] )
+    if len( usernames ) == 0:
+        authuser_cache.invalidate()
+    for username in usernames:
+        authuser_cache.invalidate( username )
+
+
 app.register_blueprint( dbapp.bp )
 app.register_blueprint( ltcvapp.bp )
 app.register_blueprint( spectrumapp.bp )
@@ -197,7 +260,8 @@ urls = {
     "/getprocvers": GetProcVers,
     "/procver/<procver>": ProcVer,
     "/count/<which>/<procver>": CountThings,
-    "/objectsearch/<processing_version>": ObjectSearch
+    "/objectsearch/<processing_version>": ObjectSearch,
+    "/crossmatch/<processing_version>": CrossMatch,
 }
 
 usedurls = {}
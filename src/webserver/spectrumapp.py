@@ -42,7 +42,7 @@ class AskForSpectrum( BaseView ):
                        'wanttime': now }
                        for i in range(len(data['objectids'])) ]
 
-        n = db.WantedSpectra.bulk_insert_or_upsert( tocreate, upsert=True )
+        n = db.WantedSpectra.bulk_insert_or_upsert( tocreate, upsert=True, dbcon=self.dbcon )
 
         return { 'status': 'ok',
                  'message': 'wanted spectra created',
@@ -101,7 +101,8 @@ class WhatSpectraAreWanted( BaseView ):
         df = spectrum.what_spectra_are_wanted( procver=procver, wantsince=wantsince, requester=requester,
                                                notclaimsince=notclaimsince, nospecsince=nospecsince,
                                                detsince=detsince, lim_mag=lim_mag, lim_mag_band=lim_mag_band,
-                                               mjdnow=mjdnow, logger=flask.current_app.logger )
+                                               mjdnow=mjdnow, logger=flask.current_app.logger,
+                                               dbcon=self.dbcon )
 
         # Build the return structure
         retarr = []
@@ -146,7 +147,7 @@ class PlanSpectrum( BaseView ):
                    'comment': data['comment'] if 'comment' in data else None
                   }
         plansp = db.PlannedSpectra( **kwargs )
-        plansp.insert( refresh=False )
+        plansp.insert( refresh=False, dbcon=self.dbcon )
 
         return { "status": "ok" }
 
@@ -161,7 +162,7 @@ class RemoveSpectrumPlan( BaseView ):
         if ( 'oid' not in data ) or ( 'facility' not in data ):
             return "JSON payload must include keys oid and facility", 500
 
-        with db.DB() as con:
+        with db.DB( self.dbcon ) as con:
             cursor = con.cursor()
             cursor.execute( "DELETE FROM plannedspectra WHERE root_diaobject_id=%(id)s "
                             "  AND facility=%(fac)s",
@@ -191,7 +192,7 @@ class ReportSpectrumInfo( BaseView ):
                                                   ( str(data['z']).strip()=="" ) )
                                         else float( data['z'] ) ),
                                     classid=int( data['classid'] ) )
-        specinfo.insert( refresh=False )
+        specinfo.insert( refresh=False, dbcon=self.dbcon )
 
         return { 'status': 'ok' }
 
@@ -207,7 +208,7 @@ class GetSpectrumInfo( BaseView ):
             data['rootids'] = data['oid']
             del data['oid']
 
-        df = spectrum.get_spectrum_info( logger=flask.current_app.logger, **data )
+        df = spectrum.get_spectrum_info( logger=flask.current_app.logger, dbcon=self.dbcon, **data )
         df.rename( columns={ 'root_diaobject_id': 'oid' }, inplace=True )
         df['inserted_at'] = df['inserted_at'].apply( lambda x: x.isoformat() )
         return df.to_dict( 'records' )
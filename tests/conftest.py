@@ -377,6 +377,11 @@ def snana_fits_maintables_loaded_module( procver ):
             cursor.execute( "SELECT COUNT(*) FROM host_galaxy" )
             nhost = cursor.fetchone()[0]
             assert nhost == 356
+            cursor.execute( "SELECT COUNT(*) FROM diaobject_detstats" )
+            ndetstats = cursor.fetchone()[0]
+            cursor.execute( "SELECT COUNT(*) FROM "
+                            "( SELECT DISTINCT diaobjectid, processing_version FROM diasource ) subq" )
+            assert ndetstats == cursor.fetchone()[0]
 
             # Build the root diaobject; kind of a hack, but whatever.  Might be slow
             #   for lots of objects, but our test set is small
@@ -401,7 +406,8 @@ def snana_fits_maintables_loaded_module( procver ):
     finally:
         with DB() as conn:
             cursor = conn.cursor()
-            for tab in [ 'root_diaobject', 'host_galaxy', 'diaobject', 'diasource', 'diaforcedsource' ]:
+            for tab in [ 'root_diaobject', 'host_galaxy', 'diaobject', 'diasource', 'diaforcedsource',
+                         'diaobject_detstats', 'ingest_batch' ]:
                 cursor.execute( f"TRUNCATE TABLE {tab} CASCADE" )
             conn.commit()
 
@@ -1,5 +1,8 @@
 import pytest
 import uuid
+import pickle
+
+import numpy as np
 
 import psycopg
 
@@ -56,7 +59,7 @@ class BaseTestDB:
         assert obj2._tablemeta is not None
         assert obj2._tablemeta == obj1.tablemeta
 
-    def test_instantiate( self, basetest_setup ):
+    def test_instantiate( self, basetest_setup, monkeypatch ):
         # Test basic instantiation
         obj = self.cls( **self.dict1 )
         assert all( getattr( obj, k ) is not None for k in obj._pk )
@@ -67,6 +70,32 @@ class BaseTestDB:
         with pytest.raises( RuntimeError, match="Unknown columns" ):
             _ = self.cls( this_column_will_never_exist_in_any_table=42 )
 
+        # Columns live in slots, not a __dict__
+        assert isinstance( obj, self.cls )
+        assert not hasattr( obj, '__dict__' )
+        with pytest.raises( AttributeError ):
+            obj.this_column_will_never_exist_in_any_table = 42
+
+        # Make sure pickling still works
+        unpickled = pickle.loads( pickle.dumps( obj ) )
+        assert type( unpickled ) is type( obj )
+        for k, v in self.dict1.items():
+            assert getattr( unpickled, k ) == v
+
+        # ...even in a process that hasn't loaded the table metadata (and
+        #   so doesn't need a database)
+        pickled = pickle.dumps( obj )
+
+        def _no_meta( cls, dbcon=None ):
+            raise RuntimeError( "Tried to load table metadata" )
+        monkeypatch.setattr( self.cls, '_tablemeta', None )
+        monkeypatch.setattr( self.cls, '_rowclass', None )
+        monkeypatch.setattr( self.cls, 'load_table_meta', classmethod( _no_meta ) )
+        unpickled = pickle.loads( pickled )
+        assert isinstance( unpickled, self.cls )
+        for k, v in self.dict1.items():
+            assert getattr( unpickled, k ) == v
+
 
     def test_insert( self, obj1_inserted ):
         with DB() as dbcon:
@@ -176,6 +205,17 @@ class BaseTestDB:
         # Make sure we get an empty list if we ask for non-existing stuff
         them = self.cls.get_batch( [ missing ] )
         assert them == []
+        assert self.cls.get_batch( [] ) == []
+
+        # Make sure chunking doesn't lose anything
+        them = self.cls.get_batch( [ self.obj1.pks, missing, self.obj2.pks ], chunksize=1 )
+        assert sorted( [ i.pks for i in them ] ) == sorted( [ self.obj1.pks, self.obj2.pks ] )
+
+        # Make sure we can ask for just some columns
+        them = self.cls.get_batch( [ self.obj1.pks ], columns=self.cls._pk )
+        assert len(them) == 1
+        assert them[0].pks == self.obj1.pks
+        assert all( not hasattr( them[0], c ) for c in self.columns if c not in self.cls._pk )
 
 
     def test_get_by_attrs( self, obj1_inserted, obj2_inserted ):
@@ -230,6 +270,18 @@ class BaseTestDB:
             assert len(gotten) == 2
             assert sorted( [ i.pks for i in gotten ] ) == sorted( [ self.obj1.pks, self.obj2.pks ] )
 
+            # iter_byattrs should give the same thing even if it has to fetch more than once
+            itr = self.cls.iter_byattrs( fetch_size=1, **kwargs )
+            assert not isinstance( itr, list )
+            gotten = list( itr )
+            assert len(gotten) == 2
+            assert sorted( [ i.pks for i in gotten ] ) == sorted( [ self.obj1.pks, self.obj2.pks ] )
+
+            # ...including on a connection we pass
+            with DB() as con:
+                gotten = list( self.cls.iter_byattrs( dbcon=con, fetch_size=1, **kwargs ) )
+                assert len(gotten) == 2
+
     def test_unique( self, obj1_inserted ):
         if len( self.uniques ) == 0:
             # Can't run this test, so just pass
@@ -314,6 +366,75 @@ class BaseTestDB:
             self.obj1.delete_from_db()
             self.obj2.delete_from_db()
 
+            # Next : dictionary of numpy arrays (goes through copy_columnar_data)
+            dictofarrays = { k: np.array( v ) for k, v in dictoflists.items() }
+            n = self.cls.bulk_insert_or_upsert( dictofarrays )
+            assert n == 2
+            objs = self.cls.get_batch( [ self.obj1.pks, self.obj2.pks ] )
+            assert len( objs ) == 2
+            for obj in [ self.obj1, self.obj2 ]:
+                which = [ o for o in objs if [ getattr(o, k) for k in self.cls._pk ] == obj.pks ]
+                which = which[0]
+                assert all( getattr( which, k ) == getattr( obj, k ) for k in self.columns if k not in jsoncols )
+            self.obj1.delete_from_db()
+            self.obj2.delete_from_db()
+
+            # Zero-length numpy columns are nothing to do (like an empty list), not a crash
+            emptyarrays = { k: v[:0] for k, v in dictofarrays.items() }
+            assert self.cls.bulk_insert_or_upsert( emptyarrays ) is None
+            assert self.cls.bulk_insert_or_upsert( iter( [ emptyarrays ] ) ) == 0
+            with DB() as con:
+                cursor = con.cursor()
+                cursor.execute( f"CREATE TEMP TABLE temp_test_empty_copy (LIKE {self.cls.__tablename__})" )
+                assert self.cls.copy_columnar_data( cursor, 'temp_test_empty_copy', emptyarrays ) == 0
+                cursor.execute( "SELECT COUNT(*) FROM temp_test_empty_copy" )
+                assert cursor.fetchone()[0] == 0
+                con.rollback()
+
+            # Next : generator of dictionaries, one row per chunk
+            for commit_each_chunk in [ False, True ]:
+                n = self.cls.bulk_insert_or_upsert( ( d for d in dicts ), chunksize=1,
+                                                    commit_each_chunk=commit_each_chunk )
+                assert n == 2
+                objs = self.cls.get_batch( [ self.obj1.pks, self.obj2.pks ] )
+                assert len( objs ) == 2
+                for obj in [ self.obj1, self.obj2 ]:
+                    which = [ o for o in objs if [ getattr(o, k) for k in self.cls._pk ] == obj.pks ]
+                    which = which[0]
+                    assert all( getattr( which, k ) == getattr( obj, k ) for k in self.columns if k not in jsoncols )
+                self.obj1.delete_from_db()
+                self.obj2.delete_from_db()
+
+            # A chunk that fails after an earlier chunk was committed leaves
+            #   the earlier chunk, and cleans up the staging table
+            with DB() as con:
+                with pytest.raises( Exception ):
+                    self.cls.bulk_insert_or_upsert( iter( [ [ dicts[0] ], [ { 'this_is_not_a_column': 1 } ] ] ),
+                                                    dbcon=con, commit_each_chunk=True )
+                cursor = con.cursor()
+                cursor.execute( "SELECT COUNT(*) FROM pg_class WHERE relname LIKE 'temp_bulk_upsert_%' "
+                                "AND relpersistence='t'" )
+                assert cursor.fetchone()[0] == 0
+            objs = self.cls.get_batch( [ self.obj1.pks, self.obj2.pks ] )
+            assert len( objs ) == 1
+            self.obj1.delete_from_db()
+
+            # Next : two bulk upserts on the same connection at the same time
+            with DB() as con:
+                q = self.cls.bulk_insert_or_upsert( [ dicts[0] ], dbcon=con, nocommit=True,
+                                                    staging_table="temp_test_bulk_upsert" )
+                n = self.cls.bulk_insert_or_upsert( iter( [ [ dicts[1] ] ] ), dbcon=con )
+                assert n == 1
+                cursor = con.cursor()
+                cursor.execute( q )
+                assert cursor.rowcount == 1
+                cursor.execute( "DROP TABLE temp_test_bulk_upsert" )
+                con.commit()
+            objs = self.cls.get_batch( [ self.obj1.pks, self.obj2.pks ] )
+            assert len( objs ) == 2
+            self.obj1.delete_from_db()
+            self.obj2.delete_from_db()
+
 
             # TODO : test updating, conflicts, etc.
 
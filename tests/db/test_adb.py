@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+import db
+from db import ADB, DiaForcedSource
+
+
+async def _backend_pid( conn ):
+    cursor = conn.cursor()
+    await cursor.execute( "SELECT pg_backend_pid()" )
+    return ( await cursor.fetchone() )[0]
+
+
+def test_adb_pool():
+    async def go():
+        async with ADB() as conn:
+            pid1 = await _backend_pid( conn )
+        async with ADB() as conn:
+            pid2 = await _backend_pid( conn )
+        assert pid1 == pid2
+
+        # Queries that happen at the same time need different connections
+        async def sleepy():
+            async with ADB() as conn:
+                cursor = conn.cursor()
+                await cursor.execute( "SELECT pg_sleep(0.5), pg_backend_pid()" )
+                return ( await cursor.fetchone() )[1]
+
+        loop = asyncio.get_running_loop()
+        t0 = loop.time()
+        pids = await asyncio.gather( *[ sleepy() for i in range(4) ] )
+        assert loop.time() - t0 < 1.5
+        assert len( set( pids ) ) == 4
+
+        await db.get_async_dbpool().close()
+
+    asyncio.run( go() )
+
+
+def test_adb_pool_max_open():
+    async def go():
+        pool = db.AsyncConnectionPool( max_size=1, max_open=1, timeout=0.2 )
+        try:
+            conn = await pool.getconn()
+            with pytest.raises( RuntimeError, match="Timed out" ):
+                await pool.getconn()
+
+            # Waiting doesn't block the event loop, so somebody else can give the connection back
+            async def giveback():
+                await asyncio.sleep( 0.05 )
+                await pool.putconn( conn )
+
+            conn2, _ = await asyncio.gather( pool.getconn(), giveback() )
+            assert conn2 is conn
+            await pool.putconn( conn2 )
+        finally:
+            await pool.close()
+
+    asyncio.run( go() )
+
+
+def test_async_dbbase( procver1, obj1 ):
+    dicts = [ { 'diaforcedsourceid': i, 'processing_version': procver1.id,
+                'diaobjectid': obj1.diaobjectid, 'diaobject_procver': obj1.processing_version,
+                'visit': i, 'detector': 1, 'midpointmjdtai': 60000. + i, 'band': 'r',
+                'ra': 42., 'dec': 13., 'psfflux': 100. + i, 'psffluxerr': 1. }
+              for i in range( 100, 110 ) ]
+
+    async def go():
+        n = await DiaForcedSource.abulk_insert_or_upsert( dicts )
+        assert n == 10
+
+        # Generator input, and make sure it doesn't insert things that are already there
+        n = await DiaForcedSource.abulk_insert_or_upsert( ( d for d in dicts ), chunksize=3 )
+        assert n == 0
+
+        obj = await DiaForcedSource.aget( 105, procver1.id )
+        assert isinstance( obj, DiaForcedSource )
+        assert obj.visit == 105
+        assert obj.psfflux == 205.
+        assert await DiaForcedSource.aget( 666, procver1.id ) is None
+
+        objs = await DiaForcedSource.aget_batch( [ [ i, procver1.id ] for i in range( 100, 110 ) ], chunksize=4 )
+        assert sorted( o.diaforcedsourceid for o in objs ) == list( range( 100, 110 ) )
+
+        # Many at once
+        objs = await asyncio.gather( *[ DiaForcedSource.aget( i, procver1.id ) for i in range( 100, 110 ) ] )
+        assert [ o.diaforcedsourceid for o in objs ] == list( range( 100, 110 ) )
+
+        await db.get_async_dbpool().close()
+
+    try:
+        asyncio.run( go() )
+    finally:
+        with db.DB() as con:
+            cursor = con.cursor()
+            cursor.execute( "DELETE FROM diaforcedsource WHERE diaforcedsourceid>=100 AND diaforcedsourceid<110" )
+            con.commit()
@@ -0,0 +1,179 @@
+import os
+import time
+import threading
+import multiprocessing
+
+import pytest
+
+import db
+from db import DB, ConnectionPool
+
+
+def _backend_pid( conn ):
+    cursor = conn.cursor()
+    cursor.execute( "SELECT pg_backend_pid()" )
+    return cursor.fetchone()[0]
+
+
+def test_db_reuses_connections():
+    with DB() as conn:
+        pid1 = _backend_pid( conn )
+    with DB() as conn:
+        pid2 = _backend_pid( conn )
+    assert pid1 == pid2
+
+    # Nested DB() calls need different connections
+    with DB() as conn1:
+        with DB() as conn2:
+            assert conn1 is not conn2
+            assert _backend_pid( conn1 ) != _backend_pid( conn2 )
+
+
+def test_pool_resets_connections():
+    pool = ConnectionPool( db.get_dbcon, max_size=1 )
+    try:
+        conn = pool.getconn()
+        pid = _backend_pid( conn )
+        cursor = conn.cursor()
+        cursor.execute( "CREATE TEMP TABLE test_dbpool_temp( x int )" )
+        conn.commit()
+        cursor.execute( "INSERT INTO test_dbpool_temp(x) VALUES (1)" )
+        pool.putconn( conn )
+
+        conn = pool.getconn()
+        assert _backend_pid( conn ) == pid
+        cursor = conn.cursor()
+        cursor.execute( "SELECT COUNT(*) FROM pg_tables WHERE tablename='test_dbpool_temp'" )
+        assert cursor.fetchone()[0] == 0
+        assert not conn.autocommit
+
+        # psycopg prepares statements that get run a lot; those need
+        #   to still work after the connection goes back to the pool
+        for i in range( 10 ):
+            cursor.execute( "SELECT %(i)s", { 'i': i } )
+        pool.putconn( conn )
+        conn = pool.getconn()
+        assert _backend_pid( conn ) == pid
+        cursor = conn.cursor()
+        for i in range( 10 ):
+            cursor.execute( "SELECT %(i)s", { 'i': i } )
+            assert cursor.fetchone()[0] == i
+        pool.putconn( conn )
+
+        # A closed connection shouldn't get handed out again
+        conn = pool.getconn()
+        conn.close()
+        pool.putconn( conn )
+        conn2 = pool.getconn()
+        assert not conn2.closed
+        pool.putconn( conn2 )
+
+        # A connection closed while it's in the pool should be replaced
+        conn = pool.getconn()
+        pool.putconn( conn )
+        conn.close()
+        conn2 = pool.getconn()
+        assert conn2 is not conn
+        assert not conn2.closed
+        _backend_pid( conn2 )
+
+        # Pool is full, so an extra connection should just get closed
+        conn3 = pool.getconn()
+        pool.putconn( conn2 )
+        pool.putconn( conn3 )
+        assert conn3.closed
+        assert not conn2.closed
+    finally:
+        pool.close()
+
+
+def test_pool_max_open():
+    with pytest.raises( ValueError, match="max_open" ):
+        ConnectionPool( db.get_dbcon, min_size=3, max_open=2 )
+
+    pool = ConnectionPool( db.get_dbcon, max_size=1, max_open=2, timeout=0.3 )
+    try:
+        conn1 = pool.getconn()
+        conn2 = pool.getconn()
+
+        # Both are out, so the next one has to wait, and gives up after timeout
+        t0 = time.monotonic()
+        with pytest.raises( RuntimeError, match="Timed out after 0.3 s waiting for a database connection" ):
+            pool.getconn()
+        assert time.monotonic() - t0 >= 0.3
+
+        # ...but it gets one if somebody gives one back while it's waiting
+        pool.timeout = 5.
+        threading.Timer( 0.1, pool.putconn, args=( conn1, ) ).start()
+        conn3 = pool.getconn()
+        assert conn3 is conn1
+
+        # A connection that's closed rather than kept (because max_size
+        #   are already idle) frees up its slot too
+        pool.putconn( conn3 )
+        pool.putconn( conn2 )
+        assert conn2.closed
+        assert pool._nopen == 1
+        pool.timeout = 0.3
+        conn4 = pool.getconn()
+        conn5 = pool.getconn()
+        assert conn4 is conn3
+        assert not conn5.closed
+        assert pool._nopen == 2
+        pool.putconn( conn4 )
+        pool.putconn( conn5 )
+        assert pool._nopen == 1
+    finally:
+        pool.close()
+    assert pool._nopen == 0
+
+
+def test_pool_min_size():
+    pool = ConnectionPool( db.get_dbcon, min_size=3, max_size=5, max_open=5 )
+    try:
+        assert len( pool._idle ) == 0
+        conn = pool.getconn()
+        # The first getconn opens min_size connections
+        assert len( pool._idle ) == 2
+        assert pool._nopen == 3
+        pool.putconn( conn )
+        assert len( pool._idle ) == 3
+        conns = [ pool.getconn() for i in range( 3 ) ]
+        pids = { _backend_pid( c ) for c in conns }
+        assert len( pids ) == 3
+        assert pool._nopen == 3
+        for c in conns:
+            pool.putconn( c )
+    finally:
+        pool.close()
+
+
+def test_pool_zero_size():
+    pool = ConnectionPool( db.get_dbcon, max_size=0 )
+    conn = pool.getconn()
+    pool.putconn( conn )
+    assert conn.closed
+
+
+def _child_backend_pid( queue ):
+    with DB() as conn:
+        queue.put( ( os.getpid(), _backend_pid( conn ) ) )
+
+
+def test_pool_after_fork():
+    with DB() as conn:
+        parentpid = _backend_pid( conn )
+
+    ctx = multiprocessing.get_context( 'fork' )
+    queue = ctx.Queue()
+    proc = ctx.Process( target=_child_backend_pid, args=( queue, ) )
+    proc.start()
+    childospid, childpid = queue.get( timeout=30 )
+    proc.join()
+    assert proc.exitcode == 0
+    assert childospid != os.getpid()
+    assert childpid != parentpid
+
+    # The child must not have closed the parent's connection
+    with DB() as conn:
+        assert _backend_pid( conn ) == parentpid
@@ -0,0 +1,194 @@
+import pytest
+
+from db import DB, DiaSource, DiaObjectDetStats
+
+from basetest import BaseTestDB
+
+
+class TestDiaObjectDetStats( BaseTestDB ):
+
+    @pytest.fixture
+    def basetest_setup( self, procver1 ):
+        self.cls = DiaObjectDetStats
+        self.columns = {
+            'diaobjectid',
+            'processing_version',
+            'ndet',
+            'firstdetmjd',
+            'lastdetmjd',
+            'nbandsdetected',
+            'bandsdetected',
+            'maxdetflux',
+            'maxdetfluxerr',
+            'maxdetfluxmjd',
+            'maxdetfluxband',
+            'lastdetflux',
+            'lastdetfluxerr',
+            'lastdetfluxmjd',
+            'lastdetfluxband',
+            'last_ingest_batch',
+        }
+        self.safe_to_modify = [
+            'ndet',
+            'firstdetmjd',
+            'lastdetmjd',
+            'nbandsdetected',
+            'bandsdetected',
+            'maxdetflux',
+            'maxdetfluxerr',
+            'maxdetfluxmjd',
+            'maxdetfluxband',
+            'lastdetflux',
+            'lastdetfluxerr',
+            'lastdetfluxmjd',
+            'lastdetfluxband',
+            'last_ingest_batch',
+        ]
+        self.uniques = []
+
+        self.obj1 = DiaObjectDetStats( diaobjectid=1,
+                                       processing_version=procver1.id,
+                                       ndet=3,
+                                       firstdetmjd=60000.,
+                                       lastdetmjd=60010.,
+                                       nbandsdetected=2,
+                                       bandsdetected='gr',
+                                       maxdetflux=12.5,
+                                       maxdetfluxerr=1.25,
+                                       maxdetfluxmjd=60005.,
+                                       maxdetfluxband='g',
+                                       lastdetflux=10.5,
+                                       lastdetfluxerr=1.5,
+                                       lastdetfluxmjd=60010.,
+                                       lastdetfluxband='r',
+                                       last_ingest_batch=1
+                                      )
+        self.dict1 = { k: getattr( self.obj1, k ) for k in self.columns }
+        self.obj2 = DiaObjectDetStats( diaobjectid=2,
+                                       processing_version=procver1.id,
+                                       ndet=1,
+                                       firstdetmjd=60020.,
+                                       lastdetmjd=60020.,
+                                       nbandsdetected=1,
+                                       bandsdetected='i',
+                                       maxdetflux=20.25,
+                                       maxdetfluxerr=2.,
+                                       maxdetfluxmjd=60020.,
+                                       maxdetfluxband='i',
+                                       lastdetflux=20.25,
+                                       lastdetfluxerr=2.,
+                                       lastdetfluxmjd=60020.,
+                                       lastdetfluxband='i',
+                                       last_ingest_batch=2
+                                      )
+        self.dict2 = { k: getattr( self.obj2, k ) for k in self.columns }
+        self.dict3 = { 'diaobjectid': 3,
+                       'processing_version': procver1.id,
+                       'ndet': 5,
+                       'firstdetmjd': 60030.,
+                       'lastdetmjd': 60050.,
+                       'nbandsdetected': 3,
+                       'bandsdetected': 'giz',
+                       'maxdetflux': 30.5,
+                       'maxdetfluxerr': 3.5,
+                       'maxdetfluxmjd': 60040.,
+                       'maxdetfluxband': 'z',
+                       'lastdetflux': 25.75,
+                       'lastdetfluxerr': 2.75,
+                       'lastdetfluxmjd': 60050.,
+                       'lastdetfluxband': 'g',
+                       'last_ingest_batch': 3 }
+
+
+@pytest.fixture
+def moresrcs( obj1, procver1, src1 ):
+    srcs = []
+    for i, ( band, mjd, flux ) in enumerate( [ ( 'g', 59010., 10. ), ( 'r', 59020., 5. ), ( 'g', 58990., 1. ) ] ):
+        src = DiaSource( diasourceid=43+i,
+                         processing_version=procver1.id,
+                         diaobjectid=obj1.diaobjectid,
+                         diaobject_procver=obj1.processing_version,
+                         visit=65+i,
+                         detector=9,
+                         band=band,
+                         midpointmjdtai=mjd,
+                         ra=obj1.ra,
+                         dec=obj1.dec,
+                         psfflux=flux,
+                         psffluxerr=flux/10.
+                        )
+        src.insert()
+        srcs.append( src )
+
+    yield srcs
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "DELETE FROM diasource WHERE diasourceid=ANY(%(id)s)",
+                        { 'id': [ s.diasourceid for s in srcs ] } )
+        con.commit()
+
+
+@pytest.fixture
+def cleanup_detstats():
+    yield True
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "DELETE FROM diaobject_detstats" )
+        con.commit()
+
+
+def test_detstats_refresh( obj1, src1, src1_pv2, procver1, procver2, cleanup_detstats ):
+    with pytest.raises( ValueError, match="Must pass either processing_version or fromtable" ):
+        DiaObjectDetStats.recompute()
+    with pytest.raises( ValueError, match="Pass either fromtable, or processing_version" ):
+        DiaObjectDetStats.recompute( processing_version=procver1.id, fromtable='diasource' )
+
+    assert DiaObjectDetStats.recompute( processing_version=procver1.id, diaobjectids=[ obj1.diaobjectid ] ) == 1
+    stats = DiaObjectDetStats.get( obj1.diaobjectid, procver1.id )
+    assert stats.ndet == 1
+    assert stats.firstdetmjd == pytest.approx( 59000. )
+    assert stats.lastdetmjd == pytest.approx( 59000. )
+    assert stats.nbandsdetected == 1
+    assert stats.bandsdetected == 'r'
+    assert stats.maxdetflux == pytest.approx( 3. )
+    assert stats.lastdetflux == pytest.approx( 3. )
+    assert stats.lastdetfluxband == 'r'
+    # Only refreshed the one processing version
+    assert DiaObjectDetStats.get( obj1.diaobjectid, procver2.id ) is None
+
+    # A whole processing version by alias
+    assert DiaObjectDetStats.recompute( processing_version=procver2.description ) == 1
+    assert DiaObjectDetStats.get( obj1.diaobjectid, procver2.id ).ndet == 1
+
+
+def test_detstats_incremental( obj1, procver1, src1, moresrcs, cleanup_detstats ):
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "CREATE TEMP TABLE temp_detstats_test AS "
+                        "SELECT * FROM diasource WHERE diasourceid=ANY(%(ids)s)",
+                        { 'ids': [ moresrcs[0].diasourceid, moresrcs[1].diasourceid ] } )
+        assert DiaObjectDetStats.recompute( fromtable='temp_detstats_test', dbcon=con ) == 1
+        cursor.execute( "DROP TABLE temp_detstats_test" )
+
+    # The stats include all sources of the object, not just the ones in the from table
+    stats = DiaObjectDetStats.get( obj1.diaobjectid, procver1.id )
+    assert stats.ndet == 4
+    assert stats.firstdetmjd == pytest.approx( 58990. )
+    assert stats.lastdetmjd == pytest.approx( 59020. )
+    assert stats.nbandsdetected == 2
+    assert stats.bandsdetected == 'gr'
+    assert stats.maxdetflux == pytest.approx( 10. )
+    assert stats.maxdetfluxerr == pytest.approx( 1. )
+    assert stats.maxdetfluxmjd == pytest.approx( 59010. )
+    assert stats.maxdetfluxband == 'g'
+    assert stats.lastdetflux == pytest.approx( 5. )
+    assert stats.lastdetfluxerr == pytest.approx( 0.5 )
+    assert stats.lastdetfluxmjd == pytest.approx( 59020. )
+    assert stats.lastdetfluxband == 'r'
+
+    # Refreshing again changes nothing
+    assert DiaObjectDetStats.recompute( processing_version=procver1.id, diaobjectids=[ obj1.diaobjectid ] ) == 1
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SELECT COUNT(*), MAX(ndet) FROM diaobject_detstats" )
+        assert cursor.fetchone() == ( 1, 4 )
@@ -1,6 +1,8 @@
 import datetime
 import pytest
 
+import numpy as np
+
 from db import DiaForcedSource
 
 from basetest import BaseTestDB
@@ -99,3 +101,46 @@ class TestDiaForcedSource( BaseTestDB ):
                        'time_processed': t0 + datetime.timedelta( days=2 ),
                        'time_withdrawn': t0 + datetime.timedelta( weeks=3 )
                       }
+
+    def test_fetch_columns( self, basetest_setup ):
+        try:
+            self.obj1.insert()
+            self.obj2.insert()
+
+            # All numbers, no NULLs, so this should go through the fast path
+            cols = DiaForcedSource.fetch_columns( columns=[ 'diaforcedsourceid', 'diaobjectid', 'visit',
+                                                            'midpointmjdtai', 'psfflux' ],
+                                                  where="diaforcedsourceid IN (%(a)s,%(b)s)",
+                                                  subdict={ 'a': 1, 'b': 2 } )
+            assert set( cols.keys() ) == { 'diaforcedsourceid', 'diaobjectid', 'visit', 'midpointmjdtai', 'psfflux' }
+            dex = np.argsort( cols['diaforcedsourceid'] )
+            assert cols['diaforcedsourceid'].dtype == np.int64
+            assert cols['visit'].dtype == np.int32
+            assert cols['psfflux'].dtype == np.float32
+            assert cols['midpointmjdtai'].dtype == np.float64
+            assert not isinstance( cols['psfflux'], np.ma.MaskedArray )
+            assert list( cols['diaforcedsourceid'][dex] ) == [ 1, 2 ]
+            assert list( cols['diaobjectid'] ) == [ self.obj1.diaobjectid ] * 2
+            assert cols['midpointmjdtai'][dex] == pytest.approx( [ 60000., 60001. ] )
+            assert cols['psfflux'][dex] == pytest.approx( [ 123.4, 123.5 ], rel=1e-6 )
+
+            # time_withdrawn is NULL for obj1
+            cols = DiaForcedSource.fetch_columns( columns=[ 'diaforcedsourceid', 'band', 'time_withdrawn' ],
+                                                  processing_version=self.obj1.processing_version,
+                                                  diaobjectid=self.obj1.diaobjectid )
+            dex = np.argsort( cols['diaforcedsourceid'] )
+            assert list( cols['diaforcedsourceid'][dex] ) == [ 1, 2 ]
+            assert cols['band'].dtype.kind == 'U'
+            assert list( cols['band'][dex] ) == [ 'r', 'i' ]
+            assert isinstance( cols['time_withdrawn'], np.ma.MaskedArray )
+            assert list( cols['time_withdrawn'].mask[dex] ) == [ True, False ]
+            assert cols['time_withdrawn'][dex][1] == self.obj2.time_withdrawn
+
+            # Nothing there
+            cols = DiaForcedSource.fetch_columns( columns=[ 'diaforcedsourceid', 'psfflux' ], diaforcedsourceid=-1 )
+            assert len( cols['diaforcedsourceid'] ) == 0
+            assert cols['psfflux'].dtype == np.float32
+
+        finally:
+            self.obj1.delete_from_db()
+            self.obj2.delete_from_db()
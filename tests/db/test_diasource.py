@@ -1,3 +1,8 @@
+import os
+import gc
+import random
+import tracemalloc
+
 import pytest
 
 from db import DiaSource
@@ -157,3 +162,44 @@ class TestDiaSource( BaseTestDB ):
                        'dec': 13.0002,
                        'psfflux': 135.7,
                        'psffluxerr': 9.1 }
+
+
+@pytest.mark.skipif( os.getenv( 'FASTDB_BENCHMARK' ) is None, reason="FASTDB_BENCHMARK not set" )
+def test_diasource_memory_benchmark():
+    # How much memory 10⁵ DiaSource objects take beyond their values, compared
+    #   to what they took when the columns were in each object's __dict__
+    #   (which, with more than 30 attributes, doesn't get shared keys).
+    class DictRow:
+        pass
+
+    DiaSource.load_table_meta()
+    cols = list( DiaSource._tablemeta.keys() )
+    n = 100000
+    rng = random.Random( 42 )
+    rows = [ tuple( rng.random() for c in cols ) for _ in range( n ) ]
+
+    gc.collect()
+    tracemalloc.start()
+    dictobjs = []
+    for row in rows:
+        obj = DictRow()
+        for col, val in zip( cols, row ):
+            setattr( obj, col, val )
+        dictobjs.append( obj )
+    dictbytes = tracemalloc.get_traced_memory()[0] / n
+    tracemalloc.stop()
+    del dictobjs
+    gc.collect()
+
+    tracemalloc.start()
+    objs = DiaSource._objects_from_rows( cols, rows )
+    slotbytes = tracemalloc.get_traced_memory()[0] / n
+    tracemalloc.stop()
+    assert len( objs ) == n
+
+    # Each value is a 24-byte float object (plus an 8-byte pointer, counted above)
+    valbytes = 24 * len( cols )
+    print( f"\nDiaSource ({len(cols)} columns), bytes per object beyond values: "
+           f"__dict__ {dictbytes:.0f}, __slots__ {slotbytes:.0f}; "
+           f"including values: {dictbytes+valbytes:.0f} vs. {slotbytes+valbytes:.0f}" )
+    assert slotbytes < 0.5 * dictbytes
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+import db
+from db import DB
+
+
+def _add_alias( pvid, alias ):
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "INSERT INTO processing_version_alias(id,description) VALUES (%(id)s,%(alias)s)",
+                        { 'id': pvid, 'alias': alias } )
+        con.commit()
+
+
+def _remove_aliases( pvid ):
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "DELETE FROM processing_version_alias WHERE id=%(id)s", { 'id': pvid } )
+        con.commit()
+
+
+@pytest.fixture
+def cache():
+    c = db.ProcessingVersionCache( ttl=300. )
+    yield c
+    c._close_listener()
+
+
+@pytest.fixture
+def count_loads( cache, monkeypatch ):
+    loads = []
+    origload = cache._load
+
+    def _load( dbcon=None ):
+        loads.append( 1 )
+        return origload( dbcon )
+
+    monkeypatch.setattr( cache, '_load', _load )
+    return loads
+
+
+def test_procver_id( cache, procver1, procver2, count_loads ):
+    try:
+        _add_alias( procver1.id, 'realtime' )
+
+        # Integers aren't checked unless they have to be
+        assert cache.id( 42 ) == 42
+        assert cache.id( '42' ) == 42
+        assert cache.id( 666 ) == 666
+        assert len( count_loads ) == 0
+
+        assert cache.id( 'pv42' ) == 42
+        assert cache.id( 'pv23' ) == 23
+        assert cache.id( 'realtime' ) == 42
+        assert cache.id( 42, must_exist=True ) == 42
+        assert cache.id( '23', must_exist=True ) == 23
+        assert len( count_loads ) == 1
+
+        # Unknown things reload once (in case they're brand new) before giving up
+        with pytest.raises( ValueError, match="Unknown processing version nope" ):
+            cache.id( 'nope' )
+        with pytest.raises( ValueError, match="Unknown processing version 666" ):
+            cache.id( 666, must_exist=True )
+        assert len( count_loads ) == 3
+
+        assert cache.description( 42 ) == 'pv42'
+        assert cache.description( 666 ) is None
+        assert cache.aliases( 42 ) == [ 'realtime' ]
+        assert cache.aliases( 23 ) == []
+        assert cache.descriptions()[23] == 'pv23'
+        assert cache.all_aliases() == { 'realtime': 42 }
+
+        # The module-level function does the same thing
+        assert db.procver_id( 'realtime' ) == 42
+    finally:
+        _remove_aliases( procver1.id )
+
+
+def test_procver_cache_notify( cache, procver1, procver2, count_loads ):
+    try:
+        assert cache.id( 'pv42' ) == 42
+        assert cache.aliases( 23 ) == []
+        assert len( count_loads ) == 1
+
+        # Changing the alias table should send a notification that makes the cache reload
+        _add_alias( procver2.id, 'moved' )
+        t0 = time.monotonic()
+        while ( cache.aliases( 23 ) != [ 'moved' ] ) and ( time.monotonic() - t0 < 5. ):
+            time.sleep( 0.05 )
+        assert cache.aliases( 23 ) == [ 'moved' ]
+
+        # Re-point the alias; a reload is the only way the cache could know
+        nloads = len( count_loads )
+        with DB() as con:
+            cursor = con.cursor()
+            cursor.execute( "UPDATE processing_version_alias SET id=42 WHERE description='moved'" )
+            con.commit()
+        t0 = time.monotonic()
+        while ( cache.id( 'moved' ) != 42 ) and ( time.monotonic() - t0 < 5. ):
+            time.sleep( 0.05 )
+        assert cache.id( 'moved' ) == 42
+        assert len( count_loads ) > nloads
+    finally:
+        _remove_aliases( procver1.id )
+        _remove_aliases( procver2.id )
+
+
+def test_procver_cache_ttl( procver1, monkeypatch ):
+    cache = db.ProcessingVersionCache( ttl=0.2 )
+    try:
+        # Without a listener, the ttl is the only thing that makes the cache notice changes
+        monkeypatch.setattr( cache, '_listen_retry', time.monotonic() + 3600. )
+        assert cache.aliases( 42 ) == []
+        _add_alias( procver1.id, 'ttltest' )
+        assert cache.aliases( 42 ) == []
+        time.sleep( 0.3 )
+        assert cache.aliases( 42 ) == [ 'ttltest' ]
+        assert cache._listener is None
+    finally:
+        _remove_aliases( procver1.id )
+        cache._close_listener()
@@ -0,0 +1,66 @@
+import pytest
+
+import db
+from db import DB, query_stats, query_fingerprint
+
+
+@pytest.fixture
+def stats_on():
+    was = ( query_stats.enabled, query_stats.slow_query_secs, query_stats.explain_slow_queries )
+    query_stats.reset()
+    query_stats.enable( slow_query_secs=0.2, explain_slow_queries=True )
+    yield query_stats
+    query_stats.enabled, query_stats.slow_query_secs, query_stats.explain_slow_queries = was
+    query_stats.reset()
+
+
+def test_query_fingerprint():
+    assert ( query_fingerprint( "/*+ IndexScan(f) */ SELECT a,b FROM t\n  WHERE x=%(x)s AND y IN (1, 2.5e3, 3) "
+                                "AND z='it''s' AND w=$1" )
+             == "SELECT a,b FROM t WHERE x=? AND y IN (?,...) AND z=? AND w=?" )
+    assert ( query_fingerprint( "DROP TABLE temp_bulk_upsert_0123456789abcdef0123456789abcdef" )
+             == "DROP TABLE temp_bulk_upsert_?" )
+    assert query_fingerprint( "SELECT col1 FROM t2 WHERE q=%s" ) == "SELECT col1 FROM t2 WHERE q=?"
+
+
+def test_query_stats( stats_on ):
+    with DB() as con:
+        cursor = con.cursor()
+        assert isinstance( cursor, db.InstrumentedCursor )
+        for i in range( 3 ):
+            cursor.execute( "SELECT generate_series(1, %(n)s)", { 'n': 10 + i } )
+
+        # A slow one should get logged, along with its plan
+        cursor.execute( "SELECT pg_sleep(0.25)" )
+        # ...and the cursor should still have the results of the query, not the explain
+        assert cursor.description[0].name == 'pg_sleep'
+        assert len( cursor.fetchall() ) == 1
+
+        with db.server_cursor( con, fetch_size=7 ) as sscursor:
+            assert isinstance( sscursor, db.InstrumentedServerCursor )
+            sscursor.execute( "SELECT generate_series(1, 20)" )
+            assert len( list( sscursor ) ) == 20
+
+    summary = { s['fingerprint']: s for s in query_stats.summary() }
+    s = summary[ "SELECT generate_series(?,...)" ]
+    # Three from the client cursor, one from the server cursor
+    assert s['calls'] == 4
+    assert s['rows'] == 10 + 11 + 12 + 20
+
+    s = summary[ "SELECT pg_sleep(?)" ]
+    assert s['calls'] == 1
+    assert s['max_secs'] >= 0.25
+    assert query_stats.summary( limit=1 )[0]['fingerprint'] == "SELECT pg_sleep(?)"
+
+    assert len( query_stats.slow_queries ) == 1
+    assert query_stats.slow_queries[0]['query'] == "SELECT pg_sleep(0.25)"
+    assert 'actual time' in query_stats.slow_queries[0]['plan']
+
+    # Turned off, nothing more should get recorded
+    query_stats.disable()
+    with DB() as con:
+        cursor = con.cursor()
+        assert not isinstance( cursor, db.InstrumentedCursor )
+        cursor.execute( "SELECT generate_series(1, 3)" )
+    summary = { s['fingerprint']: s for s in query_stats.summary() }
+    assert summary[ "SELECT generate_series(?,...)" ]['calls'] == 4
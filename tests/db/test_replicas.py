@@ -0,0 +1,104 @@
+import os
+import time
+
+import pytest
+import psycopg
+
+import db
+from db import DB
+
+
+def _server( conn ):
+    return ( conn.info.host, conn.info.port )
+
+
+@pytest.fixture
+def replicas( monkeypatch ):
+    """Returns a function that sets the replicas in the config and forgets what replicas are down."""
+    def set_replicas( reps ):
+        monkeypatch.setattr( db.config, 'dbreplicas', reps )
+        db._replica_down_until.clear()
+    yield set_replicas
+    db._replica_down_until.clear()
+
+
+# A port on the database host that nothing is listening on
+_deadreplica = f"{db.dbhost}:1"
+
+
+def test_no_replicas( replicas ):
+    replicas( [] )
+    assert db.replica_hosts() == []
+    with DB() as con:
+        primary = _server( con )
+    with DB( readonly=True ) as con:
+        assert _server( con ) == primary
+        cursor = con.cursor()
+        cursor.execute( "SHOW transaction_read_only" )
+        assert cursor.fetchone()[0] == 'on'
+        with pytest.raises( psycopg.errors.ReadOnlySqlTransaction ):
+            cursor.execute( "CREATE TEMP TABLE test_replica_temp( x int )" )
+
+    # The connection went back to the pool; it shouldn't still be read only
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SHOW transaction_read_only" )
+        assert cursor.fetchone()[0] == 'off'
+
+
+def test_replica_fallback( replicas, monkeypatch ):
+    monkeypatch.setattr( db.config, 'dbreplica_retry_secs', 0.5 )
+    replicas( [ _deadreplica ] )
+    host, port = db._parse_replica( _deadreplica )
+    assert db.replica_hosts() == [ ( host, port ) ]
+
+    with DB() as con:
+        primary = _server( con )
+    with DB( readonly=True ) as con:
+        assert _server( con ) == primary
+        cursor = con.cursor()
+        cursor.execute( "SELECT 1" )
+
+    # It should have noticed that the replica is down, and not try it for a while
+    assert db.replica_hosts() == []
+    time.sleep( 0.6 )
+    assert db.replica_hosts() == [ ( host, port ) ]
+
+
+def test_replica_round_robin( replicas ):
+    replicas( [ 'a', 'b:5433', 'c' ] )
+    port = int( db.dbport )
+    orders = [ db.replica_hosts() for i in range( 3 ) ]
+    assert set( o[0] for o in orders ) == { ( 'a', port ), ( 'b', 5433 ), ( 'c', port ) }
+    assert all( sorted( o ) == sorted( orders[0] ) for o in orders )
+
+    db.mark_replica_down( 'b', 5433 )
+    assert all( ( 'b', 5433 ) not in db.replica_hosts() for i in range( 3 ) )
+
+
+# To run this test, set up a streaming replica of the test database
+#   and set the env var FASTDB_TEST_REPLICA to its "host:port".
+@pytest.mark.skipif( os.getenv( 'FASTDB_TEST_REPLICA' ) is None, reason="FASTDB_TEST_REPLICA not set" )
+def test_real_replica( replicas ):
+    replicas( [ _deadreplica, os.getenv( 'FASTDB_TEST_REPLICA' ) ] )
+    replica = db._parse_replica( os.getenv( 'FASTDB_TEST_REPLICA' ) )
+
+    with DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SELECT pg_is_in_recovery()" )
+        assert not cursor.fetchone()[0]
+
+    for i in range( 4 ):
+        with DB( readonly=True ) as con:
+            assert int( _server( con )[1] ) == replica[1]
+            cursor = con.cursor()
+            cursor.execute( "SELECT pg_is_in_recovery()" )
+            assert cursor.fetchone()[0]
+            cursor.execute( "SELECT COUNT(*) FROM processing_version" )
+
+    # Connections should be coming from (and going back to) the replica's pool
+    with DB( readonly=True ) as con:
+        pid = con.info.backend_pid
+    with DB( readonly=True ) as con:
+        assert con.info.backend_pid == pid
+    assert db.get_replica_pool( *replica ) is not db.get_dbpool()
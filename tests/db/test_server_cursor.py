@@ -0,0 +1,35 @@
+import psycopg
+
+import db
+from db import DB
+
+
+def test_server_cursor_hints():
+    hint = "/*+ SeqScan(diasource) */"
+    q = f"  {hint}\nSELECT diasourceid FROM diasource WHERE diasourceid=%(id)s"
+    with DB() as con:
+        # pg_hint_plan has to be able to see the hint, so it must come before the DECLARE
+        with db.server_cursor( con ) as cursor:
+            assert isinstance( cursor, db.HintedServerCursor )
+            declare = cursor._make_declare_statement( q ).as_string( con )
+            assert declare.startswith( f'{hint} DECLARE "{cursor.name}"' )
+            assert declare.endswith( "CURSOR FOR \nSELECT diasourceid FROM diasource WHERE diasourceid=%(id)s" )
+
+            # Queries without hints, and composed queries, are left alone
+            declare = cursor._make_declare_statement( "SELECT 1" ).as_string( con )
+            assert declare.startswith( 'DECLARE "' )
+            assert declare.endswith( "CURSOR FOR SELECT 1" )
+            declare = cursor._make_declare_statement( psycopg.sql.SQL( "SELECT 1" ) ).as_string( con )
+            assert declare.endswith( "CURSOR FOR SELECT 1" )
+
+            # And the query still runs
+            cursor.execute( q, { 'id': -1 } )
+            assert cursor.fetchall() == []
+
+        # Also on a connection that didn't come from the pool
+        with psycopg.connect( dbname=db.dbname, user=db.dbuser, password=db.dbpasswd,
+                              host=db.dbhost, port=db.dbport ) as rawcon:
+            with db.server_cursor( rawcon, fetch_size=2, binary=True ) as cursor:
+                assert isinstance( cursor, db.HintedServerCursor )
+                cursor.execute( "/*+ SeqScan(x) */ SELECT * FROM generate_series(1, 5) x" )
+                assert [ len( rows ) for rows in db.iter_batches( cursor ) ] == [ 2, 2, 1 ]
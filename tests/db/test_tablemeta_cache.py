@@ -0,0 +1,48 @@
+import db
+
+
+def test_load_all_table_meta( tmp_path, monkeypatch ):
+    monkeypatch.setattr( db.config, 'dbmeta_cache_dir', str( tmp_path ) )
+    monkeypatch.setattr( db, '_all_tablemeta', None )
+
+    meta = db.load_all_table_meta()
+    assert 'diaforcedsource' in meta
+    assert 'authuser' in meta
+
+    # Make sure we got the same thing as asking for just one table
+    with db.DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SELECT column_name,data_type FROM information_schema.columns "
+                        "WHERE table_name='diaforcedsource'" )
+        dfscols = { row[0]: row[1] for row in cursor.fetchall() }
+    assert { c['column_name']: c['data_type'] for c in meta['diaforcedsource'] } == dfscols
+
+    # Should have written a cache file
+    cachefiles = list( tmp_path.glob( "fastdb_tablemeta_*.json" ) )
+    assert len( cachefiles ) == 1
+
+    # A new process would read the cache file.  Mess up the cache file
+    #   to make sure that's what's read.
+    with open( cachefiles[0] ) as ifp:
+        cached = ifp.read()
+    with open( cachefiles[0], "w" ) as ofp:
+        ofp.write( cached.replace( '"midpointmjdtai"', '"this_is_from_the_cache_file"' ) )
+    monkeypatch.setattr( db, '_all_tablemeta', None )
+    meta = db.load_all_table_meta()
+    assert 'this_is_from_the_cache_file' in [ c['column_name'] for c in meta['diaforcedsource'] ]
+
+    # ...unless we ask for a reload, which should also fix the cache file
+    meta = db.load_all_table_meta( reload=True )
+    assert { c['column_name']: c['data_type'] for c in meta['diaforcedsource'] } == dfscols
+    monkeypatch.setattr( db, '_all_tablemeta', None )
+    meta = db.load_all_table_meta()
+    assert { c['column_name']: c['data_type'] for c in meta['diaforcedsource'] } == dfscols
+
+    # Without a cache dir, there should be no files
+    monkeypatch.setattr( db.config, 'dbmeta_cache_dir', None )
+    for f in cachefiles:
+        f.unlink()
+    monkeypatch.setattr( db, '_all_tablemeta', None )
+    meta = db.load_all_table_meta()
+    assert { c['column_name']: c['data_type'] for c in meta['diaforcedsource'] } == dfscols
+    assert len( list( tmp_path.glob( "*" ) ) ) == 0
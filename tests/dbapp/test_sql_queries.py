@@ -1,6 +1,7 @@
 import sys
 import io
 import pandas
+import pytest
 
 sys.path.insert( 0, '/code/client' )
 from fastdb_client import FASTDBClient
@@ -14,6 +15,40 @@ def test_short_query( obj1, src1, src1_pv2, test_user ):
     assert set( [ r['diasourceid'] for r in res ] ) == { src1.diasourceid, src1_pv2.diasourceid }
     assert set( [ r['processing_version'] for r in res ] ) == { src1.processing_version, src1_pv2.processing_version }
 
+    # Binary tables should have the same thing, without going through JSON
+    df = fastdb.submit_short_sql_query( "SELECT * FROM diasource ORDER BY diasourceid", return_format='pandas' )
+    assert list( df.diasourceid ) == sorted( [ src1.diasourceid, src1_pv2.diasourceid ] )
+    arrays = fastdb.submit_short_sql_query( "SELECT diasourceid, psfflux FROM diasource ORDER BY diasourceid",
+                                            return_format='numpy' )
+    assert set( arrays.keys() ) == { 'diasourceid', 'psfflux' }
+    assert list( arrays['diasourceid'] ) == list( df.diasourceid )
+    assert list( arrays['psfflux'] ) == list( df.psfflux )
+
+
+def test_streamed_short_query( obj1, src1, src1_pv2, test_user ):
+    fastdb = FASTDBClient( 'http://webap:8080', username='test', password='test_password' )
+
+    rows = list( fastdb.post_stream( fastdb.short_query_url,
+                                     json={ 'query': "SELECT * FROM diasource ORDER BY diasourceid",
+                                            'stream': True } ) )
+    assert len(rows) == 2
+    assert set( r['processing_version'] for r in rows ) == { src1.processing_version, src1_pv2.processing_version }
+
+    batches = list( fastdb.post_stream( fastdb.short_query_url,
+                                        json={ 'query': [ "SET LOCAL work_mem='64MB'",
+                                                          "SELECT diasourceid, psfflux FROM diasource" ],
+                                               'subdict': [ {}, {} ],
+                                               'stream': True },
+                                        return_format='pandas' ) )
+    df = pandas.concat( batches )
+    assert set( df.columns ) == { 'diasourceid', 'psfflux' }
+    assert len(df) == 2
+
+    # Errors in the query come back before streaming starts
+    with pytest.raises( RuntimeError, match='Got an error from the server: relation "nosuchtable"' ):
+        list( fastdb.post_stream( fastdb.short_query_url, json={ 'query': "SELECT * FROM nosuchtable",
+                                                                 'stream': True } ) )
+
 
 def test_synchronous_long_query( obj1, src1, src1_pv2, test_user ):
     fastdb = FASTDBClient( 'http://webap:8080', username='test', password='test_password' )
@@ -188,6 +188,8 @@ def alerts_90days_sent_received_and_imported( procver ):
                  'elasticc2_test_data/alerts_90days_sent_received_and_imported.pgdump' ]
         res = subprocess.run( args, env={ 'PGPASSWORD': 'fragile'}, capture_output=True )
         assert res.returncode == 0
+        # The dump doesn't include diaobject_detstats (which import_from_mongo would have filled)
+        db.DiaObjectDetStats.recompute( processing_version=procver.id )
         with db.DB() as conn:
             cursor = conn.cursor()
             cursor.execute( "SELECT COUNT(*) FROM diaobject" )
@@ -202,6 +204,7 @@ def alerts_90days_sent_received_and_imported( procver ):
     finally:
         with db.DB() as conn:
             cursor = conn.cursor()
+            cursor.execute( "DELETE FROM diaobject_detstats" )
             cursor.execute( "DELETE FROM diaforcedsource" )
             cursor.execute( "DELETE FROM diasource" )
             cursor.execute( "DELETE FROM diaobject_root_map" )
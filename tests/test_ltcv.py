@@ -1,6 +1,14 @@
+import os
+import time
+import uuid
+
+import pytest
 import numpy as np
+import pandas
 
+import db
 import ltcv
+import util
 
 
 def test_object_ltcv( procver, alerts_90days_sent_received_and_imported ):
@@ -53,6 +61,253 @@ def test_object_ltcv( procver, alerts_90days_sent_received_and_imported ):
     assert set( jsondict.keys() ) == set( df.columns )
     assert all( np.all( df[c].values == np.array(jsondict[c]) ) for c in df.columns )
 
+    # Columns come back in a known order, sorted by mjd
+    assert list( df.columns ) == [ 'mjd', 'band', 'psfflux', 'psffluxerr', 'isdet', 'ispatch' ]
+    assert list( sources.columns ) == [ 'mjd', 'band', 'psfflux', 'psffluxerr', 'isdet' ]
+    assert np.all( np.diff( df.mjd.values ) >= 0 )
+    # Forced points matched to a detection are flagged as detected
+    assert forced.isdet.sum() == ( ~df.ispatch & df.isdet ).sum()
+
+    jsondict = ltcv.object_ltcv( procver.id, objid, return_format='json', which='detections' )
+    assert set( jsondict.keys() ) == set( sources.columns )
+    assert jsondict['isdet'] == [ 1 ] * len(sources)
+
+    # Band filtering
+    gr = ltcv.object_ltcv( procver.id, objid, return_format='pandas', which='patch', bands=[ 'g', 'r' ] )
+    dfgr = df[ df.band.isin( [ 'g', 'r' ] ) ].reset_index( drop=True )
+    assert len(gr) == len(dfgr)
+    assert all( np.all( gr[c].values == dfgr[c].values ) for c in df.columns )
+
+    # Forced photometry and detections come back in one round trip
+    was = ( db.query_stats.enabled, db.query_stats.slow_query_secs, db.query_stats.explain_slow_queries )
+    try:
+        db.query_stats.reset()
+        db.query_stats.enable()
+        ltcv.object_ltcv( procver.id, objid, which='patch' )
+        # (Don't count the statement the pool runs when the connection is returned)
+        assert sum( s['calls'] for s in db.query_stats.summary()
+                    if ( 'diasource' in s['fingerprint'] ) or ( 'diaforcedsource' in s['fingerprint'] ) ) == 1
+    finally:
+        db.query_stats.enabled, db.query_stats.slow_query_secs, db.query_stats.explain_slow_queries = was
+        db.query_stats.reset()
+
+
+def test_object_ltcvs( procver, alerts_90days_sent_received_and_imported ):
+    with db.DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SELECT diaobjectid FROM diaobject WHERE processing_version=%(pv)s ORDER BY diaobjectid",
+                        { 'pv': procver.id } )
+        objids = [ row[0] for row in cursor.fetchall() ]
+    assert len(objids) == 37
+    # Throw in a duplicate and an object that doesn't exist
+    askfor = objids[::-1] + [ objids[3], 1 ]
+
+    for which in [ 'patch', 'forced', 'detections' ]:
+        ltcvs = ltcv.object_ltcvs( procver.description, askfor, which=which )
+        assert ltcvs['diaobjectid'] == [ 1 ] + objids
+        assert len( ltcvs['offset'] ) == len( ltcvs['diaobjectid'] ) + 1
+        assert ltcvs['offset'][0] == 0
+        assert ltcvs['offset'][1] == 0
+        assert ltcvs['offset'][-1] == len( ltcvs['mjd'] )
+        for i, objid in enumerate( ltcvs['diaobjectid'] ):
+            if objid == 1:
+                continue
+            one = ltcv.object_ltcv( procver.id, objid, which=which )
+            assert set( one.keys() ) == set( ltcvs.keys() ) - { 'diaobjectid', 'offset' }
+            for c in one.keys():
+                assert ltcvs[c][ ltcvs['offset'][i] : ltcvs['offset'][i+1] ] == one[c]
+
+        # The dataframes are the same too
+        onedf = ltcv.object_ltcv( procver.id, objids[0], return_format='pandas', which=which )
+        manydf = ltcv.object_ltcvs( procver.id, [ objids[0] ], return_format='pandas', which=which )
+        assert manydf.drop( columns='diaobjectid' ).equals( onedf )
+
+    df = ltcv.object_ltcvs( procver.id, objids[:2], return_format='pandas', bands=[ 'r' ] )
+    assert list( df.columns ) == [ 'diaobjectid', 'mjd', 'band', 'psfflux', 'psffluxerr', 'isdet', 'ispatch' ]
+    assert set( df.diaobjectid ) <= set( objids[:2] )
+    assert np.all( df.band == 'r' )
+    assert len(df) == sum( len( ltcv.object_ltcv( procver.id, o, return_format='pandas', bands=[ 'r' ] ) )
+                           for o in objids[:2] )
+
+
+# The positional search needs q3c; see test_ltcv_object_search.py.  This
+#   exercises the searches that use diaobject_detstats.
+def test_object_search_detstats( procver, alerts_90days_sent_received_and_imported ):
+    with db.DB() as con:
+        srcs = ltcv._read_dataframe( con, "SELECT diaobjectid, band, midpointmjdtai AS mjd, psfflux "
+                                          "FROM diasource WHERE processing_version=%(pv)s",
+                                     { 'pv': procver.id } )
+        cursor = con.cursor()
+        cursor.execute( "SELECT DISTINCT diaobjectid FROM diaforcedsource WHERE processing_version=%(pv)s",
+                        { 'pv': procver.id } )
+        haveforced = set( row[0] for row in cursor.fetchall() )
+    srcs = srcs.sort_values( 'mjd' )
+    grp = srcs.groupby( 'diaobjectid' )
+    stats = pandas.DataFrame( { 'ndet': grp.mjd.count(), 'first': grp.mjd.min(), 'last': grp.mjd.max(),
+                                'nbands': grp.band.nunique(), 'lastflux': grp.psfflux.last() } )
+    stats = stats[ stats.index.isin( haveforced ) ]
+
+    def check( expected, **kwargs ):
+        res = ltcv.object_search( procver.description, return_format='pandas', **kwargs )
+        assert len(expected) > 0
+        assert set( res.diaobjectid ) == set( expected.index )
+        return res
+
+    with pytest.raises( RuntimeError, match="no search criterion given" ):
+        ltcv.object_search( procver.description )
+
+    res = check( stats[ stats.ndet >= 5 ], min_numdetections=5 )
+    for row in res.itertuples():
+        assert row.ndet == stats.loc[row.diaobjectid].ndet
+        assert row.lastdetfluxmjd == pytest.approx( stats.loc[row.diaobjectid]['last'], abs=1e-5 )
+        assert row.lastdetflux == pytest.approx( stats.loc[row.diaobjectid].lastflux, rel=1e-5 )
+
+    t0 = stats['first'].median()
+    check( stats[ stats['first'] >= t0 ], mint_firstdetection=t0 )
+    check( stats[ ( stats['first'] <= t0 ) & ( stats['last'] >= t0 + 10 ) ],
+           maxt_firstdetection=t0, mint_lastdetection=t0 + 10 )
+    check( stats[ stats['last'] <= t0 ], maxt_lastdetection=t0 )
+    check( stats[ ( stats['last'] - stats['first'] ) >= 20 ], mindt_firstlastdetection=20 )
+    check( stats[ ( ( stats['last'] - stats['first'] ) <= 20 ) & ( stats.ndet > 1 ) ],
+           maxdt_firstlastdetection=20, min_numdetections=2 )
+    check( stats[ stats.nbands >= 3 ], min_bandsdetected=3 )
+
+    lastmag = -2.5 * np.log10( stats.lastflux.where( stats.lastflux > 0 ) ) + 31.4
+    m0 = lastmag.median()
+    check( stats[ lastmag >= m0 ], min_lastmag=m0 )
+    check( stats[ ( lastmag <= m0 ) & ( lastmag >= m0 - 1 ) ], min_lastmag=m0 - 1, max_lastmag=m0 )
+
+    # Restricting the bands means the stats have to come from just those bands
+    rsrcs = srcs[ srcs.band == 'r' ]
+    rstats = rsrcs.groupby( 'diaobjectid' ).mjd.count()
+    rstats = rstats[ rstats.index.isin( haveforced ) ]
+    res = check( rstats[ rstats >= 3 ], min_numdetections=3, statbands='r' )
+    assert all( res.maxdetfluxband == 'r' )
+    assert all( res.lastdetfluxband == 'r' )
+
+    # Page through everything
+    full = ltcv.object_search( procver.id, min_numdetections=1 )
+    assert full['diaobjectid'] == sorted( stats.index )
+    with pytest.raises( ValueError, match="limit must be positive" ):
+        ltcv.object_search( procver.id, min_numdetections=1, limit=0 )
+    pages = []
+    after = None
+    while True:
+        page = ltcv.object_search( procver.id, min_numdetections=1, limit=5, after_diaobjectid=after )
+        assert set( page.keys() ) == set( full.keys() )
+        pages.append( page )
+        if len( page['diaobjectid'] ) < 5:
+            break
+        after = page['diaobjectid'][-1]
+    assert len( pages ) == len( full['diaobjectid'] ) // 5 + 1
+    for col in full.keys():
+        assert sum( ( p[col] for p in pages ), [] ) == full[col]
+
+    res = ltcv.object_search( procver.id, return_format='pandas', min_numdetections=2, statbands=[ 'r', 'i' ],
+                              after_diaobjectid=full['diaobjectid'][10], limit=3 )
+    assert len( res ) == 3
+    assert all( res.diaobjectid > full['diaobjectid'][10] )
+    assert list( res.diaobjectid ) == sorted( res.diaobjectid )
+
+
+def test_merge_photometry():
+    forced = { 'diaobjectid': [ 1, 1, 1, 2, 2 ],
+               'visit': [ 10, 11, 12, 10, 13 ],
+               'detector': [ 1, 1, 1, 2, 2 ],
+               'midpointmjdtai': [ 60000., 60001., 60002., 60000., 60003. ],
+               'psfflux': [ 1., 2., 3., 4., 5. ] }
+    sources = { 'diaobjectid': [ 2, 2, 1, 3 ],
+                'visit': [ 14, 10, 11, 20 ],
+                'detector': [ 2, 2, 1, 5 ],
+                'midpointmjdtai': [ 60004., 60000., 60001., 60005. ],
+                'psfflux': [ 40., 41., 42., 43. ] }
+
+    merged = ltcv.merge_photometry( forced, sources )
+    assert set( merged.keys() ) == set( forced.keys() ) | { 'isdet', 'ispatch' }
+    assert merged['diaobjectid'].tolist() == [ 1, 1, 1, 2, 2, 2, 3 ]
+    assert merged['midpointmjdtai'].tolist() == [ 60000., 60001., 60002., 60000., 60003., 60004., 60005. ]
+    # Where there's forced photometry, we get the forced flux, not the detection flux
+    assert merged['psfflux'].tolist() == [ 1., 2., 3., 4., 5., 40., 43. ]
+    assert merged['isdet'].tolist() == [ False, True, False, True, False, True, True ]
+    assert merged['ispatch'].tolist() == [ False, False, False, False, False, True, True ]
+
+    merged = ltcv.merge_photometry( forced, sources, patch=False )
+    assert merged['psfflux'].tolist() == [ 1., 2., 3., 4., 5. ]
+    assert merged['isdet'].tolist() == [ False, True, False, True, False ]
+    assert not merged['ispatch'].any()
+
+    # Objects don't have to be integers.  (Make the uuids sort in the opposite order of the ints.)
+    uuids = { 1: uuid.UUID( int=3 ), 2: uuid.UUID( int=2 ), 3: uuid.UUID( int=1 ) }
+    uforced = { **forced, 'diaobjectid': [ uuids[i] for i in forced['diaobjectid'] ] }
+    usources = { **sources, 'diaobjectid': [ uuids[i] for i in sources['diaobjectid'] ] }
+    merged = ltcv.merge_photometry( pandas.DataFrame( uforced ), pandas.DataFrame( usources ) )
+    assert merged['diaobjectid'].tolist() == [ uuids[i] for i in [ 3, 2, 2, 2, 1, 1, 1 ] ]
+    assert merged['psfflux'].tolist() == [ 43., 4., 5., 40., 1., 2., 3. ]
+
+    # Empty things
+    empty = { k: [] for k in forced.keys() }
+    merged = ltcv.merge_photometry( empty, sources )
+    assert merged['psfflux'].tolist() == [ 42., 41., 40., 43. ]
+    assert merged['ispatch'].all()
+    merged = ltcv.merge_photometry( forced, empty )
+    assert merged['psfflux'].tolist() == [ 1., 2., 3., 4., 5. ]
+    assert not merged['isdet'].any()
+    merged = ltcv.merge_photometry( empty, empty )
+    assert len( merged['psfflux'] ) == 0
+
+
+@pytest.mark.skipif( os.getenv( 'FASTDB_BENCHMARK' ) is None, reason="FASTDB_BENCHMARK not set" )
+def test_merge_photometry_benchmark():
+    # Compare merge_photometry to what object_ltcv used to do (an outer
+    #   join of pandas frames indexed by object and time, patching with
+    #   .loc, and then sorting) for 10⁵ objects.  The timings are only
+    #   logged; wall-clock comparisons are too flaky on shared CI machines
+    #   to assert on.
+    rng = np.random.default_rng( 42 )
+    nobj = 100000
+    nforced = 30
+    nsource = 8
+    objid = np.repeat( np.arange( nobj, dtype=np.int64 ), nforced )
+    visit = np.tile( np.arange( nforced, dtype=np.int32 ), nobj )
+    forced = pandas.DataFrame( { 'diaobjectid': objid,
+                                 'visit': visit,
+                                 'detector': np.zeros( len(objid), dtype=np.int16 ),
+                                 'midpointmjdtai': 60000. + visit + objid * 1e-6,
+                                 'band': rng.choice( [ 'g', 'r', 'i' ], len(objid) ),
+                                 'psfflux': rng.normal( size=len(objid) ),
+                                 'psffluxerr': np.ones( len(objid) ) } )
+    # Detections on the last nsource visits, plus a few more visits that don't have forced photometry yet
+    objid = np.repeat( np.arange( nobj, dtype=np.int64 ), nsource )
+    visit = np.tile( np.arange( nforced - nsource // 2, nforced + nsource // 2, dtype=np.int32 ), nobj )
+    sources = pandas.DataFrame( { 'diaobjectid': objid,
+                                  'visit': visit,
+                                  'detector': np.zeros( len(objid), dtype=np.int16 ),
+                                  'midpointmjdtai': 60000. + visit + objid * 1e-6,
+                                  'band': rng.choice( [ 'g', 'r', 'i' ], len(objid) ),
+                                  'psfflux': rng.normal( size=len(objid) ),
+                                  'psffluxerr': np.ones( len(objid) ) } )
+
+    t0 = time.perf_counter()
+    f = forced.set_index( [ 'diaobjectid', 'visit', 'detector' ] )
+    s = sources.set_index( [ 'diaobjectid', 'visit', 'detector' ] )
+    joined = f.join( s, how='outer', lsuffix='_f', rsuffix='_s' ).reset_index()
+    joined['isdet'] = ~joined.midpointmjdtai_s.isna()
+    joined['ispatch'] = joined.midpointmjdtai_f.isna()
+    for c in [ 'midpointmjdtai', 'band', 'psfflux', 'psffluxerr' ]:
+        joined.loc[ joined['ispatch'], f'{c}_f' ] = joined[ joined['ispatch'] ][ f'{c}_s' ]
+    joined.sort_values( [ 'diaobjectid', 'midpointmjdtai_f' ], inplace=True )
+    t1 = time.perf_counter()
+    merged = ltcv.merge_photometry( forced, sources )
+    t2 = time.perf_counter()
+
+    util.logger.info( f"Merging {len(forced)} forced and {len(sources)} sources of {nobj} objects: "
+                      f"pandas join {t1-t0:.2f} s, merge_photometry {t2-t1:.2f} s" )
+    assert len( merged['psfflux'] ) == len( joined ) == nobj * ( nforced + nsource // 2 )
+    assert np.all( merged['diaobjectid'] == joined.diaobjectid.values )
+    assert np.all( merged['psfflux'] == joined.psfflux_f.values )
+    assert np.all( merged['isdet'] == joined.isdet.values )
+    assert np.all( merged['ispatch'] == joined.ispatch.values )
+
 
 def test_get_hot_ltcvs( procver, alerts_90days_sent_received_and_imported ):
     nobj, nroot, nsrc, nfrc = alerts_90days_sent_received_and_imported
@@ -135,4 +390,95 @@ def test_get_hot_ltcvs( procver, alerts_90days_sent_received_and_imported ):
     assert len(hostdf) == 4
     assert set( hostdf.rootid ) == set( df.rootid.unique() )
 
+    # iter_hot_ltcvs should give the same thing, a chunk of objects at a time
+    chunks = list( ltcv.iter_hot_ltcvs( procver.description, detected_since_mjd=60325., mjd_now=60328.,
+                                        source_patch=True, include_hostinfo=True,
+                                        objects_per_chunk=3, fetch_size=10 ) )
+    assert [ len( c[0].rootid.unique() ) for c in chunks ] == [ 3, 1 ]
+    assert set( chunks[0][0].rootid ).isdisjoint( set( chunks[1][0].rootid ) )
+    for chunkdf, chunkhostdf in chunks:
+        assert set( chunkhostdf.rootid ) == set( chunkdf.rootid.unique() )
+    iterdf = pandas.concat( [ c[0] for c in chunks ], ignore_index=True )
+    iterhostdf = pandas.concat( [ c[1] for c in chunks ], ignore_index=True )
+    assert iterdf.equals( df.reset_index( drop=True ) )
+    assert iterhostdf.equals( hostdf )
+
+    # Make sure it works on a read-only connection (i.e. doesn't need temp tables)
+    with db.DB( readonly=True ) as con:
+        rodf, rohostdf = ltcv.get_hot_ltcvs( procver.description, detected_since_mjd=60325., mjd_now=60328.,
+                                             source_patch=True, include_hostinfo=True, dbcon=con )
+    assert rodf.equals( df )
+    assert rohostdf.equals( hostdf )
+
+    chunks = list( ltcv.iter_hot_ltcvs( procver.description, mjd_now=60328. ) )
+    assert len( chunks ) == 1
+    assert chunks[0][1] is None
+    assert len( chunks[0][0].rootid.unique() ) == 14
+    assert chunks[0][0].is_source.sum() == 0
+
+    # An id works, but unknown processing versions are an error, not an empty result
+    iddf, _ = ltcv.get_hot_ltcvs( procver.id, detected_since_mjd=60325., mjd_now=60328. )
+    assert len( iddf ) == len( ltcv.get_hot_ltcvs( procver.description, detected_since_mjd=60325.,
+                                                   mjd_now=60328. )[0] )
+    for badpv in [ 'no_such_version', 666, '666' ]:
+        with pytest.raises( ValueError, match="Unknown processing version" ):
+            ltcv.get_hot_ltcvs( badpv, detected_since_mjd=60325., mjd_now=60328. )
+
     # TODO : more stringent tests
+
+
+def test_get_hot_ltcvs_changed_since( procver, alerts_90days_sent_received_and_imported ):
+    alldf, _ = ltcv.get_hot_ltcvs( procver.description, mjd_now=60328., source_patch=True )
+    hotroots = sorted( alldf.rootid.unique() )
+    assert len( hotroots ) == 14
+
+    with db.DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SELECT rootid, diaobjectid FROM diaobject_root_map WHERE processing_version=%(pv)s",
+                        { 'pv': procver.id } )
+        rootobj = { row[0]: row[1] for row in cursor.fetchall() }
+    coldobjs = set( rootobj.values() ) - { rootobj[r] for r in hotroots }
+
+    batch0 = db.IngestBatch.latest()
+    batches = []
+    try:
+        # The fixture didn't create any ingest batches, so nothing has changed since now
+        df, _ = ltcv.get_hot_ltcvs( procver.description, mjd_now=60328., changed_since=batch0 )
+        assert len( df ) == 0
+
+        # Pretend that two hot objects and a not-hot object got new sources
+        changed = [ rootobj[hotroots[0]], rootobj[hotroots[5]], list( coldobjs )[0] ]
+        with db.DB() as con:
+            batches.append( db.IngestBatch.new( con, description='test' ) )
+            n = db.DiaObjectDetStats.recompute( procver.id, diaobjectids=changed, ingest_batch=batches[-1],
+                                                dbcon=con, commit=False )
+            con.commit()
+        assert n == 3
+        assert batches[-1] > batch0
+        assert db.IngestBatch.latest() == batches[-1]
+
+        chdf, _ = ltcv.get_hot_ltcvs( procver.description, mjd_now=60328., source_patch=True,
+                                      changed_since=batch0 )
+        assert set( chdf.rootid.unique() ) == { hotroots[0], hotroots[5] }
+        assert chdf.equals( alldf[ alldf.rootid.isin( [ hotroots[0], hotroots[5] ] ) ].reset_index( drop=True ) )
+        chunks = list( ltcv.iter_hot_ltcvs( procver.description, mjd_now=60328., changed_since=batch0 ) )
+        assert len( chunks ) == 1
+        assert set( chunks[0][0].rootid.unique() ) == { hotroots[0], hotroots[5] }
+
+        # Nothing since the latest batch
+        df, _ = ltcv.get_hot_ltcvs( procver.description, mjd_now=60328., changed_since=batches[-1] )
+        assert len( df ) == 0
+
+        # Refreshing without an ingest batch shouldn't change what's recorded
+        db.DiaObjectDetStats.recompute( procver.id )
+        chdf, _ = ltcv.get_hot_ltcvs( procver.description, mjd_now=60328., changed_since=batch0 )
+        assert set( chdf.rootid.unique() ) == { hotroots[0], hotroots[5] }
+
+        with pytest.raises( ValueError, match="changed_since must be an integer" ):
+            ltcv.get_hot_ltcvs( procver.description, mjd_now=60328., changed_since='latest' )
+
+    finally:
+        with db.DB() as con:
+            cursor = con.cursor()
+            cursor.execute( "DELETE FROM ingest_batch WHERE id=ANY(%(ids)s)", { 'ids': batches } )
+            con.commit()
@@ -1,4 +1,5 @@
 import pytest
+import numpy as np
 
 import db
 import ltcv
@@ -112,3 +113,48 @@ def test_object_search( procver, test_user, snana_fits_maintables_loaded_module
     assert all( r.lastdetfluxband in ('r', 'g') for r in resultsrg.itertuples() )
     assert all( r.lastforcedfluxband in  ('r', 'g') for r in resultsrg.itertuples() )
     check_df_contents( resultsrg, procver.id, ['r', 'g'] )
+
+
+def _angsep( ra0, dec0, ra1, dec1 ):
+    ra0, dec0, ra1, dec1 = ( np.radians( x ) for x in ( ra0, dec0, ra1, dec1 ) )
+    hav = ( np.sin( ( dec1 - dec0 ) / 2. ) ** 2
+            + np.cos( dec0 ) * np.cos( dec1 ) * np.sin( ( ra1 - ra0 ) / 2. ) ** 2 )
+    return np.degrees( 2. * np.arcsin( np.sqrt( hav ) ) ) * 3600.
+
+
+def test_crossmatch( procver, snana_fits_maintables_loaded_module ):
+    with db.DB() as con:
+        objs = ltcv._read_dataframe( con, "SELECT diaobjectid, ra, dec FROM diaobject WHERE processing_version=%(pv)s",
+                                     { 'pv': procver.id } )
+
+    # Positions near the first 20 objects, plus one that's nowhere near anything, plus a duplicate
+    rng = np.random.default_rng( 42 )
+    ra = objs.ra.values[:20] + rng.uniform( -1., 1., 20 ) / 3600.
+    dec = objs.dec.values[:20] + rng.uniform( -1., 1., 20 ) / 3600.
+    ra = np.append( ra, [ ( objs.ra.values[0] + 180. ) % 360., ra[5] ] )
+    dec = np.append( dec, [ -objs.dec.values[0], dec[5] ] )
+
+    with pytest.raises( ValueError, match="same length" ):
+        ltcv.crossmatch( procver.id, ra, dec[:-1] )
+    with pytest.raises( ValueError, match="dec must be between" ):
+        ltcv.crossmatch( procver.id, [ 0. ], [ 91. ] )
+
+    for radius in [ 2., 600. ]:
+        res = ltcv.crossmatch( procver.description, ra, dec, radius=radius, return_format='pandas' )
+        expected = set()
+        for i in range( len(ra) ):
+            sep = _angsep( ra[i], dec[i], objs.ra.values, objs.dec.values )
+            expected |= { ( i, o ) for o in objs.diaobjectid.values[ sep < radius ] }
+        assert set( zip( res.posindex, res.diaobjectid ) ) == expected
+        assert np.all( res.sep.values <= radius )
+        assert res.sep.values == pytest.approx( _angsep( ra[res.posindex], dec[res.posindex],
+                                                         res.ra.values, res.dec.values ), abs=1e-3 )
+        assert 20 not in set( res.posindex )
+        assert list( res.posindex ) == sorted( res.posindex )
+
+        nearest = ltcv.crossmatch( procver.description, ra, dec, radius=radius, nearest=True )
+        assert nearest['posindex'] == sorted( set( res.posindex ) )
+        for i, objid, sep in zip( nearest['posindex'], nearest['diaobjectid'], nearest['sep'] ):
+            assert sep == pytest.approx( res[ res.posindex == i ].sep.min(), abs=1e-6 )
+            if radius == 2.:
+                assert objid == objs.diaobjectid.values[ i if i < 20 else 5 ]
@@ -0,0 +1,293 @@
+import io
+import time
+import uuid
+import decimal
+import datetime
+
+import pytest
+import numpy as np
+import pandas
+import pyarrow.ipc
+import flask
+import psycopg
+import simplejson
+
+import webserver.baseview
+from webserver.baseview import ( AuthUserCache, BaseView, columnar_response, streaming_response,
+                                 json_dumps, set_json_encoder, request_dbcon, release_request_dbcon )
+
+
+def test_authuser_cache():
+    cache = AuthUserCache( ttl=0.5, max_size=2 )
+    assert cache.get( 'alice' ) is None
+
+    cache.set( 'alice', ( 1, 'alice', 'Alice', 'alice@example.com' ) )
+    cache.set( 'bob', ( 2, 'bob', 'Bob', 'bob@example.com' ) )
+    assert cache.get( 'alice' )[1] == 'alice'
+    assert cache.get( 'bob' )[1] == 'bob'
+
+    # alice was used less recently than bob, so she gets pushed out
+    cache.get( 'bob' )
+    cache.set( 'carol', ( 3, 'carol', 'Carol', 'carol@example.com' ) )
+    assert cache.get( 'alice' ) is None
+    assert cache.get( 'bob' ) is not None
+    assert cache.get( 'carol' ) is not None
+
+    cache.invalidate( 'bob' )
+    assert cache.get( 'bob' ) is None
+    assert cache.get( 'carol' ) is not None
+    cache.invalidate()
+    assert cache.get( 'carol' ) is None
+
+    cache.set( 'alice', ( 1, 'alice', 'Alice', 'alice@example.com' ) )
+    time.sleep( 0.6 )
+    assert cache.get( 'alice' ) is None
+
+    nocache = AuthUserCache( ttl=0 )
+    nocache.set( 'alice', ( 1, 'alice', 'Alice', 'alice@example.com' ) )
+    assert nocache.get( 'alice' ) is None
+
+
+def test_request_dbcon():
+    # The read-only connection is read only even when there are no
+    #   replicas, so things that would break on a replica break here too.
+    app = flask.Flask( __name__ )
+    with app.test_request_context( '/' ):
+        try:
+            con = request_dbcon()
+            rocon = request_dbcon( readonly=True )
+            assert rocon is not con
+            assert request_dbcon() is con
+            assert request_dbcon( readonly=True ) is rocon
+            assert rocon.read_only
+            assert not con.read_only
+
+            cursor = rocon.cursor()
+            cursor.execute( "SELECT 1" )
+            assert cursor.fetchone()[0] == 1
+            with pytest.raises( psycopg.errors.ReadOnlySqlTransaction ):
+                cursor.execute( "CREATE TEMP TABLE test_request_dbcon( x int )" )
+            rocon.rollback()
+
+            cursor = con.cursor()
+            cursor.execute( "CREATE TEMP TABLE test_request_dbcon( x int )" )
+        finally:
+            release_request_dbcon()
+        assert 'dbcon' not in flask.g
+        assert 'rodbcon' not in flask.g
+
+
+@pytest.fixture( params=sorted( webserver.baseview.json_encoders.keys() ) )
+def json_encoder( request ):
+    prev = set_json_encoder( request.param )
+    yield request.param
+    set_json_encoder( prev )
+
+
+def test_json_dumps( json_encoder ):
+    u = uuid.uuid4()
+    thing = { 'array': np.array( [ 1.5, np.nan, np.inf ] ),
+              'intarray': np.arange( 6, dtype=np.int32 ).reshape( 2, 3 )[ :, 1 ],
+              'boolarray': np.array( [ True, False ] ),
+              'bigendian': np.array( [ 1.5, 2.5 ], dtype='>f8' ),
+              'strarray': np.array( [ 'a', 'bc' ] ),
+              'objarray': np.array( [ 1, None, u ], dtype=object ),
+              'dates': np.array( [ '2025-01-02T03:04:05', 'NaT' ], dtype='datetime64[s]' ),
+              'date64': np.datetime64( '2025-01-02' ),
+              'series': pandas.Series( [ 1., 2. ] ),
+              'scalars': [ np.float32( 0.5 ), np.float64( np.nan ), np.int64( 3 ), np.bool_( True ), np.uint8( 7 ) ],
+              'uuid': u,
+              'datetime': datetime.datetime( 2025, 1, 2, 3, 4, 5, 6, tzinfo=datetime.UTC ),
+              'date': datetime.date( 2025, 1, 2 ),
+              'timestamp': pandas.Timestamp( '2025-01-02T03:04:05' ),
+              'nat': pandas.NaT,
+              'decimal': decimal.Decimal( '1.25' ),
+              'huge': 2**70,
+              'nan': float( 'nan' ),
+              3: 'intkey' }
+    out = json_dumps( thing )
+    assert isinstance( out, bytes )
+    assert simplejson.loads( out ) == { 'array': [ 1.5, None, None ],
+                                        'intarray': [ 1, 4 ],
+                                        'boolarray': [ True, False ],
+                                        'bigendian': [ 1.5, 2.5 ],
+                                        'strarray': [ 'a', 'bc' ],
+                                        'objarray': [ 1, None, str(u) ],
+                                        'dates': [ '2025-01-02T03:04:05', None ],
+                                        'date64': '2025-01-02',
+                                        'series': [ 1., 2. ],
+                                        'scalars': [ 0.5, None, 3, True, 7 ],
+                                        'uuid': str(u),
+                                        'datetime': '2025-01-02T03:04:05.000006+00:00',
+                                        'date': '2025-01-02',
+                                        'timestamp': '2025-01-02T03:04:05',
+                                        'nat': None,
+                                        'decimal': 1.25,
+                                        'huge': 2**70,
+                                        'nan': None,
+                                        '3': 'intkey' }
+
+    with pytest.raises( TypeError, match="not JSON serializable" ):
+        json_dumps( { 'x': object() } )
+
+    # What BaseView sends
+    class JSONView( BaseView ):
+        def check_auth( self ):
+            return True
+
+        def do_the_things( self ):
+            return { 'x': np.linspace( 0., 1., 3 ), 'id': u }
+
+    app = flask.Flask( __name__ )
+    app.add_url_rule( '/view', view_func=JSONView.as_view( 'view' ) )
+    res = app.test_client().get( '/view' )
+    assert res.status_code == 200
+    assert res.headers['Content-Type'] == 'application/json'
+    assert res.json == { 'x': [ 0., 0.5, 1. ], 'id': str(u) }
+
+
+def test_set_json_encoder():
+    assert 'simplejson' in webserver.baseview.json_encoders
+    prev = set_json_encoder( 'simplejson' )
+    try:
+        assert set_json_encoder( 'simplejson' ) == 'simplejson'
+        with pytest.raises( ValueError, match="Unknown JSON encoder" ):
+            set_json_encoder( 'cjson' )
+    finally:
+        set_json_encoder( prev )
+    assert prev == ( 'orjson' if webserver.baseview.orjson is not None else 'simplejson' )
+
+
+def test_columnar_response():
+    ids = [ uuid.uuid4() for i in range(3) ]
+    t = datetime.datetime( 2025, 4, 1, tzinfo=datetime.UTC )
+    columns = { 'id': ids,
+                'n': [ 1, None, 3 ],
+                'x': np.array( [ 1.5, np.nan, 2.5 ] ),
+                's': [ 'a', None, 'ccc' ],
+                'b': [ True, False, None ],
+                't': [ t, t, t ] }
+
+    body, status, headers = columnar_response( columns, 'arrow', headers={ 'FASTDB-Cursor': '42' } )
+    assert status == 200
+    assert headers == { 'Content-Type': 'application/vnd.apache.arrow.stream', 'FASTDB-Cursor': '42' }
+    table = pyarrow.ipc.open_stream( body ).read_all()
+    assert table.column_names == [ 'id', 'n', 'x', 's', 'b', 't' ]
+    data = table.to_pydict()
+    assert data['id'] == [ str(i) for i in ids ]
+    assert data['n'] == [ 1, None, 3 ]
+    assert data['s'] == [ 'a', None, 'ccc' ]
+    assert data['b'] == [ True, False, None ]
+    assert data['t'] == [ t, t, t ]
+
+    body, status, headers = columnar_response( pandas.DataFrame( columns ), 'npz' )
+    assert headers == { 'Content-Type': 'application/x-npz' }
+    with np.load( io.BytesIO( body ), allow_pickle=False ) as npz:
+        assert npz.files == [ 'id', 'n', 'x', 's', 'b', 't' ]
+        assert list( npz['id'] ) == [ str(i) for i in ids ]
+        assert np.array_equal( npz['n'], [ 1., np.nan, 3. ], equal_nan=True )
+        assert np.array_equal( npz['x'], columns['x'], equal_nan=True )
+        assert list( npz['s'] ) == [ 'a', '', 'ccc' ]
+        assert list( npz['b'] ) == [ True, False, False ]
+        assert npz['t'].dtype.kind == 'M'
+
+    with pytest.raises( TypeError, match="can't be sent in a .npz file" ):
+        columnar_response( { 'l': [ [ 1, 2 ], [ 3 ] ] }, 'npz' )
+    with pytest.raises( ValueError, match="Unknown columnar format" ):
+        columnar_response( columns, 'json' )
+
+
+def test_columnar_format():
+    app = flask.Flask( __name__ )
+    view = BaseView()
+    for accept, return_format, expected in [ ( None, None, None ),
+                                             ( '*/*', None, None ),
+                                             ( 'application/json', 'arrow', 'arrow' ),
+                                             ( 'application/vnd.apache.arrow.stream', None, 'arrow' ),
+                                             ( 'application/vnd.apache.arrow.stream', 1, 'arrow' ),
+                                             ( 'application/x-npz', None, 'npz' ),
+                                             ( 'application/x-npz', 'arrow', 'arrow' ),
+                                             ( 'application/json, application/x-npz;q=0.5', None, None ) ]:
+        headers = {} if accept is None else { 'Accept': accept }
+        with app.test_request_context( '/', headers=headers ):
+            assert view.columnar_format( return_format ) == expected
+
+
+def test_streaming_response():
+    produced = []
+
+    def chunks( n, fail=False ):
+        for i in range( n ):
+            produced.append( i )
+            if fail and ( i == 1 ):
+                raise RuntimeError( "Oops" )
+            yield { 'i': np.arange( 3 ) + 3*i, 'id': [ uuid.UUID( int=3*i+j ) for j in range(3) ] }
+
+    def rows( n, fail=False ):
+        for chunk in chunks( n, fail ):
+            yield [ { 'i': int(i), 'id': id } for i, id in zip( chunk['i'], chunk['id'] ) ]
+
+    class StreamingView( BaseView ):
+        def check_auth( self ):
+            return True
+
+        def do_the_things( self ):
+            return rows( 2 )
+
+    app = flask.Flask( __name__ )
+    app.add_url_rule( '/view', view_func=StreamingView.as_view( 'view' ) )
+    app.add_url_rule( '/jsonl/<int:n>/<int:fail>',
+                      endpoint='jsonl',
+                      view_func=lambda n, fail: streaming_response( rows( n, fail ), headers={ 'X-Thing': 'yes' } ) )
+    app.add_url_rule( '/arrow/<int:n>/<int:fail>',
+                      endpoint='arrow',
+                      view_func=lambda n, fail: streaming_response( chunks( n, fail ), 'arrow' ) )
+    client = app.test_client()
+
+    # Make sure that chunks are sent as they're made, not all at the end
+    res = client.get( '/jsonl/3/0', buffered=False )
+    assert res.status_code == 200
+    assert res.headers['Content-Type'] == 'application/x-ndjson'
+    assert res.headers['X-Thing'] == 'yes'
+    body = iter( res.response )
+    first = next( body )
+    assert produced == [ 0 ]
+    lines = ( first + b''.join( body ) ).decode().splitlines()
+    res.close()
+    assert produced == [ 0, 1, 2 ]
+    assert [ simplejson.loads( line ) for line in lines ] == [ { 'i': i, 'id': str( uuid.UUID( int=i ) ) }
+                                                               for i in range(9) ]
+
+    produced.clear()
+    res = client.get( '/arrow/3/0' )
+    assert res.headers['Content-Type'] == 'application/vnd.apache.arrow.stream'
+    reader = pyarrow.ipc.open_stream( res.data )
+    batches = list( reader )
+    assert len( batches ) == 3
+    table = pyarrow.Table.from_batches( batches )
+    assert table['i'].to_pylist() == list( range(9) )
+    assert table['id'].to_pylist() == [ str( uuid.UUID( int=i ) ) for i in range(9) ]
+
+    # Nothing to send should still be a valid stream
+    res = client.get( '/arrow/0/0' )
+    assert pyarrow.ipc.open_stream( res.data ).read_all().num_rows == 0
+    res = client.get( '/jsonl/0/0' )
+    assert res.data == b''
+
+    # Errors after the response has started
+    res = client.get( '/jsonl/3/1' )
+    assert res.status_code == 200
+    lines = [ simplejson.loads( line ) for line in res.data.decode().splitlines() ]
+    assert len( lines ) == 4
+    assert lines[-1] == { 'status': 'error', 'error': 'Oops' }
+    res = client.get( '/arrow/3/1' )
+    with pytest.raises( Exception ):
+        pyarrow.ipc.open_stream( res.data ).read_all()
+
+    # A view that returns a generator gets streamed as JSON lines
+    res = client.get( '/view' )
+    assert res.headers['Content-Type'] == 'application/x-ndjson'
+    assert len( res.data.decode().splitlines() ) == 6
+
+    with pytest.raises( ValueError, match="Can't stream format npz" ):
+        streaming_response( rows( 1 ), 'npz' )
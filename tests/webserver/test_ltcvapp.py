@@ -1,3 +1,16 @@
+import os
+import time
+import uuid
+
+import pytest
+import numpy as np
+import pandas
+import pyarrow.ipc
+
+import db
+import ltcv
+import util
+from webserver.ltcvapp import hot_transients_json
 
 
 def test_gethottransients( test_user, fastdb_client, procver, alerts_90days_sent_received_and_imported ):
@@ -140,3 +153,276 @@ def test_gethottransients( test_user, fastdb_client, procver, alerts_90days_sent
                                   'hostgal_stdcolor_g_r_err', 'hostgal_stdcolor_r_i_err',
                                   'hostgal_stdcolor_i_z_err', 'hostgal_stdcolor_z_y_err',
                                   'hostgal_snsep', 'hostgal_pzmean', 'hostgal_pzstd' }
+
+
+def test_gethottransients_since_cursor( test_user, fastdb_client, procver, alerts_90days_sent_received_and_imported ):
+    res = fastdb_client.post( '/ltcv/gethottransients',
+                              json={ 'processing_version': procver.description,
+                                     'mjd_now': 60328.,
+                                     'since_cursor': None } )
+    assert set( res.keys() ) == { 'cursor', 'transients' }
+    assert len( res['transients'] ) == 14
+    cursor0 = res['cursor']
+
+    res = fastdb_client.post( '/ltcv/gethottransients',
+                              json={ 'processing_version': procver.description,
+                                     'mjd_now': 60328.,
+                                     'since_cursor': cursor0 } )
+    assert res['transients'] == []
+    assert res['cursor'] == cursor0
+
+    batch = None
+    try:
+        with db.DB() as con:
+            cursor = con.cursor()
+            cursor.execute( "SELECT rootid, diaobjectid FROM diaobject_root_map WHERE processing_version=%(pv)s",
+                            { 'pv': procver.id } )
+            rootobj = { str(row[0]): row[1] for row in cursor.fetchall() }
+            batch = db.IngestBatch.new( con, description='test' )
+            db.DiaObjectDetStats.recompute( procver.id, diaobjectids=list( rootobj.values() ), ingest_batch=batch,
+                                            dbcon=con, commit=False )
+            con.commit()
+
+        res = fastdb_client.post( '/ltcv/gethottransients',
+                                  json={ 'processing_version': procver.description,
+                                         'mjd_now': 60328.,
+                                         'return_format': 2,
+                                         'since_cursor': cursor0 } )
+        assert res['cursor'] == str( batch )
+        assert len( res['transients']['objectid'] ) == 14
+        assert set( res['transients']['objectid'] ) <= set( rootobj.keys() )
+
+        res = fastdb_client.post( '/ltcv/gethottransients',
+                                  json={ 'processing_version': procver.description,
+                                         'mjd_now': 60328.,
+                                         'since_cursor': res['cursor'] } )
+        assert res['transients'] == []
+
+        # With a binary table, the cursor comes back in a header
+        res = fastdb_client.post( '/ltcv/gethottransients',
+                                  json={ 'processing_version': procver.description,
+                                         'mjd_now': 60328.,
+                                         'return_format': 'arrow',
+                                         'since_cursor': cursor0 }, return_format='raw' )
+        assert res.headers['FASTDB-Cursor'] == str( batch )
+        df = pyarrow.ipc.open_stream( res.content ).read_pandas()
+        assert df.rootid.nunique() == 14
+        assert set( df.rootid ) <= set( rootobj.keys() )
+
+        orig_retries = fastdb_client.retries
+        try:
+            fastdb_client.retries = 0
+            with pytest.raises( RuntimeError, match='Got status 500 trying to connect' ):
+                fastdb_client.post( '/ltcv/gethottransients',
+                                    json={ 'processing_version': procver.description,
+                                           'since_cursor': 'foo' } )
+        finally:
+            fastdb_client.retries = orig_retries
+
+    finally:
+        if batch is not None:
+            with db.DB() as con:
+                cursor = con.cursor()
+                cursor.execute( "DELETE FROM ingest_batch WHERE id=%(id)s", { 'id': batch } )
+                con.commit()
+
+
+def test_gethottransients_stream( test_user, fastdb_client, procver, alerts_90days_sent_received_and_imported ):
+    params = { 'processing_version': procver.description,
+               'detected_since_mjd': 60325.,
+               'mjd_now': 60328.,
+               'source_patch': True }
+    for return_format in ( 0, 1 ):
+        whole = fastdb_client.post( '/ltcv/gethottransients', json={ **params, 'return_format': return_format } )
+        streamed = list( fastdb_client.post_stream( '/ltcv/gethottransients',
+                                                    json={ **params, 'return_format': return_format,
+                                                           'stream': True, 'objects_per_chunk': 3 } ) )
+        assert len( streamed ) == 4
+        assert ( sorted( streamed, key=lambda t: t['objectid'] ) ==
+                 sorted( whole, key=lambda t: t['objectid'] ) )
+
+    batches = list( fastdb_client.post_stream( '/ltcv/gethottransients',
+                                               json={ **params, 'stream': True, 'objects_per_chunk': 3 },
+                                               return_format='pandas' ) )
+    assert len( batches ) == 2
+    df = pandas.concat( batches )
+    assert df.rootid.nunique() == 4
+    assert len( df ) == 91
+    assert df.is_source.sum() == 3
+
+    # The cursor comes back in a header
+    res = fastdb_client.post( '/ltcv/gethottransients',
+                              json={ **params, 'stream': True, 'since_cursor': None }, return_format='raw' )
+    assert res.headers['Content-Type'] == 'application/x-ndjson'
+    assert res.headers['FASTDB-Cursor'] == str( db.IngestBatch.latest() )
+
+    orig_retries = fastdb_client.retries
+    try:
+        fastdb_client.retries = 0
+        with pytest.raises( RuntimeError, match='Got status 500 trying to connect' ):
+            fastdb_client.post( '/ltcv/gethottransients', json={ **params, 'stream': True, 'return_format': 2 } )
+    finally:
+        fastdb_client.retries = orig_retries
+
+
+def test_getltcvs( test_user, fastdb_client, procver, alerts_90days_sent_received_and_imported ):
+    with db.DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SELECT diaobjectid FROM diaobject WHERE processing_version=%(pv)s "
+                        "ORDER BY diaobjectid LIMIT 3", { 'pv': procver.id } )
+        objids = [ row[0] for row in cursor.fetchall() ]
+    # Throw in an object that doesn't exist
+    objids.append( 1 )
+
+    res = fastdb_client.post( f'/ltcv/getltcvs/{procver.description}', json={ 'diaobjectids': objids } )
+    assert res['status'] == 'ok'
+    ltcvs = res['ltcvs']
+    assert ltcvs == ltcv.object_ltcvs( procver.id, objids )
+    assert ltcvs['diaobjectid'] == sorted( objids )
+    assert ltcvs['offset'][0] == ltcvs['offset'][1]
+    assert ltcvs['offset'][-1] == len( ltcvs['mjd'] ) > 0
+
+    res = fastdb_client.post( '/ltcv/getltcvs', json={ 'processing_version': procver.description,
+                                                       'diaobjectids': objids,
+                                                       'which': 'forced',
+                                                       'bands': [ 'r', 'i' ] } )
+    assert res['ltcvs'] == ltcv.object_ltcvs( procver.id, objids, which='forced', bands=[ 'r', 'i' ] )
+    assert set( res['ltcvs']['band'] ) == { 'r', 'i' }
+
+    # Get it as a table instead of JSON
+    expected = ltcv.object_ltcvs( procver.id, objids, return_format='pandas' )
+    for return_format in [ 'arrow', 'pandas', 'numpy' ]:
+        res = fastdb_client.post( f'/ltcv/getltcvs/{procver.description}', json={ 'diaobjectids': objids },
+                                  return_format=return_format )
+        df = pandas.DataFrame( res.to_pandas() if return_format == 'arrow' else res )
+        assert list( df.columns ) == list( expected.columns )
+        for col in expected.columns:
+            assert np.all( df[col].values == expected[col].values )
+    res = fastdb_client.post( f'/ltcv/getltcvs/{procver.description}',
+                              json={ 'diaobjectids': objids, 'return_format': 'npz' }, return_format='raw' )
+    assert res.headers['Content-Type'] == 'application/x-npz'
+
+    res = fastdb_client.post( f'/ltcv/getltcv/{procver.description}/{objids[0]}', json={ 'which': 'forced' },
+                              return_format='pandas' )
+    assert res.equals( ltcv.object_ltcv( procver.id, objids[0], which='forced', return_format='pandas' ) )
+
+
+def _old_hot_transients_json( df, hostdf, return_format ):
+    # What GetHotTransients used to do (return formats 0 and 1), for comparison
+    bands = [ 'u', 'g', 'r', 'i', 'z', 'y' ]
+    sne = []
+    objids = df['rootid'].unique()
+    df = df.set_index( [ 'rootid', 'sourceid' ] )
+    if hostdf is not None:
+        hostdf = hostdf.set_index( 'rootid' )
+    for objid in objids:
+        subdf = df.xs( objid, level='rootid' )
+        toadd = { 'objectid': str(objid), 'ra': subdf.ra.values[0], 'dec': subdf.dec.values[0],
+                  'zp': 31.4, 'redshift': -99., 'sncode': -99 }
+        if hostdf is not None:
+            subhostdf = hostdf.xs( objid )
+            toadd[ 'hostgal_petroflux_r' ] = subhostdf.petroflux_r
+            toadd[ 'hostgal_petroflux_r_err' ] = subhostdf.petroflux_r_err
+            toadd[ 'hostgal_snsep' ] = subhostdf.nearbyextobj1sep
+            toadd[ 'hostgal_pzmean' ] = subhostdf.pzmean
+            toadd[ 'hostgal_pzstd' ] = subhostdf.pzstd
+            for bandi in range( len(bands)-1 ):
+                toadd[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}' ] = (
+                    subhostdf[ f'stdcolor_{bands[bandi]}_{bands[bandi+1]}' ] )
+                toadd[ f'hostgal_stdcolor_{bands[bandi]}_{bands[bandi+1]}_err' ] = (
+                    subhostdf[ f'stdcolor_{bands[bandi]}_{bands[bandi+1]}_err' ] )
+        phot = { 'mjd': list( subdf['midpointmjdtai'] ),
+                 'band': list( subdf['band'] ),
+                 'flux': list( subdf['psfflux'] ),
+                 'fluxerr': list( subdf['psffluxerr'] ),
+                 'is_source': list( subdf['is_source'] ) }
+        if return_format == 0:
+            toadd['photometry'] = phot
+        else:
+            toadd.update( phot )
+        sne.append( toadd )
+    return sne
+
+
+def _fake_hot_ltcvs( rng, nobj, npts ):
+    rootids = np.array( [ uuid.UUID( int=int(i) ) for i in rng.integers( 0, 2**62, nobj ) ], dtype=object )
+    objindex = np.repeat( np.arange( nobj ), npts )
+    n = len( objindex )
+    df = pandas.DataFrame( { 'rootid': rootids[ objindex ],
+                             'ra': rng.uniform( 0., 360., nobj )[ objindex ],
+                             'dec': rng.uniform( -90., 0., nobj )[ objindex ],
+                             'sourceid': np.arange( n, dtype=np.int64 ),
+                             'visit': np.arange( n, dtype=np.int64 ),
+                             'detector': np.zeros( n, dtype=np.int16 ),
+                             'midpointmjdtai': 60000. + rng.uniform( 0., 30., n ),
+                             'band': rng.choice( [ 'u', 'g', 'r', 'i', 'z', 'y' ], n ),
+                             'psfflux': rng.normal( size=n ),
+                             'psffluxerr': np.ones( n ),
+                             'is_source': rng.random( n ) < 0.1 } )
+    hostdf = pandas.DataFrame( { 'rootid': rootids } )
+    for b0, b1 in zip( 'ugriz', 'grizy' ):
+        hostdf[ f'stdcolor_{b0}_{b1}' ] = rng.normal( size=nobj )
+        hostdf[ f'stdcolor_{b0}_{b1}_err' ] = rng.uniform( size=nobj )
+    for col in [ 'petroflux_r', 'petroflux_r_err', 'nearbyextobj1sep', 'pzmean', 'pzstd' ]:
+        hostdf[ col ] = rng.uniform( size=nobj )
+    return df, hostdf
+
+
+def test_hot_transients_json():
+    rng = np.random.default_rng( 64738 )
+    df, hostdf = _fake_hot_ltcvs( rng, 20, rng.integers( 1, 12, 20 ) )
+
+    for return_format in [ 0, 1 ]:
+        assert hot_transients_json( df, hostdf, return_format ) == _old_hot_transients_json( df, hostdf,
+                                                                                            return_format )
+        assert hot_transients_json( df, None, return_format ) == _old_hot_transients_json( df, None, return_format )
+
+    # Return format 2 should be return format 1 turned inside out
+    rows = hot_transients_json( df, hostdf, 1 )
+    cols = hot_transients_json( df, hostdf, 2 )
+    assert set( cols.keys() ) == set( rows[0].keys() )
+    for key, vals in cols.items():
+        assert vals == [ r[key] for r in rows ]
+
+    # Objects don't have to be together in the data frame, and don't have to have a host
+    shuffled = df.sample( frac=1, random_state=42 ).reset_index( drop=True )
+    res = hot_transients_json( shuffled, hostdf.iloc[1:], 0 )
+    assert [ r['objectid'] for r in res ] == [ str(o) for o in shuffled.rootid.unique() ]
+    for r in res:
+        sub = shuffled[ shuffled.rootid == uuid.UUID( r['objectid'] ) ]
+        assert r['photometry']['mjd'] == list( sub.midpointmjdtai )
+        assert r['photometry']['is_source'] == list( sub.is_source )
+        if r['objectid'] == str( hostdf.rootid[0] ):
+            assert r['hostgal_pzmean'] is None
+        else:
+            assert r['hostgal_pzmean'] == hostdf[ hostdf.rootid == sub.rootid.values[0] ].pzmean.values[0]
+
+    empty = df.iloc[0:0]
+    assert hot_transients_json( empty, None, 0 ) == []
+    assert hot_transients_json( empty, hostdf.iloc[0:0], 2 )['objectid'] == []
+
+    with pytest.raises( ValueError, match="Unknown return_format 3" ):
+        hot_transients_json( df, None, 3 )
+
+
+@pytest.mark.skipif( os.getenv( 'FASTDB_BENCHMARK' ) is None, reason="FASTDB_BENCHMARK not set" )
+def test_hot_transients_json_benchmark():
+    # The old way (df.xs for each object) is too slow to do for all 50000
+    #   objects, so just time it for the first 1000.
+    rng = np.random.default_rng( 42 )
+    nobj = 50000
+    df, hostdf = _fake_hot_ltcvs( rng, nobj, 20 )
+
+    t0 = time.perf_counter()
+    res = hot_transients_json( df, hostdf, 0 )
+    t1 = time.perf_counter()
+    oldres = []
+    indexed = df.set_index( [ 'rootid', 'sourceid' ] )
+    for objid in df.rootid.unique()[:1000]:
+        oldres.append( list( indexed.xs( objid, level='rootid' )['psfflux'] ) )
+    t2 = time.perf_counter()
+
+    util.logger.info( f"Serializing {len(df)} points of {nobj} objects: {t1-t0:.2f} s; "
+                      f"old way, ~{(t2-t1)*nobj/1000:.0f} s (extrapolated from 1000 objects)" )
+    assert len( res ) == nobj
+    assert [ r['photometry']['flux'] for r in res[:1000] ] == oldres
@@ -1,5 +1,10 @@
+import io
+
 import pytest
+import numpy as np
+
 import db
+import ltcv
 
 
 # Include the procver fixture since it's a session scoped fixture,
@@ -79,3 +84,36 @@ def test_procver( server_test_processing_versions, test_user, fastdb_client ):
             res = fastdb_client.post( '/procver/does_not_exist' )
     finally:
         fastdb_client.retries = orig_retries
+
+
+def test_crossmatch( test_user, fastdb_client, procver, alerts_90days_sent_received_and_imported ):
+    with db.DB() as con:
+        cursor = con.cursor()
+        cursor.execute( "SELECT ra, dec FROM diaobject WHERE processing_version=%(pv)s ORDER BY diaobjectid LIMIT 5",
+                        { 'pv': procver.id } )
+        rows = cursor.fetchall()
+    ra = [ r[0] + 0.5/3600. for r in rows ]
+    dec = [ r[1] for r in rows ]
+    expected = ltcv.crossmatch( procver.id, ra, dec, radius=2., nearest=True )
+    assert expected['posindex'] == [ 0, 1, 2, 3, 4 ]
+
+    res = fastdb_client.post( f'/crossmatch/{procver.description}',
+                              json={ 'ra': ra, 'dec': dec, 'radius': 2., 'nearest': True } )
+    assert res['status'] == 'ok'
+    assert res['matches'] == expected
+
+    # Uploads have to go straight through the client's requests session
+    fastdb_client.verify_logged_in()
+    url = f'{fastdb_client.url}/crossmatch/{procver.description}?radius=2&nearest=1'
+    csv = "ra,dec\n" + "".join( f"{r!r},{d!r}\n" for r, d in zip( ra, dec ) )
+    npz = io.BytesIO()
+    np.savez( npz, ra=np.array( ra ), dec=np.array( dec ) )
+    for body, mimetype in [ ( csv, 'text/csv' ), ( npz.getvalue(), 'application/octet-stream' ) ]:
+        res = fastdb_client.req.post( url, data=body, headers={ 'Content-Type': mimetype },
+                                      verify=fastdb_client.verify )
+        assert res.status_code == 200
+        assert res.json()['matches'] == expected
+
+    res = fastdb_client.req.post( url, data="ra,dec\n", headers={ 'Content-Type': 'text/plain' },
+                                  verify=fastdb_client.verify )
+    assert res.status_code == 500